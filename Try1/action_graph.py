@@ -0,0 +1,85 @@
+# action_graph.py
+"""
+Turning one parsed action into a laid-out, exported graph: the steps shared
+by the Flask endpoints and the layout job workers (see jobs.py), kept free
+of any Flask dependency so worker processes can import them.
+"""
+import json
+from nodes import build_tree_from_json, layout_graph, extend_extents, Start, End, Atomic, NodeIds, ActionInstance
+from export_graph import export_graph_json, collapse_graph, columnar_graph, encode_binary_graph
+from instrumentation import stage, record_counts
+
+# Wire formats: one dict per node, columnar JSON, columnar binary
+GRAPH_FORMATS = ("rows", "columnar", "binary")
+
+def pick_root_action(actions, action_name=None):
+    # Requested action, else "test", else the first one; None if there are none
+    if action_name and action_name in actions:
+        return actions[action_name]
+    return actions.get("test") or (next(iter(actions.values()), None))
+
+def action_summaries(actions):
+    # Gallery entries for all actions (compound and atomic)
+    action_list = []
+    for name, act in actions.items():
+        act_type = act.get("type", "atomic")
+        has_activity = bool(act.get("children"))
+        action_list.append({"name": name, "type": act_type, "has_activity": has_activity})
+    return action_list
+
+def layout_action_graph(root_action, actions, shared=False, ids=None, unroll=False):
+    """Builds and lays out root_action between Start/End nodes and exports it."""
+    start_node, extents = build_action_graph(root_action, actions, shared, ids, unroll)
+    with stage("export"):
+        graph = export_graph_json(start_node, extents)
+    parts = [graph] + list(graph.get("templates", {}).values())
+    record_counts(sum(len(p["nodes"]) for p in parts), sum(len(p["edges"]) for p in parts))
+    return graph
+
+def build_action_graph(root_action, actions, shared=False, ids=None, unroll=False):
+    """
+    Builds and lays out root_action between Start/End nodes; returns (start node, extents).
+    Node ids are dense from 0 per graph, taken from ids or a new NodeIds.
+    unroll: repeat(n) as n iterations of one shared body (see nodes.RepeatIterations).
+    """
+    with ids or NodeIds():
+        return _build_action_graph(root_action, actions, shared, unroll)
+
+def _build_action_graph(root_action, actions, shared, unroll):
+    with stage("build"):
+        root_node = build_tree_from_json(root_action, actions, templates={} if shared else None,
+                                         unroll=unroll)
+    start_node = Start("Start")
+    start_node.add_child(root_node)
+    with stage("layout"):
+        last_node, _, _, extents = layout_graph(root_node, start_node.gx, start_node.gy + 1)
+    start_node.edges.append((start_node, root_node))
+    extents = extend_extents(extents, start_node)
+    # Only add End node if root is not atomic and has children (a shared
+    # ActionInstance root has them in its template)
+    if not isinstance(root_node, Atomic) and (root_node.children or isinstance(root_node, ActionInstance)):
+        end_node = End("End")
+        end_node.gx = last_node.gx
+        end_node.gy = last_node.gy + 1
+        if isinstance(last_node, ActionInstance):
+            # Below the template's exit node, laid out relative to the instance
+            exit_node = last_node.template.exit
+            end_node.gx += exit_node.gx
+            end_node.gy += exit_node.gy
+        last_node.edges.append((last_node, end_node))
+        extents = extend_extents(extents, end_node)
+    return start_node, extents
+
+def serialize_graph(graph, collapsed=False, fmt="rows"):
+    """
+    Body bytes of an exported graph in one of GRAPH_FORMATS.
+    collapsed: drop the templates of a shared graph (see export_graph.collapse_graph).
+    """
+    with stage("serialize"):
+        if collapsed:
+            graph = collapse_graph(graph)
+        if fmt != "rows":
+            graph = columnar_graph(graph)
+        if fmt == "binary":
+            return encode_binary_graph(graph)
+        return json.dumps(graph, separators=(",", ":")).encode("utf-8")
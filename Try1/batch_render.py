@@ -0,0 +1,204 @@
+# batch_render.py
+"""
+Headless batch rendering of every action in a set of PSS files.
+
+Each action with an activity is built, laid out and written as PNG (pygame
+with the dummy video driver, see visualization.render_static_layer) and/or
+SVG (svg_render.render_svg, no pygame needed) to
+OUT/<file path relative to its input>/<action>.<format>; a file given
+directly uses its name without the suffix. When two inputs map to the same
+directory, the later one gets a "-2", "-3", ... suffix.
+
+Work runs in a process pool: one task per file lists its actions, then the
+actions are rendered in chunks of ACTIONS_PER_TASK. Each worker keeps the
+files it parsed in an LRU cache keyed by path, size and mtime, so a file is
+parsed at most once per worker. At the end the run reports throughput and
+every failed file or action.
+
+Usage: python batch_render.py PATH... [--out DIR] [--format png,svg]
+                              [--workers N] [--actions a,b] [--cell-size PX]
+Exits with status 1 if any file or action failed.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from my_parser import parse_pss_file
+from nodes import iter_nodes_edges
+from action_graph import build_action_graph
+from graph_cache import LRUCache
+
+FORMATS = ("png", "svg")
+CELL_SIZE = 40
+MARGIN = 80
+ACTIONS_PER_TASK = 8
+PARSE_CACHE_FILES = 8
+
+_parsed = LRUCache(PARSE_CACHE_FILES)  # (path, size, mtime) -> actions, per worker
+
+
+def _init_worker():
+    # PNG rendering needs a display for Surface.convert(); the dummy one draws nowhere
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+
+def parsed_actions(path):
+    st = os.stat(path)
+    return _parsed.get_or_create((path, st.st_size, st.st_mtime_ns),
+                                 lambda: parse_pss_file(path)["actions"])
+
+
+def list_actions(path, names=None):
+    """Names of the actions with an activity in the file (restricted to names if given)."""
+    actions = parsed_actions(path)
+    return [name for name, action in actions.items()
+            if action.get("children") and (names is None or name in names)]
+
+
+def input_files(paths):
+    """
+    (file, output subdirectory) for each file argument and each *.pss file
+    under a directory argument. A file reached twice is listed once, and
+    subdirectories are made unique (a.pss given from two directories goes
+    to "a" and "a-2").
+    """
+    files = []
+    seen, used = set(), set()
+    for arg in paths:
+        path = Path(arg)
+        if path.is_dir():
+            found = [(f, f.relative_to(path).with_suffix("")) for f in sorted(path.rglob("*.pss"))]
+        else:
+            found = [(path, Path(path.stem))]
+        for f, subdir in found:
+            if f.resolve() in seen:
+                continue
+            seen.add(f.resolve())
+            unique, k = subdir, 1
+            while unique in used:
+                k += 1
+                unique = subdir.with_name(f"{subdir.name}-{k}")
+            used.add(unique)
+            files.append((str(f), unique))
+    return files
+
+
+def render_actions(path, names, out_dir, formats, cell_size=CELL_SIZE):
+    """
+    Renders the named actions of the file into out_dir; returns one
+    (name, node count, error message or None) per action.
+    """
+    actions = parsed_actions(path)
+    os.makedirs(out_dir, exist_ok=True)
+    results = []
+    for name in names:
+        try:
+            start_node, extents = build_action_graph(actions[name], actions)
+            nodes, edges = [], []
+            for kind, item in iter_nodes_edges(start_node):
+                (edges if kind == "edge" else nodes).append(item)
+            bounds = tuple(extents)
+            base = os.path.join(out_dir, name)
+            if "png" in formats:
+                _save_png(nodes, edges, bounds, cell_size, base + ".png")
+            if "svg" in formats:
+                from svg_render import render_svg
+                with open(base + ".svg", "w", encoding="utf-8") as f:
+                    f.write(render_svg(nodes, edges, bounds, cell_size, MARGIN))
+            results.append((name, len(nodes), None))
+        except Exception as e:
+            results.append((name, 0, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def _save_png(nodes, edges, bounds, cell_size, file_path):
+    import pygame
+    from visualization import GridIndex, render_static_layer, layer_size, MAX_LAYER_PIXELS
+    if not pygame.display.get_surface():
+        pygame.display.init()
+        pygame.display.set_mode((1, 1))
+    index = GridIndex(nodes, edges)
+    # Zoom out until the image fits in MAX_LAYER_PIXELS
+    width, height = layer_size(bounds, cell_size, MARGIN, 1.0)
+    zoom = min(1.0, (MAX_LAYER_PIXELS / (width * height)) ** 0.5)
+    layer = render_static_layer(index, bounds, cell_size, MARGIN, zoom)
+    while layer is None:
+        zoom *= 0.9
+        layer = render_static_layer(index, bounds, cell_size, MARGIN, zoom)
+    pygame.image.save(layer, file_path)
+
+
+def run(files, out, formats, workers=None, names=None, cell_size=CELL_SIZE, log=print):
+    """
+    Renders all actions of files ((path, output subdirectory) pairs) into out.
+    Returns {"files", "actions", "nodes", "seconds", "failures": [(file, action or None, message)]}.
+    """
+    report = {"files": len(files), "actions": 0, "nodes": 0, "seconds": 0.0, "failures": []}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+        # future -> (path, output subdirectory) of a listing, or (path, None) of a render
+        pending = {pool.submit(list_actions, path, names): (path, sub) for path, sub in files}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, sub = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    report["failures"].append((path, None, f"{type(e).__name__}: {e}"))
+                    log(f"FAILED {path}: {e}")
+                    continue
+                if sub is not None:
+                    out_dir = os.path.join(out, sub)
+                    for i in range(0, len(result), ACTIONS_PER_TASK):
+                        task = pool.submit(render_actions, path, result[i:i + ACTIONS_PER_TASK],
+                                           out_dir, formats, cell_size)
+                        pending[task] = (path, None)
+                    continue
+                for name, node_count, error in result:
+                    if error:
+                        report["failures"].append((path, name, error))
+                        log(f"FAILED {path} {name}: {error}")
+                    else:
+                        report["actions"] += 1
+                        report["nodes"] += node_count
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("paths", nargs="+", help="PSS files or directories of *.pss files")
+    parser.add_argument("--out", default="renders")
+    parser.add_argument("--format", default="png", help="comma-separated, of " + ", ".join(FORMATS))
+    parser.add_argument("--workers", type=int, help="processes (default: one per CPU)")
+    parser.add_argument("--actions", help="comma-separated action names (default: all with an activity)")
+    parser.add_argument("--cell-size", type=int, default=CELL_SIZE)
+    args = parser.parse_args(argv)
+
+    formats = tuple(f.strip() for f in args.format.split(",") if f.strip())
+    unknown = [f for f in formats if f not in FORMATS]
+    if unknown or not formats:
+        parser.error(f"Unknown format {unknown}, expected some of {FORMATS}.")
+    names = set(args.actions.split(",")) if args.actions else None
+    files = input_files(args.paths)
+    if not files:
+        parser.error("No PSS files found.")
+
+    report = run(files, args.out, formats, args.workers, names, args.cell_size)
+    seconds = report["seconds"]
+    print(f"{report['actions']} actions ({report['nodes']} nodes) from {report['files']} files "
+          f"in {seconds:.2f} s: {report['actions'] / seconds:.1f} actions/s, "
+          f"{report['nodes'] / seconds:.0f} nodes/s")
+    if report["failures"]:
+        print(f"{len(report['failures'])} failures:")
+        for path, name, message in report["failures"]:
+            print(f"  {path}" + (f" {name}" if name else "") + f": {message}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+# bench_layout.py
+"""
+Regression benchmark: layout time on a deeply nested fork tree must grow
+linearly with node count. Each level is a Parallel (or Select) holding one
+Atomic and the next level, so every fork asks for the width of everything
+below it.
+
+Usage: python bench_layout.py [max_depth]
+Exits with status 1 if time per node grows more than MAX_SLOWDOWN times
+between the smallest and the largest tree.
+"""
+import sys
+import time
+from nodes import Atomic, Parallel, Select
+
+MAX_SLOWDOWN = 3.0
+REPEATS = 5
+
+
+def build_nested_forks(depth):
+    root = None
+    for level in range(depth):
+        fork = Parallel(f"P{level}") if level % 2 else Select(f"S{level}")
+        fork.add_child(Atomic(f"A{level}"))
+        if root is not None:
+            fork.add_child(root)
+        root = fork
+    return root
+
+
+def time_layout(depth):
+    best = None
+    for _ in range(REPEATS):
+        root = build_nested_forks(depth)
+        start = time.perf_counter()
+        root.layout(0, 0)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(max_depth=800):
+    depths = [max_depth // 8, max_depth // 4, max_depth // 2, max_depth]
+    per_node = []
+    print(f"{'depth':>8} {'nodes':>8} {'layout ms':>10} {'us/node':>8}")
+    for depth in depths:
+        elapsed = time_layout(depth)
+        node_count = 3 * depth  # fork, its merge and one atomic per level
+        per_node.append(elapsed / node_count)
+        print(f"{depth:>8} {node_count:>8} {elapsed * 1000:>10.2f} {per_node[-1] * 1e6:>8.2f}")
+    slowdown = per_node[-1] / per_node[0]
+    print(f"time per node grew {slowdown:.2f}x (limit {MAX_SLOWDOWN}x)")
+    return 0 if slowdown <= MAX_SLOWDOWN else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(*(int(a) for a in sys.argv[1:])))
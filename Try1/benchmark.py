@@ -0,0 +1,167 @@
+# benchmark.py
+"""
+Pipeline benchmark on synthetic workloads (see pss_workload.PRESETS).
+
+For each workload, times parse_activity_text, build_tree_from_json,
+layout_graph, collect_nodes_edges, export_graph_json and the /parse endpoint
+through Flask's test client (cold: caches cleared first, warm: cached), as
+the best and mean of --repeats runs. One more run per stage under
+tracemalloc records its peak traced memory. Results are written as JSON so
+two runs can be compared with --compare.
+
+Usage: python benchmark.py [--out FILE] [--repeats N] [--workloads a,b]
+                           [--compare BASELINE] [--max-slowdown X]
+Exits with status 1 if --max-slowdown is given and a stage's best time
+grew by more than that factor over the baseline.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from nodes import build_tree_from_json, layout_graph, collect_nodes_edges, NodeIds
+from export_graph import export_graph_json
+from my_parser import parse_activity_text
+from pss_workload import generate_pss, PRESETS
+
+REPEATS = 5
+
+
+def measure(setup, run, repeats=REPEATS):
+    """Best and mean seconds of run(setup()) over repeats, and its peak traced bytes."""
+    times = []
+    for _ in range(repeats):
+        arg = setup()
+        start = time.perf_counter()
+        run(arg)
+        times.append(time.perf_counter() - start)
+    arg = setup()
+    tracemalloc.start()
+    run(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"best_s": min(times), "mean_s": sum(times) / len(times), "peak_bytes": peak}
+
+
+def build(actions):
+    with NodeIds():
+        return build_tree_from_json(actions["test"], actions)
+
+
+def laid_out(actions):
+    root = build(actions)
+    return root, layout_graph(root).extents
+
+
+def bench_workload(text, repeats=REPEATS):
+    actions = parse_activity_text(text)["actions"]
+    nodes, edges = collect_nodes_edges(laid_out(actions)[0])
+    result = {
+        "source_bytes": len(text),
+        "actions": len(actions),
+        "nodes": len(nodes),
+        "edges": len(edges),
+        "stages": {
+            "parse": measure(lambda: text, parse_activity_text, repeats),
+            "build": measure(lambda: actions, build, repeats),
+            "layout": measure(lambda: build(actions), layout_graph, repeats),
+            "collect": measure(lambda: laid_out(actions)[0], collect_nodes_edges, repeats),
+            "export": measure(lambda: laid_out(actions), lambda a: export_graph_json(*a), repeats),
+        },
+    }
+    result["stages"].update(bench_endpoint(text, repeats))
+    return result
+
+
+def bench_endpoint(text, repeats=REPEATS):
+    # /parse through the Flask test client; skipped when Flask is not installed
+    try:
+        import flask_server
+    except ImportError:
+        return {}
+    client = flask_server.app.test_client()
+    caches = (flask_server.parse_cache, flask_server.graph_cache, flask_server.json_cache,
+              flask_server.incremental_parser.blocks)
+
+    def post(_):
+        response = client.post("/parse", json={"text": text, "action": "test"})
+        response.get_data()  # drain a streamed body
+        assert response.status_code == 200, response.status_code
+
+    def cold():
+        for cache in caches:
+            cache.clear()
+
+    post(None)
+    return {
+        "endpoint_cold": measure(cold, post, repeats),
+        "endpoint_warm": measure(lambda: None, post, repeats),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare(results, baseline):
+    """Prints per-stage best-time ratios against a baseline; returns the largest ratio."""
+    worst = 0.0
+    print(f"{'workload':>10} {'stage':>14} {'baseline ms':>12} {'now ms':>10} {'ratio':>7}")
+    for name, workload in results["workloads"].items():
+        old = baseline["workloads"].get(name)
+        if old is None:
+            continue
+        for stage, now in workload["stages"].items():
+            before = old["stages"].get(stage)
+            if before is None:
+                continue
+            ratio = now["best_s"] / before["best_s"] if before["best_s"] else float("inf")
+            worst = max(worst, ratio)
+            print(f"{name:>10} {stage:>14} {before['best_s'] * 1000:>12.2f} "
+                  f"{now['best_s'] * 1000:>10.2f} {ratio:>7.2f}")
+    return worst
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--workloads", default=",".join(PRESETS))
+    parser.add_argument("--compare")
+    parser.add_argument("--max-slowdown", type=float)
+    args = parser.parse_args(argv)
+
+    results = {"environment": environment(), "repeats": args.repeats, "workloads": {}}
+    print(f"{'workload':>10} {'nodes':>8} {'stage':>14} {'best ms':>10} {'peak KB':>10}")
+    for name in args.workloads.split(","):
+        params = PRESETS[name]
+        workload = bench_workload(generate_pss(**params), args.repeats)
+        workload["params"] = params
+        results["workloads"][name] = workload
+        for stage, m in workload["stages"].items():
+            print(f"{name:>10} {workload['nodes']:>8} {stage:>14} "
+                  f"{m['best_s'] * 1000:>10.2f} {m['peak_bytes'] / 1024:>10.0f}")
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            worst = compare(results, json.load(f))
+        if args.max_slowdown is not None and worst > args.max_slowdown:
+            print(f"slowest stage grew {worst:.2f}x (limit {args.max_slowdown}x)")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+# check_shared_export.py
+"""
+Regression check: a shared export (action_graph.layout_action_graph with
+shared=True), with every ActionInstance replaced by its template shifted to
+the instance position, must draw the same nodes and edges as the expanded
+export of the same action. Nodes are compared by name, type, position and
+bbox and edges by their end positions, since ids differ between the two.
+
+Checks a few fixed cases (among them an action whose activity is a single
+compound reference, which is an ActionInstance root in the shared build)
+and every action of some pss_workload documents.
+
+Usage: python check_shared_export.py [seeds]
+Exits with status 1 if any action differs.
+"""
+import sys
+from collections import Counter
+from my_parser import parse_activity_text
+from action_graph import layout_action_graph
+from pss_workload import generate_pss
+
+CASES = [
+    """
+    action A {} action B {}
+    action Sub { activity { A; B; } }
+    action test { activity { Sub; } }
+    """,
+    """
+    action A {} action B {} action C {}
+    action Sub { activity { parallel { A; B; } } }
+    action Top { activity { Sub; C; } }
+    action test { activity { Top; } }
+    """,
+    """
+    action A {} action B {}
+    action Sub { activity { select { A; B; } } }
+    action test { activity { repeat(3) { Sub; } A; Sub; } }
+    """,
+]
+
+
+def drawn(graph):
+    """(Counter of nodes, Counter of edges) as drawn, with templates placed at their instances."""
+    templates = graph.get("templates", {})
+    nodes, edges = Counter(), Counter()
+
+    def place(section, dx, dy):
+        # Positions of the section's nodes, instances resolved to their template entry and exit
+        ends = {}
+        for n in section["nodes"]:
+            if n["type"] == "actioninstance":
+                t = templates[n["template"]]
+                inner = place(t, dx + n["gx"], dy + n["gy"])
+                ends[n["id"]] = (inner[t["entry"]][0], inner[t["exit"]][1])
+                continue
+            pos = (n["gx"] + dx, n["gy"] + dy)
+            ends[n["id"]] = (pos, pos)
+            bbox = n.get("bbox")
+            if bbox:
+                bbox = (bbox[0] + dx, bbox[1] + dx, bbox[2] + dy, bbox[3] + dy)
+            nodes[(n["name"], n["type"], pos, bbox)] += 1
+        for src, dst in section["edges"]:
+            edges[(ends[src][1], ends[dst][0])] += 1
+        return ends
+
+    place(graph, 0, 0)
+    return nodes, edges
+
+
+def check(text, label, log=print):
+    actions = parse_activity_text(text)["actions"]
+    failed = 0
+    for name, action in actions.items():
+        if not action.get("children"):
+            continue
+        expanded = drawn(layout_action_graph(action, actions))
+        shared = drawn(layout_action_graph(action, actions, shared=True))
+        for kind, a, b in zip(("nodes", "edges"), expanded, shared):
+            if a != b:
+                failed += 1
+                log(f"FAILED {label} {name}: {kind} only expanded {list((a - b).elements())[:3]}, "
+                    f"only shared {list((b - a).elements())[:3]}")
+    return failed
+
+
+def main(seeds=10):
+    failed = sum(check(text, f"case {i}") for i, text in enumerate(CASES))
+    for seed in range(seeds):
+        failed += check(generate_pss(levels=2, actions_per_level=3, depth=2, fanout=2, seed=seed),
+                        f"seed {seed}")
+    print("OK" if not failed else f"{failed} differences")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10))
@@ -1,12 +1,275 @@
 import json
-from nodes import collect_nodes_edges, Node, Atomic, Start, End, Merge, Sequence, Parallel, Select, Repeat, CompoundAction
+import struct
+import sys
+from array import array
+from nodes import iter_nodes_edges, Node, Atomic, Start, End, Merge, Sequence, Parallel, Select, Repeat, CompoundAction
+from graph_store import StoreNode, TYPE_NAMES
 
-def export_graph_json(root: Node):
-    nodes, edges = collect_nodes_edges(root)
+# Node types that carry a bbox in the export (type string must be lowercase)
+BBOX_TYPES = ("parallel", "select", "repeat", "sequence", "compoundaction", "actioninstance",
+              "repeatiterations")
+# Node types that reference a template: shared actions and unrolled repeat bodies
+TEMPLATE_TYPES = ("actioninstance", "repeatiterations")
+
+def export_graph_json(root: Node, extents=None):
+    """
+    Exports the graph reachable from root as {"nodes", "edges"}.
+    If it contains ActionInstance nodes, each shared template is exported
+    once under "templates" (laid out at the origin, with its entry and exit
+    node ids and height) and instances only carry their template name and
+    position. Unrolled repeats (see nodes.RepeatIterations) work the same
+    way: the body is a template and the iterations node carries its name
+    and "times"; iteration k is the body shifted down by k * height.
+    root may also be a graph_store.StoreNode; the store's arrays are then
+    exported directly. extents, as returned by nodes.layout_graph(), is
+    passed through so clients need not rescan the nodes for bounds.
+    """
+    if isinstance(root, StoreNode):
+        graph = _export_store(root.store, root.index)
+        if extents is not None:
+            graph["extents"] = list(extents)
+        return graph
+    pending = []
+    graph = _export_nodes_edges(root, pending)
+
+    templates = {}
+    while pending:
+        template = pending.pop()
+        if template.name in templates:
+            continue
+        t_graph = _export_nodes_edges(template.root, pending)
+        t_graph["entry"] = template.root.id
+        t_graph["exit"] = template.exit.id
+        t_graph["height"] = template.height
+        templates[template.name] = t_graph
+    if templates:
+        graph["templates"] = templates
+    if extents is not None:
+        graph["extents"] = list(extents)
+    return graph
+
+def collapse_graph(graph):
+    """
+    Collapsed view of a shared export: instances stay single placeholder
+    nodes (with their bbox, so the space they need is known) and the
+    templates are left out, to be fetched one instance at a time. Repeat
+    bodies are kept, since the iterations are drawn from them.
+    """
+    collapsed = {key: value for key, value in graph.items() if key != "templates"}
+    templates = graph.get("templates", {})
+    bodies = {n["template"] for section in [graph, *templates.values()] for n in section["nodes"]
+              if n["type"] == "repeatiterations"}
+    if bodies:
+        collapsed["templates"] = {name: templates[name] for name in templates if name in bodies}
+    return collapsed
+
+def find_instance_template(graph, instance_id):
+    """
+    (template name, template graph {nodes, edges, entry, exit}) behind the
+    placeholder with path id instance_id ("<instance id>.<template node id>..."
+    as built by expanding the enclosing placeholders), or None if the shared
+    export graph has no such instance. Inside an unrolled repeat the path
+    goes "<iterations id>.<iteration>.<body node id>"; the body is shared,
+    so the iteration does not matter.
+    """
+    templates = graph.get("templates", {})
+    current = graph
+    name = None
+    parts = str(instance_id).split(".")
+    k = 0
+    while k < len(parts):
+        try:
+            node_id = int(parts[k])
+        except ValueError:
+            return None
+        node = next((n for n in current["nodes"] if n["id"] == node_id), None)
+        if node is None or node["type"] not in TEMPLATE_TYPES:
+            return None
+        current = templates[node["template"]]
+        if node["type"] == "repeatiterations":
+            k += 2
+            name = None
+            continue
+        name = node["template"]
+        k += 1
+    if name is None:
+        return None
+    return name, current
+
+# Columnar wire format: per graph section (root graph and each template)
+# parallel arrays indexed by node row; edges, entry and exit use rows, not ids
+COLUMNS = ("id", "name", "type", "gx", "gy", "edges", "bbox_nodes", "bbox",
+           "instance_nodes", "instance_template", "repeat_nodes", "repeat_times")
+BINARY_MAGIC = b"PSSG"
+
+def columnar_graph(graph):
+    """
+    Columnar form of an export_graph_json() result: "id", "gx", "gy" and
+    "name"/"type" indices into the deduplicated "names"/"types" tables,
+    one flat "edges" array of (src row, dst row) pairs, bboxes as 4 values
+    per row listed in "bbox_nodes", instance template names per row in
+    "instance_nodes" and the "times" of unrolled repeats per row in
+    "repeat_nodes".
+    Templates become sections of the same shape.
+    """
+    names, name_index = [], {}
+    types, type_index = [], {}
+
+    def intern(table, index, value):
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(table)
+            table.append(value)
+        return code
+
+    def section(g):
+        columns = {key: [] for key in COLUMNS}
+        row_of = {}
+        for row, n in enumerate(g["nodes"]):
+            row_of[n["id"]] = row
+            columns["id"].append(n["id"])
+            columns["name"].append(intern(names, name_index, n["name"]))
+            columns["type"].append(intern(types, type_index, n["type"]))
+            columns["gx"].append(n["gx"])
+            columns["gy"].append(n["gy"])
+            if "bbox" in n:
+                columns["bbox_nodes"].append(row)
+                columns["bbox"].extend(n["bbox"])
+            if "template" in n:
+                columns["instance_nodes"].append(row)
+                columns["instance_template"].append(intern(names, name_index, n["template"]))
+            if "times" in n:
+                columns["repeat_nodes"].append(row)
+                columns["repeat_times"].append(n["times"])
+        columns["edges"] = [row_of[node_id] for edge in g["edges"] for node_id in edge]
+        if "entry" in g:
+            columns["entry"] = row_of[g["entry"]]
+            columns["exit"] = row_of[g["exit"]]
+            columns["height"] = g["height"]
+        return columns
+
+    result = section(graph)
+    if "templates" in graph:
+        result["templates"] = {name: section(t) for name, t in graph["templates"].items()}
+    if "extents" in graph:
+        result["extents"] = graph["extents"]
+    result["names"] = names
+    result["types"] = types
+    result["format"] = "columnar"
+    return result
+
+def encode_binary_graph(columnar):
+    """
+    Binary form of a columnar_graph() result: BINARY_MAGIC, the byte length
+    of a JSON header (uint32, little-endian), the header padded to a multiple
+    of 4 bytes, then every column of every section (root first, then the
+    templates in header order) as little-endian int32, so clients can wrap
+    them in Int32Arrays without copying. The header holds everything that
+    is not a column plus per-section column "lengths".
+    """
+    sections = [columnar] + list(columnar.get("templates", {}).values())
+    header = {key: value for key, value in columnar.items() if key not in COLUMNS and key != "templates"}
+    header["columns"] = COLUMNS
+    header["lengths"] = [len(columnar[key]) for key in COLUMNS]
+    header["templates"] = {
+        name: dict({key: value for key, value in t.items() if key not in COLUMNS},
+                   lengths=[len(t[key]) for key in COLUMNS])
+        for name, t in columnar.get("templates", {}).items()
+    }
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 4)
+    body = array('i')
+    for s in sections:
+        for key in COLUMNS:
+            body.extend(s[key])
+    if sys.byteorder == "big":
+        body.byteswap()
+    return BINARY_MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes + body.tobytes()
+
+def iter_graph_json(root: Node, extents=None, chunk_nodes=1000, counts=None):
+    """
+    Streaming counterpart of export_graph_json(): yields the same document,
+    serialized compactly, as str chunks of about chunk_nodes nodes or edges
+    while the graph is walked, instead of building the node and edge lists
+    and one string of the whole document. Edges are buffered as an int array
+    until the nodes are written.
+    counts: optional dict whose "nodes" and "edges" totals are filled in on the way.
+    """
+    if counts is not None:
+        counts.update(nodes=0, edges=0)
+    if isinstance(root, StoreNode):
+        yield '{'
+        yield from _iter_section_json(_iter_store_items(root.store, root.index), chunk_nodes, counts)
+    else:
+        pending = []
+        yield '{'
+        yield from _iter_section_json(_iter_items(root, pending), chunk_nodes, counts)
+        done = set()
+        while pending:
+            template = pending.pop()
+            if template.name in done:
+                continue
+            yield ',"templates":{' if not done else ','
+            done.add(template.name)
+            yield json.dumps(template.name) + ':{'
+            yield from _iter_section_json(_iter_items(template.root, pending), chunk_nodes, counts)
+            yield f',"entry":{template.root.id},"exit":{template.exit.id},"height":{template.height}}}'
+        if done:
+            yield '}'
+    if extents is not None:
+        yield ',"extents":' + json.dumps(list(extents), separators=(",", ":"))
+    yield '}'
+
+def _iter_section_json(items, chunk_nodes, counts=None):
+    # '"nodes":[...],"edges":[...]' of one walk, in chunks
+    edges = array('q')
+    chunk = []
+    separator = ''
+    nodes = 0
+    yield '"nodes":['
+    for kind, item in items:
+        if kind == "edge":
+            edges.extend(item)
+            continue
+        nodes += 1
+        chunk.append(json.dumps(item, separators=(",", ":")))
+        if len(chunk) >= chunk_nodes:
+            yield separator + ','.join(chunk)
+            separator = ','
+            chunk = []
+    if chunk:
+        yield separator + ','.join(chunk)
+    if counts is not None:
+        counts["nodes"] += nodes
+        counts["edges"] += len(edges) // 2
+    yield '],"edges":['
+    step = 2 * chunk_nodes
+    for k in range(0, len(edges), step):
+        pairs = edges[k:k + step]
+        yield (',' if k else '') + ','.join(f'[{pairs[i]},{pairs[i + 1]}]' for i in range(0, len(pairs), 2))
+    yield ']'
+
+def _export_nodes_edges(root, instance_templates):
+    # One pass over the graph; templates of ActionInstances found are appended to instance_templates
+    return _collect_items(_iter_items(root, instance_templates))
+
+def _export_store(store, root):
+    return _collect_items(_iter_store_items(store, root))
+
+def _collect_items(items):
     nodes_json = []
     edges_json = []
+    for kind, item in items:
+        (edges_json if kind == "edge" else nodes_json).append(item)
+    return {"nodes": nodes_json, "edges": edges_json}
 
-    for n in nodes:
+def _iter_items(root, instance_templates):
+    # ("node", node dict) and ("edge", [src id, dst id]) in iter_nodes_edges order
+    for kind, item in iter_nodes_edges(root):
+        if kind == "edge":
+            yield kind, [item[0].id, item[1].id]
+            continue
+        n = item
         node_type = type(n).__name__.lower()
         node_dict = {
             "id": n.id,
@@ -15,15 +278,33 @@ def export_graph_json(root: Node):
             "gx": n.gx,
             "gy": n.gy
         }
-        # Add bbox for compound nodes (type string must be lowercase)
-        if node_type in ("parallel", "select", "repeat", "sequence", "compoundaction") and getattr(n, "bbox", None):
+        # Add bbox for compound nodes
+        if node_type in BBOX_TYPES and getattr(n, "bbox", None):
             node_dict["bbox"] = list(n.bbox)
-        nodes_json.append(node_dict)
+        if node_type in TEMPLATE_TYPES:
+            node_dict["template"] = n.template.name
+            instance_templates.append(n.template)
+        if node_type == "repeatiterations":
+            node_dict["times"] = n.times
+        yield kind, node_dict
 
-    for e in edges:
-        edges_json.append([e[0].id, e[1].id])
-
-    return {"nodes": nodes_json, "edges": edges_json}
+def _iter_store_items(store, root):
+    names = store.names
+    for kind, item in store.iter_nodes_edges(root):
+        if kind == "edge":
+            yield kind, list(item)
+            continue
+        node_type = TYPE_NAMES[store.type_code[item]]
+        node_dict = {
+            "id": item,
+            "name": names[store.name_index[item]],
+            "type": node_type,
+            "gx": store.gx[item],
+            "gy": store.gy[item]
+        }
+        if node_type in BBOX_TYPES and store.has_bbox[item]:
+            node_dict["bbox"] = list(store.get_bbox(item))
+        yield kind, node_dict
 
 if __name__ == "__main__":
     # tiny test
@@ -1,34 +1,214 @@
 # flask_server.py
 from flask import Flask, render_template, jsonify, request
-from nodes import build_tree_from_json, Start, End
-from export_graph import export_graph_json
-from my_parser import parse_activity_text
+from export_graph import iter_graph_json, find_instance_template
+from action_graph import (pick_root_action, action_summaries, build_action_graph,
+                          layout_action_graph, serialize_graph, GRAPH_FORMATS)
+from my_parser import parse_activity_text, IncrementalParser, dependency_fingerprint
+from graph_cache import LRUCache, text_hash
+from jobs import JobManager, TooManyJobs
+import instrumentation
+from instrumentation import stage, Profiler, PROFILE_KINDS
+import gzip
 import json
+import secrets
+import time
+import zlib
 
 app = Flask(__name__)
 
+# Content-addressed caches: parsed documents by the hash of the PSS text;
+# laid-out graphs and their serialized JSON per (dependency fingerprint,
+# action, shared), so an edit only invalidates graphs of the actions that
+# reach the edited one.
+PARSE_CACHE_BYTES = 64 * 1024 * 1024    # total size of the cached source texts
+GRAPH_CACHE_ITEMS = 2_000_000           # total nodes + edges of cached graphs
+JSON_CACHE_BYTES = 128 * 1024 * 1024
+
+def _graph_items(graph):
+    parts = [graph] + list(graph.get("templates", {}).values())
+    return sum(len(p["nodes"]) + len(p["edges"]) for p in parts)
+
+parse_cache = LRUCache(PARSE_CACHE_BYTES)
+graph_cache = LRUCache(GRAPH_CACHE_ITEMS, sizeof=_graph_items)
+json_cache = LRUCache(JSON_CACHE_BYTES, sizeof=len)
+# Reuses the parsed actions of unchanged blocks when an edited document comes in
+incremental_parser = IncrementalParser(PARSE_CACHE_BYTES)
+# Layout jobs in worker processes (see /jobs)
+job_manager = JobManager()
+JOB_WAIT_MAX = 30.0  # longest long-poll wait, seconds
+# Reports of ?profile=cprofile|tracemalloc requests, served from /metrics/profiles/<id>
+PROFILE_KEEP = 16
+profiles = LRUCache(PROFILE_KEEP)
+LOCAL_ADDRS = ("127.0.0.1", "::1")
+
+def is_local_request():
+    return request.remote_addr in LOCAL_ADDRS
+
+@app.before_request
+def start_timing():
+    # Stage timings of every request, sent back as Server-Timing (see instrumentation)
+    if request.endpoint in (None, "static"):
+        return None
+    request.timings = instrumentation.start_request(request.endpoint)
+    kind = request.args.get("profile")
+    if kind is not None:
+        if not is_local_request():
+            return jsonify({"error": "Profiling is only available to local requests."}), 403
+        if kind not in PROFILE_KINDS:
+            return jsonify({"error": f"Unknown profile kind {kind!r}."}), 400
+        profiler = Profiler(kind)
+        if not profiler.start():
+            return jsonify({"error": "Another request is being profiled."}), 409
+        request.profiler = profiler
+        request.profile_id = secrets.token_hex(8)
+    return None
+
+@app.after_request
+def add_timing_headers(response):
+    timings = getattr(request, "timings", None)
+    if timings is None:
+        return response
+    if getattr(request, "profiler", None) is not None:
+        response.headers["X-Profile"] = f"/metrics/profiles/{request.profile_id}"
+    response.headers["Server-Timing"] = instrumentation.server_timing(timings)
+    return response
+
+@app.teardown_request
+def finish_timing(exc):
+    # Also runs when the view raised and no after_request hook did (debug mode),
+    # so the profiler is always stopped and the request's timings closed
+    profiler = getattr(request, "profiler", None)
+    if profiler is not None:
+        request.profiler = None
+        profiles.put(request.profile_id, profiler.stop())
+    timings = getattr(request, "timings", None)
+    if timings is not None:
+        request.timings = None
+        instrumentation.finish_request(timings)
+
 @app.route("/")
 def index():
     return render_template("index.html")
 
-def create_graph_from_pss_text(pss_text):
-    # parse PSS text into JSON structure
-    activity_tree = parse_activity_text(pss_text)
+def get_parsed(text):
+    """Returns (text hash, parse result), parsing only on a cache miss."""
+    doc = text_hash(text)
+    with stage("parse"):
+        return doc, parse_cache.get_or_create(doc, lambda: incremental_parser.parse(text), size=len(text))
+
+def get_graph(parsed, root_action, shared=False, unroll=False):
+    """Exported graph for root_action of a parsed document, built only on a cache miss."""
+    actions = parsed["actions"]
+    name = root_action["name"]
+    key = (dependency_fingerprint(actions, parsed["fingerprints"], name), name, shared, unroll)
+    return key, graph_cache.get_or_create(
+        key, lambda: layout_action_graph(root_action, actions, shared, unroll=unroll))
+
+COMPRESS_MIN_BYTES = 1024
+
+def graph_json_key(parsed, root_action, shared=False, collapsed=False, fmt="rows", unroll=False):
+    name = root_action["name"]
+    fingerprint = dependency_fingerprint(parsed["actions"], parsed["fingerprints"], name)
+    return (fingerprint, name, shared or collapsed, collapsed, fmt, unroll)
+
+def get_graph_json(parsed, root_action, shared=False, collapsed=False, fmt="rows", unroll=False):
+    """
+    Serialized graph for root_action, from the JSON cache when possible.
+    collapsed: shared graph without its templates (see export_graph.collapse_graph).
+    fmt: one of GRAPH_FORMATS; "binary" gives export_graph.encode_binary_graph bytes.
+    unroll: repeat(n) as n iterations of one shared body (see nodes.RepeatIterations).
+    """
+    shared = shared or collapsed
+    key = graph_json_key(parsed, root_action, shared, collapsed, fmt, unroll)
+    body = json_cache.get(key)
+    if body is None:
+        _, graph = get_graph(parsed, root_action, shared, unroll)
+        body = serialize_graph(graph, collapsed, fmt)
+        json_cache.put(key, body)
+    return body
 
-    # build Node tree
-    root_node = build_tree_from_json(activity_tree)
-    start_node = Start("Start")
-    start_node.add_child(root_node)
+# Largest streamed body that is also kept in the JSON cache
+STREAM_CACHE_MAX_BYTES = 16 * 1024 * 1024
 
-    last_node, _, _ = root_node.layout(start_node.gx, start_node.gy + 1)
-    start_node.edges.append((start_node, root_node))
+def stream_graph_json(parsed, root_action, shared=False, unroll=False):
+    """
+    Streamed response for the "rows" format: the graph is laid out, then
+    serialized chunk by chunk while the response is sent (see
+    export_graph.iter_graph_json). Bodies up to STREAM_CACHE_MAX_BYTES are
+    collected on the way and stored in the JSON cache. Serialization ends
+    after the response headers are sent, so it is recorded in the /metrics
+    "stream" histogram rather than in Server-Timing.
+    """
+    key = graph_json_key(parsed, root_action, shared, unroll=unroll)
+    body = json_cache.get(key)
+    if body is not None:
+        return send_body(body)
+    start_node, extents = build_action_graph(root_action, parsed["actions"], shared, unroll=unroll)
+    compress = "gzip" in request.accept_encodings
+    endpoint = request.endpoint
 
-    end_node = End("End")
-    end_node.gx = last_node.gx
-    end_node.gy = last_node.gy + 1
-    last_node.edges.append((last_node, end_node))
+    def generate():
+        kept, size = [], 0
+        counts = {}
+        start = time.perf_counter()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31: gzip
+        for chunk in iter_graph_json(start_node, extents, counts=counts):
+            data = chunk.encode("utf-8")
+            size += len(data)
+            if kept is not None:
+                kept.append(data)
+                if size > STREAM_CACHE_MAX_BYTES:
+                    kept = None
+            if compressor:
+                data = compressor.compress(data)
+                if not data:
+                    continue
+            yield data
+        if compressor:
+            yield compressor.flush()
+        if kept is not None:
+            json_cache.put(key, b"".join(kept))
+        instrumentation.metrics.observe_stage(endpoint, "stream", (time.perf_counter() - start) * 1000)
+        instrumentation.metrics.observe_counts(endpoint, counts["nodes"], counts["edges"])
 
-    return export_graph_json(start_node)
+    response = app.response_class(generate(), mimetype="application/json")
+    if compress:
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+def send_body(body, mimetype="application/json"):
+    """Response for a serialized body, gzip-compressed if the client accepts it."""
+    if len(body) >= COMPRESS_MIN_BYTES and "gzip" in request.accept_encodings:
+        response = app.response_class(gzip.compress(body, 6), mimetype=mimetype)
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+    return app.response_class(body, mimetype=mimetype)
+
+def get_request_document(data):
+    """
+    ((doc, parsed), None) for a request sending "text" or a cached "doc" id,
+    or (None, error response): 400 if doc is not a string, 404 if the id is
+    unknown.
+    """
+    doc = data.get("doc")
+    if doc is not None and "text" not in data:
+        if not isinstance(doc, str):
+            return None, (jsonify({"error": "doc must be a string."}), 400)
+        parsed = parse_cache.get(doc)
+        if parsed is None:
+            return None, (jsonify({"error": "Unknown document id.", "doc": doc}), 404)
+        return (doc, parsed), None
+    return get_parsed(data.get("text", "")), None
+
+def create_graph_from_pss_text(pss_text, action_name=None):
+    # parse PSS text into JSON structure
+    actions = parse_activity_text(pss_text)["actions"]
+    root_action = pick_root_action(actions, action_name)
+    if not root_action:
+        return None
+    return layout_action_graph(root_action, actions)
 
 @app.route("/parse", methods=["POST"])
 def graph_from_text():
@@ -36,31 +216,24 @@ def graph_from_text():
         data = request.get_json()
         text = data.get("text", "")
         action_name = data.get("action", None)
-        parsed = parse_activity_text(text)
+        # shared: reuse one laid-out subtree per referenced action (see ActionTemplate)
+        shared = bool(data.get("shared", False))
+        # collapsed: referenced actions as placeholders, expanded through /expand
+        collapsed = bool(data.get("collapsed", False))
+        # unroll: repeat(n) bodies drawn n times from one laid-out copy (see RepeatIterations)
+        unroll = bool(data.get("unroll", False))
+        fmt = data.get("format", "rows")
+        if fmt not in GRAPH_FORMATS:
+            return jsonify({"error": f"Unknown format {fmt!r}."}), 400
+        _, parsed = get_parsed(text)
         actions = parsed.get("actions", {})
-        root_action = None
-        if action_name and action_name in actions:
-            root_action = actions[action_name]
-        else:
-            root_action = actions.get("test") or (next(iter(actions.values()), None))
+        root_action = pick_root_action(actions, action_name)
         if not root_action:
             return jsonify({"error": "No valid action found in input."}), 400
-        root_node = build_tree_from_json(root_action, actions)
-        start_node = Start("Start")
-        start_node.add_child(root_node)
-        last_node, _, _ = root_node.layout(start_node.gx, start_node.gy + 1)
-        start_node.edges.append((start_node, root_node))
-        # Only add End node if root is not atomic and has children
-        from nodes import Atomic
-        is_atomic = isinstance(root_node, Atomic)
-        has_children = hasattr(root_node, 'children') and len(root_node.children) > 0
-        if not is_atomic and has_children:
-            end_node = End("End")
-            end_node.gx = last_node.gx
-            end_node.gy = last_node.gy + 1
-            last_node.edges.append((last_node, end_node))
-        graph = export_graph_json(start_node)
-        return jsonify(graph)
+        if fmt == "rows" and not collapsed:
+            return stream_graph_json(parsed, root_action, shared, unroll)
+        body = get_graph_json(parsed, root_action, shared, collapsed, fmt, unroll)
+        return send_body(body, "application/octet-stream" if fmt == "binary" else "application/json")
     except Exception as e:
         import traceback
         print("Error in /parse:", traceback.format_exc())
@@ -71,19 +244,191 @@ def list_actions():
     try:
         data = request.get_json()
         text = data.get("text", "")
-        parsed = parse_activity_text(text)
-        actions = parsed.get("actions", {})
-        # Collect all actions (compound and atomic)
-        action_list = []
-        for name, act in actions.items():
-            act_type = act.get("type", "atomic")
-            has_activity = bool(act.get("children"))
-            action_list.append({"name": name, "type": act_type, "has_activity": has_activity})
-        return jsonify({"actions": action_list})
+        _, parsed = get_parsed(text)
+        with stage("summaries"):
+            return jsonify({"actions": action_summaries(parsed.get("actions", {}))})
     except Exception as e:
         import traceback
         print("Error in /actions:", traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+@app.route("/render", methods=["POST"])
+def render_document():
+    """
+    /actions and /parse in one round trip: parses once and returns the
+    document id, the action list, the chosen (or default) action and its graph.
+    Later requests may send {"doc": id} instead of the text while the parsed
+    document is still cached; an unknown id answers 404 so the client resends
+    the text.
+    """
+    try:
+        data = request.get_json()
+        document, error = get_request_document(data)
+        if error:
+            return error
+        doc, parsed = document
+        action_name = data.get("action", None)
+        shared = bool(data.get("shared", False))
+        collapsed = bool(data.get("collapsed", False))
+        unroll = bool(data.get("unroll", False))
+        # The graph is embedded in a JSON document, so binary is not offered here
+        fmt = data.get("format", "rows")
+        if fmt not in GRAPH_FORMATS[:2]:
+            return jsonify({"error": f"Unknown format {fmt!r}."}), 400
+        actions = parsed.get("actions", {})
+        root_action = pick_root_action(actions, action_name)
+        graph = get_graph_json(parsed, root_action, shared, collapsed, fmt, unroll) if root_action else b"null"
+        # The graph is spliced in as the cached JSON bytes, not re-serialized
+        head = json.dumps({
+            "doc": doc,
+            "actions": action_summaries(actions),
+            "action": root_action["name"] if root_action else None,
+        }, separators=(",", ":"))
+        body = head[:-1].encode("utf-8") + b',"graph":' + graph + b"}"
+        return send_body(body)
+    except Exception as e:
+        import traceback
+        print("Error in /render:", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/expand", methods=["POST"])
+def expand_placeholder():
+    """
+    Laid-out subtree behind one placeholder of a collapsed graph:
+    {"id", "template", "nodes", "edges", "entry", "exit"} at the template
+    origin; the client shifts it to the placeholder position. Placeholders
+    nested in it are expanded by further requests with their path ids.
+    """
+    try:
+        data = request.get_json()
+        document, error = get_request_document(data)
+        if error:
+            return error
+        _, parsed = document
+        root_action = pick_root_action(parsed.get("actions", {}), data.get("action"))
+        if not root_action:
+            return jsonify({"error": "No valid action found in input."}), 400
+        _, graph = get_graph(parsed, root_action, shared=True, unroll=bool(data.get("unroll", False)))
+        found = find_instance_template(graph, data.get("id"))
+        if found is None:
+            return jsonify({"error": f"No placeholder with id {data.get('id')}."}), 404
+        name, template = found
+        return jsonify({"id": data.get("id"), "template": name, **template})
+    except Exception as e:
+        import traceback
+        print("Error in /expand:", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Starts building a graph in the worker pool. Takes the /render fields
+    ("text" or "doc", "action", "shared", "collapsed", "unroll", "format") plus an
+    optional "editor" id string, whose previous job is cancelled, and optional
+    "time_budget" (seconds) and "node_budget" limits. Answers 202 with
+    {"job", "state", "doc"}, or 503 while too many jobs are unfinished; the
+    result comes from GET /jobs/<id>.
+    """
+    try:
+        data = request.get_json()
+        document, error = get_request_document(data)
+        if error:
+            return error
+        doc, parsed = document
+        fmt = data.get("format", "rows")
+        if fmt not in GRAPH_FORMATS:
+            return jsonify({"error": f"Unknown format {fmt!r}."}), 400
+        shared = bool(data.get("shared", False))
+        collapsed = bool(data.get("collapsed", False))
+        unroll = bool(data.get("unroll", False))
+        editor = data.get("editor")
+        if editor is not None and not isinstance(editor, str):
+            return jsonify({"error": "editor must be a string."}), 400
+        budgets = {}
+        for key, kind in (("time_budget", float), ("node_budget", int)):
+            value = data.get(key)
+            if value is not None:
+                try:
+                    value = kind(value)
+                except (TypeError, ValueError, OverflowError):
+                    value = None
+                if value is None or not value > 0:
+                    return jsonify({"error": f"{key} must be a positive number."}), 400
+            budgets[key] = value
+        root_action = pick_root_action(parsed.get("actions", {}), data.get("action"))
+        if not root_action:
+            return jsonify({"error": "No valid action found in input."}), 400
+        try:
+            job = job_manager.submit(root_action, parsed["actions"], shared, collapsed, fmt,
+                                     editor=editor, unroll=unroll, **budgets)
+        except TooManyJobs as e:
+            return jsonify({"error": str(e)}), 503
+        key = graph_json_key(parsed, root_action, shared, collapsed, fmt, unroll)
+
+        def cache_result(future):
+            if not future.cancelled() and future.exception() is None:
+                json_cache.put(key, future.result())
+
+        job.future.add_done_callback(cache_result)
+        return jsonify({**job.status(), "doc": doc}), 202
+    except Exception as e:
+        import traceback
+        print("Error in /jobs:", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_result(job_id):
+    """
+    Result of a job: the graph body once it is done, else its status with
+    202 (still pending or running), 410 (cancelled) or 422 (failed, e.g. over
+    budget). ?wait=<seconds> long-polls until the job finishes.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}."}), 404
+    timeout = min(request.args.get("wait", 0.0, type=float), JOB_WAIT_MAX)
+    state = job_manager.wait(job, timeout) if timeout > 0 else job.state
+    if state == "done":
+        body = job.future.result()
+        return send_body(body, "application/json" if body[:1] == b"{" else "application/octet-stream")
+    status = {"pending": 202, "running": 202, "cancelled": 410}.get(state, 422)
+    return jsonify(job.status()), status
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}."}), 404
+    job_manager.cancel(job_id)
+    return jsonify(job.status())
+
+@app.route("/cache", methods=["GET"])
+def cache_stats():
+    return jsonify({
+        "parsed": parse_cache.stats(),
+        "blocks": incremental_parser.blocks.stats(),
+        "graphs": graph_cache.stats(),
+        "json": json_cache.stats(),
+    })
+
+@app.route("/metrics", methods=["GET"])
+def metrics_report():
+    """
+    Per endpoint: histograms of stage durations (ms, incl. "total") and of
+    the node and edge counts of the graphs built. Local requests only.
+    """
+    if not is_local_request():
+        return jsonify({"error": "Metrics are only available to local requests."}), 403
+    return jsonify(instrumentation.metrics.snapshot())
+
+@app.route("/metrics/profiles/<profile_id>", methods=["GET"])
+def profile_report(profile_id):
+    if not is_local_request():
+        return jsonify({"error": "Profiles are only available to local requests."}), 403
+    report = profiles.get(profile_id)
+    if report is None:
+        return jsonify({"error": f"Unknown profile {profile_id}."}), 404
+    return app.response_class(report, mimetype="text/plain")
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,286 @@
+# graph_store.py
+"""
+Compact, array-backed storage for activity graphs.
+
+A GraphStore keeps one entry per node in parallel typed arrays (type code,
+name index into an interned string table, grid position, bbox, tree links,
+cached width, first and last outgoing edge) plus a flat edge array with a
+next-edge link per edge, instead of one Python object with a
+__dict__, child/edge lists and tuples per node. Node ids are the dense array
+indices.
+
+StoreNode is a __slots__ view of one entry that behaves like a Node, so
+build_tree_from_json(..., store=...), the layout functions and
+export_graph_json run on a store unchanged.
+"""
+from array import array
+from nodes import (Node, Atomic, Start, End, Merge, Sequence, Parallel, Select,
+                   Repeat, CompoundAction, ForkNode)
+
+# Type code -> node class; the code is the index in this tuple
+NODE_CLASSES = (Node, Atomic, Start, End, Merge, Sequence, Parallel, Select, Repeat, CompoundAction)
+TYPE_NAMES = tuple(cls.__name__.lower() for cls in NODE_CLASSES)
+_TYPE_CODES = {cls: code for code, cls in enumerate(NODE_CLASSES)}
+
+# Names the Node constructors fall back to when given None
+_DEFAULT_NAMES = {Sequence: "Sequence", Parallel: "Parallel", Select: "Select",
+                  Repeat: "Repeat", CompoundAction: "CompoundAction", Merge: "Merge"}
+
+_NONE = -1  # "no node" / "not measured" in index and width arrays
+
+
+class GraphStore:
+    def __init__(self):
+        self.names = []          # interned string table
+        self._name_index = {}
+        self.type_code = array('B')
+        self.name_index = array('i')
+        self.gx = array('i')
+        self.gy = array('i')
+        self.has_bbox = array('B')
+        self.bbox_min_gx = array('i')
+        self.bbox_max_gx = array('i')
+        self.bbox_min_gy = array('i')
+        self.bbox_max_gy = array('i')
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.last_child = array('i')
+        self.next_sibling = array('i')
+        self.merge = array('i')
+        self.width = array('i')
+        self.first_edge = array('i')  # per node: its first outgoing edge, or _NONE
+        self.last_edge = array('i')
+        self.edges = array('i')      # flat (src, dst) index pairs in insertion order
+        self.next_edge = array('i')  # per edge: the source's next outgoing edge, or _NONE
+
+    def __len__(self):
+        return len(self.type_code)
+
+    def intern(self, name):
+        index = self._name_index.get(name)
+        if index is None:
+            index = self._name_index[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def add_node(self, cls, name=None):
+        """Appends a node of the given Node class and returns its StoreNode view."""
+        index = self._append(cls, name or _DEFAULT_NAMES.get(cls, "Node"))
+        if issubclass(cls, (ForkNode, Sequence)):
+            # Fork-like and sequential nodes own their merge node, as in the object model
+            self.merge[index] = self._append(Merge, f"End_{self.names[self.name_index[index]]}")
+        return StoreNode(self, index)
+
+    def _append(self, cls, name):
+        index = len(self.type_code)
+        self.type_code.append(_TYPE_CODES[cls])
+        self.name_index.append(self.intern(name))
+        for column in (self.gx, self.gy, self.has_bbox, self.bbox_min_gx,
+                       self.bbox_max_gx, self.bbox_min_gy, self.bbox_max_gy):
+            column.append(0)
+        for column in (self.parent, self.first_child, self.last_child,
+                       self.next_sibling, self.merge, self.width,
+                       self.first_edge, self.last_edge):
+            column.append(_NONE)
+        return index
+
+    def node(self, index):
+        return StoreNode(self, index)
+
+    def add_child(self, parent, child):
+        last = self.last_child[parent]
+        if last == _NONE:
+            self.first_child[parent] = child
+        else:
+            self.next_sibling[last] = child
+        self.last_child[parent] = child
+        self.parent[child] = parent
+
+    def children(self, index):
+        child = self.first_child[index]
+        while child != _NONE:
+            yield child
+            child = self.next_sibling[child]
+
+    def add_edge(self, src, dst):
+        k = len(self.next_edge)
+        self.edges.append(src)
+        self.edges.append(dst)
+        self.next_edge.append(_NONE)
+        last = self.last_edge[src]
+        if last == _NONE:
+            self.first_edge[src] = k
+        else:
+            self.next_edge[last] = k
+        self.last_edge[src] = k
+
+    def targets(self, index):
+        """Targets of the node's outgoing edges, in insertion order."""
+        edges, next_edge = self.edges, self.next_edge
+        k = self.first_edge[index]
+        while k != _NONE:
+            yield edges[2 * k + 1]
+            k = next_edge[k]
+
+    def get_bbox(self, index):
+        if not self.has_bbox[index]:
+            return None
+        return (self.bbox_min_gx[index], self.bbox_max_gx[index],
+                self.bbox_min_gy[index], self.bbox_max_gy[index])
+
+    def set_bbox(self, index, bbox):
+        if bbox is None:
+            self.has_bbox[index] = 0
+            return
+        self.has_bbox[index] = 1
+        (self.bbox_min_gx[index], self.bbox_max_gx[index],
+         self.bbox_min_gy[index], self.bbox_max_gy[index]) = bbox
+
+    def iter_nodes_edges(self, root):
+        """Same walk and order as nodes.iter_nodes_edges, over node indices."""
+        visited = bytearray(len(self.type_code))
+        visited[root] = 1
+        yield "node", root
+        # Stack entries: (node, iterator over its targets)
+        stack = [(root, self.targets(root))]
+        while stack:
+            src, targets = stack[-1]
+            dst = next(targets, None)
+            if dst is None:
+                stack.pop()
+                continue
+            yield "edge", (src, dst)
+            if not visited[dst]:
+                visited[dst] = 1
+                yield "node", dst
+                stack.append((dst, self.targets(dst)))
+
+
+class _StoreEdges:
+    # Stand-in for Node.edges: appends (src, dst) views into the store's edge array
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def append(self, edge):
+        self.store.add_edge(edge[0].index, edge[1].index)
+
+    def __iter__(self):
+        store = self.store
+        src = StoreNode(store, self.index)
+        for dst in store.targets(self.index):
+            yield src, StoreNode(store, dst)
+
+
+class StoreNode:
+    """Node-compatible view of one GraphStore entry."""
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, StoreNode) and other.store is self.store and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    def __repr__(self):
+        return f"<StoreNode {self.index} {self.store_type} {self.name!r}>"
+
+    @property
+    def node_class(self):
+        return NODE_CLASSES[self.store.type_code[self.index]]
+
+    @property
+    def store_type(self):
+        return TYPE_NAMES[self.store.type_code[self.index]]
+
+    @property
+    def id(self):
+        return self.index
+
+    @property
+    def name(self):
+        return self.store.names[self.store.name_index[self.index]]
+
+    @property
+    def type(self):
+        return "action" if self.node_class is CompoundAction else "node"
+
+    @property
+    def gx(self):
+        return self.store.gx[self.index]
+
+    @gx.setter
+    def gx(self, value):
+        self.store.gx[self.index] = value
+
+    @property
+    def gy(self):
+        return self.store.gy[self.index]
+
+    @gy.setter
+    def gy(self, value):
+        self.store.gy[self.index] = value
+
+    @property
+    def bbox(self):
+        return self.store.get_bbox(self.index)
+
+    @bbox.setter
+    def bbox(self, value):
+        self.store.set_bbox(self.index, value)
+
+    @property
+    def parent(self):
+        parent = self.store.parent[self.index]
+        return None if parent == _NONE else StoreNode(self.store, parent)
+
+    @property
+    def children(self):
+        return [StoreNode(self.store, c) for c in self.store.children(self.index)]
+
+    @property
+    def edges(self):
+        return _StoreEdges(self.store, self.index)
+
+    @property
+    def _width(self):
+        width = self.store.width[self.index]
+        return None if width == _NONE else width
+
+    @_width.setter
+    def _width(self, value):
+        self.store.width[self.index] = _NONE if value is None else value
+
+    @property
+    def merge(self):
+        merge = self.store.merge[self.index]
+        return None if merge == _NONE else StoreNode(self.store, merge)
+
+    @property
+    def bbox_margin(self):
+        return self.node_class.bbox_margin
+
+    def create_merge(self):
+        return self.merge
+
+    def add_child(self, child):
+        self.store.add_child(self.index, child.index)
+        self.invalidate_width()
+
+    # Width caching, measuring and layout are the Node implementations,
+    # dispatched on the stored node class
+    invalidate_width = Node.invalidate_width
+    measure_width = Node.measure_width
+    layout = Node.layout
+
+    def _measure_steps(self):
+        return self.node_class._measure_steps(self)
+
+    def _layout_steps(self, gx, gy):
+        return self.node_class._layout_steps(self, gx, gy)
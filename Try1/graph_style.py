@@ -0,0 +1,47 @@
+# graph_style.py
+"""
+How each node type is drawn, shared by the pygame viewer (visualization.py)
+and the SVG writer (svg_render.py); kept free of pygame so SVG rendering
+does not need it.
+"""
+from nodes import Start, End, Merge, Parallel, Select, Repeat, Sequence, Atomic, CompoundAction
+
+# Colors of grid lines, edges, compound action bboxes and captions
+GRID_COLOR = (230, 230, 230)
+EDGE_COLOR = (0, 0, 0)
+BBOX_COLOR = (255, 220, 120)
+LABEL_COLOR = (20, 20, 20)
+
+def node_style(node):
+    """(fill color, caption) of a node."""
+    if isinstance(node, Start):
+        color = (200, 255, 255)
+        caption = f"St[{node.id}]"
+    elif isinstance(node, End):
+        color = (255, 200, 255)
+        caption = f"En[{node.id}]"
+    elif isinstance(node, Merge):
+        color = (200, 255, 200)
+        caption = f"M[{node.id}]"
+    elif isinstance(node, Parallel):
+        color = (255, 200, 200)
+        caption = f"P[{node.id}]"
+    elif isinstance(node, Select):
+        color = (255, 255, 150)
+        caption = f"S[{node.id}]"
+    elif isinstance(node, Repeat):
+        color = (180, 180, 255)
+        caption = f"R[{node.id}]"
+    elif isinstance(node, Sequence):
+        color = (220, 220, 255)
+        caption = f"Seq[{node.id}]"
+    elif isinstance(node, Atomic):
+        color = (200, 200, 255)
+        caption = f"{node.name}[{node.id}]"
+    elif isinstance(node, CompoundAction):
+        color = (255, 220, 120)
+        caption = f"Action[{node.name}][{node.id}]"
+    else:
+        color = (200, 200, 255)
+        caption = f"A[{node.id}]"
+    return color, caption
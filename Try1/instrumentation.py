@@ -0,0 +1,198 @@
+# instrumentation.py
+"""
+Lightweight per-request stage timing.
+
+start_request() opens a RequestTimings for the current context; code on the
+request path wraps its stages in `with stage("layout"):` and reports graph
+sizes with record_counts(). Outside a request (e.g. in job workers) both are
+no-ops. server_timing() gives the Server-Timing header value and
+finish_request() folds the request into the process-wide `metrics`
+histograms; it must run even when the request failed.
+
+Profiler gives an opt-in cProfile or tracemalloc report for one request.
+"""
+import cProfile
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Histogram bucket upper bounds; one more bucket holds everything above
+TIME_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+COUNT_BUCKETS = (10, 100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+PROFILE_KINDS = ("cprofile", "tracemalloc")
+PROFILE_LINES = 40
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        labels = [str(b) for b in self.bounds] + ["+Inf"]
+        return {"count": self.count, "sum": self.sum, "buckets": dict(zip(labels, self.buckets))}
+
+
+class Metrics:
+    """Per endpoint: a duration histogram (ms) per stage, node and edge count histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}  # endpoint -> {stage: Histogram}
+        self.nodes = {}   # endpoint -> Histogram
+        self.edges = {}
+
+    def observe_stage(self, endpoint, name, ms):
+        with self._lock:
+            stages = self.stages.setdefault(endpoint, {})
+            if name not in stages:
+                stages[name] = Histogram(TIME_BUCKETS_MS)
+            stages[name].observe(ms)
+
+    def observe_counts(self, endpoint, nodes, edges):
+        with self._lock:
+            self.nodes.setdefault(endpoint, Histogram(COUNT_BUCKETS)).observe(nodes)
+            self.edges.setdefault(endpoint, Histogram(COUNT_BUCKETS)).observe(edges)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    "stages_ms": {name: h.to_dict() for name, h in stages.items()},
+                    "nodes": self.nodes[endpoint].to_dict() if endpoint in self.nodes else None,
+                    "edges": self.edges[endpoint].to_dict() if endpoint in self.edges else None,
+                }
+                for endpoint, stages in self.stages.items()
+            }
+
+
+metrics = Metrics()
+
+
+class RequestTimings:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.stages = {}  # name -> ms, summed over repeats, in first-seen order
+        self.nodes = None
+        self.edges = None
+        self.total = None  # ms, fixed by server_timing()
+        self._token = None
+
+    def add(self, name, ms):
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+
+_current = ContextVar("request_timings", default=None)
+
+
+def start_request(endpoint):
+    timings = RequestTimings(endpoint)
+    timings._token = _current.set(timings)
+    return timings
+
+
+def server_timing(timings):
+    """Server-Timing header value of the request so far; fixes its total."""
+    timings.total = (time.perf_counter() - timings.start) * 1000
+    entries = [f"{name};dur={ms:.2f}" for name, ms in timings.stages.items()]
+    entries.append(f"total;dur={timings.total:.2f}")
+    return ", ".join(entries)
+
+
+def finish_request(timings):
+    """Records the request in `metrics` and ends it in the current context."""
+    _current.reset(timings._token)
+    total = timings.total
+    if total is None:  # no response was made
+        total = (time.perf_counter() - timings.start) * 1000
+    for name, ms in timings.stages.items():
+        metrics.observe_stage(timings.endpoint, name, ms)
+    metrics.observe_stage(timings.endpoint, "total", total)
+    if timings.nodes is not None:
+        metrics.observe_counts(timings.endpoint, timings.nodes, timings.edges)
+
+
+@contextmanager
+def stage(name):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, (time.perf_counter() - start) * 1000)
+
+
+def record_counts(nodes, edges):
+    timings = _current.get()
+    if timings is not None:
+        timings.nodes = (timings.nodes or 0) + nodes
+        timings.edges = (timings.edges or 0) + edges
+
+
+_profiling = threading.Lock()  # held by the running Profiler
+
+
+class Profiler:
+    """
+    cProfile (calls in the current thread) or tracemalloc (allocations in
+    the whole process) between start() and stop(); stop() returns the top
+    PROFILE_LINES entries as text. Both profilers are process-wide, so one
+    request is profiled at a time: start() returns False while another
+    Profiler is running.
+    """
+
+    def __init__(self, kind):
+        if kind not in PROFILE_KINDS:
+            raise ValueError(f"Unknown profile kind {kind!r}, expected one of {PROFILE_KINDS}.")
+        self.kind = kind
+        self._profile = None
+        self._started_tracing = False
+
+    def start(self):
+        if not _profiling.acquire(blocking=False):
+            return False
+        if self.kind == "cprofile":
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except ValueError:  # a profiler outside this module is active (Python 3.12+)
+                _profiling.release()
+                return False
+        elif not tracemalloc.is_tracing():
+            self._started_tracing = True
+            tracemalloc.start()
+        return True
+
+    def stop(self):
+        out = io.StringIO()
+        try:
+            if self.kind == "cprofile":
+                self._profile.disable()
+                pstats.Stats(self._profile, stream=out).sort_stats("cumulative").print_stats(PROFILE_LINES)
+                return out.getvalue()
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if self._started_tracing:
+                tracemalloc.stop()
+        finally:
+            _profiling.release()
+        print(f"peak traced memory: {peak / 1024:.0f} KB", file=out)
+        for stat in snapshot.statistics("lineno")[:PROFILE_LINES]:
+            print(stat, file=out)
+        return out.getvalue()
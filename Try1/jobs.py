@@ -0,0 +1,189 @@
+# jobs.py
+"""
+Layout jobs: build, layout and export of one action in a process pool, so a
+large action does not hold a request thread and several can run at once.
+
+Every job holds a slot in a shared array of cancel flags until it finishes;
+the worker checks its flag, together with the job's time and node budgets,
+every CHECK_EVERY allocated node ids and between stages. Submitting a job for an editor
+cancels that editor's previous job: a pending one never starts, a running
+one stops at its next check.
+"""
+import multiprocessing
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from nodes import NodeIds
+from action_graph import layout_action_graph, serialize_graph
+from graph_cache import LRUCache
+
+CANCEL_SLOTS = 1024
+CHECK_EVERY = 1024      # node ids allocated between budget checks
+TIME_BUDGET = 30.0      # seconds per job
+NODE_BUDGET = 2_000_000
+KEEP_JOBS = 256         # most recent jobs whose state and result are kept
+
+
+class JobCancelled(RuntimeError):
+    pass
+
+
+class BudgetExceeded(RuntimeError):
+    pass
+
+
+class TooManyJobs(RuntimeError):
+    pass
+
+
+_cancel_flags = None  # the JobManager's flag array, in worker processes
+
+
+def _init_worker(flags):
+    global _cancel_flags
+    _cancel_flags = flags
+
+
+class _Budget:
+    def __init__(self, slot, time_budget, node_budget):
+        self.slot = slot
+        self.time_budget = time_budget
+        self.node_budget = node_budget
+        self.deadline = time.monotonic() + time_budget
+
+    def check(self, nodes=0):
+        if _cancel_flags is not None and _cancel_flags[self.slot]:
+            raise JobCancelled("Job was cancelled.")
+        if nodes > self.node_budget:
+            raise BudgetExceeded(f"Graph exceeds the budget of {self.node_budget} nodes.")
+        if time.monotonic() > self.deadline:
+            raise BudgetExceeded(f"Job exceeds its time budget of {self.time_budget} s.")
+
+
+class _BudgetedNodeIds(NodeIds):
+    # NodeIds that checks the job's budget every CHECK_EVERY ids
+    def __init__(self, budget):
+        super().__init__()
+        self.budget = budget
+
+    def __next__(self):
+        value = super().__next__()
+        if value % CHECK_EVERY == 0:
+            self.budget.check(self.count)
+        return value
+
+
+def run_layout_job(slot, root_action, actions, shared, collapsed, fmt, time_budget, node_budget,
+                   unroll=False):
+    """Worker entry point: the body bytes of one graph, as action_graph.serialize_graph."""
+    budget = _Budget(slot, time_budget, node_budget)
+    budget.check()
+    ids = _BudgetedNodeIds(budget)
+    graph = layout_action_graph(root_action, actions, shared or collapsed, ids, unroll)
+    budget.check(ids.count)
+    return serialize_graph(graph, collapsed, fmt)
+
+
+class Job:
+    def __init__(self, job_id, editor, slot, future):
+        self.id = job_id
+        self.editor = editor
+        self.slot = slot
+        self.future = future
+
+    @property
+    def state(self):
+        future = self.future
+        if future.cancelled():
+            return "cancelled"
+        if not future.done():
+            return "running" if future.running() else "pending"
+        error = future.exception()
+        if error is None:
+            return "done"
+        return "cancelled" if isinstance(error, JobCancelled) else "failed"
+
+    def status(self):
+        status = {"job": self.id, "state": self.state}
+        if status["state"] == "failed":
+            status["error"] = str(self.future.exception())
+        return status
+
+
+class JobManager:
+    """
+    Submits layout jobs to a lazily started process pool and tracks the
+    KEEP_JOBS most recent ones by id. Budgets given per job are capped at
+    the manager's. At most CANCEL_SLOTS jobs can be unfinished at once.
+    """
+
+    def __init__(self, max_workers=None, time_budget=TIME_BUDGET, node_budget=NODE_BUDGET):
+        self.max_workers = max_workers
+        self.time_budget = time_budget
+        self.node_budget = node_budget
+        self._flags = multiprocessing.RawArray('b', CANCEL_SLOTS)
+        self._free_slots = list(range(CANCEL_SLOTS - 1, -1, -1))
+        self._executor = None
+        self._jobs = LRUCache(KEEP_JOBS)
+        self._latest = LRUCache(KEEP_JOBS)  # editor -> id of its most recent job
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, initializer=_init_worker,
+                                                 initargs=(self._flags,))
+        return self._executor
+
+    def submit(self, root_action, actions, shared=False, collapsed=False, fmt="rows",
+               editor=None, time_budget=None, node_budget=None, unroll=False):
+        time_budget = self.time_budget if time_budget is None else min(time_budget, self.time_budget)
+        node_budget = self.node_budget if node_budget is None else min(node_budget, self.node_budget)
+        with self._lock:
+            if not self._free_slots:
+                raise TooManyJobs(f"All {CANCEL_SLOTS} job slots are in use.")
+            slot = self._free_slots.pop()
+            self._flags[slot] = 0
+            previous = self._latest.get(editor) if editor is not None else None
+            try:
+                future = self._pool().submit(run_layout_job, slot, root_action, actions, shared,
+                                             collapsed, fmt, time_budget, node_budget, unroll)
+            except Exception:
+                self._free_slots.append(slot)
+                raise
+            job = Job(secrets.token_hex(8), editor, slot, future)
+            self._jobs.put(job.id, job)
+            if editor is not None:
+                self._latest.put(editor, job.id)
+        # Outside the lock: a future that is already done runs the callback right away
+        future.add_done_callback(lambda _: self._release(slot))
+        if previous is not None:
+            self.cancel(previous)
+        return job
+
+    def _release(self, slot):
+        # The job in slot finished; no worker checks its flag any more
+        with self._lock:
+            self._free_slots.append(slot)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancels a pending or running job; False if it is unknown or already finished."""
+        job = self._jobs.get(job_id)
+        if job is None or job.future.done():
+            return False
+        if not job.future.cancel():
+            self._flags[job.slot] = 1
+        return True
+
+    def wait(self, job, timeout):
+        """Waits up to timeout seconds for job to finish; returns its state."""
+        wait([job.future], timeout)
+        return job.state
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
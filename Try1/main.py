@@ -2,8 +2,8 @@ from my_parser import parse_pss_file
 import pygame
 import os
 import sys  # <-- Add this import
-from nodes import Start, End, Atomic, Sequence, Parallel, Select, Repeat, collect_nodes_edges, build_tree_from_json
-from visualization import draw_node, draw_edges, draw_grid
+from nodes import Start, End, Atomic, Sequence, Parallel, Select, Repeat, iter_nodes_edges, build_tree_from_json, layout_graph, extend_extents, NodeIds
+from visualization import GridIndex, draw_region, render_static_layer, screen_to_grid, node_rect
 
 # --- Load PSS file ---
 pss_path = "C:/Users/User/Git_test1/test1/Try1/example.pss"
@@ -85,50 +85,65 @@ def main(activity_tree):
             raise ValueError(f"Unknown type {t}")
 
     # --- Visualization setup as before ---
-    start_node = Start("Start")
-    tree = build_tree_from_json(activity_tree)
-
-    # If the root is a sequence with only one child, skip it for layout
-    if isinstance(tree, Sequence) and len(tree.children) == 1:
-        tree = tree.children[0]
-
-    start_node.add_child(tree)
-    last_node, _, _ = tree.layout(start_node.gx, start_node.gy + 1)
-    start_node.edges.append((start_node, tree))
-    end_node = End("End")
-    last_node.edges.append((last_node, end_node))
-
-    nodes, edges = collect_nodes_edges(start_node)
-
-    # --- Compute bounds ---
-    min_gx = min(n.gx for n in nodes)
-    max_gx = max(n.gx for n in nodes)
-    min_gy = min(n.gy for n in nodes)
-    max_gy = max(n.gy for n in nodes)
-
-    # Place end node directly below last_node and update bounds accordingly
-    end_node.gx = last_node.gx
-    end_node.gy = last_node.gy + 1
-    nodes.append(end_node)
-
-    # Use exact bounds for grid size
-    min_gx = min(min_gx, end_node.gx)
-    max_gx = max(max_gx, end_node.gx)
-    min_gy = min(min_gy, end_node.gy)
-    max_gy = max(max_gy, end_node.gy)
+    with NodeIds():  # dense node ids from 0 for this graph
+        start_node = Start("Start")
+        tree = build_tree_from_json(activity_tree)
+
+        # If the root is a sequence with only one child, skip it for layout
+        if isinstance(tree, Sequence) and len(tree.children) == 1:
+            tree = tree.children[0]
+
+        start_node.add_child(tree)
+        last_node, _, _, extents = layout_graph(tree, start_node.gx, start_node.gy + 1)
+        start_node.edges.append((start_node, tree))
+
+        # Place end node directly below last_node
+        end_node = End("End")
+        end_node.gx = last_node.gx
+        end_node.gy = last_node.gy + 1
+        last_node.edges.append((last_node, end_node))
+
+    # --- Collect draw lists in one pass over the graph ---
+    nodes, edges = [], []
+    for kind, item in iter_nodes_edges(start_node):
+        (edges if kind == "edge" else nodes).append(item)
+
+    # Use exact bounds for grid size; layout already measured them
+    min_gx, max_gx, min_gy, max_gy = extend_extents(extents, start_node, end_node)
     w_cells = max_gx - min_gx + 1
     h_cells = max_gy - min_gy + 1
 
     # --- Compute cell size (scaled to 80%) ---
     cell_w = (SCREEN_WIDTH - 2*MARGIN) // w_cells
     cell_h = (SCREEN_HEIGHT - 2*MARGIN) // h_cells
-    cell_size = int(min(cell_w, cell_h) * 0.8)
+    # At least a pixel: graphs over a few hundred rows or columns would get 0
+    cell_size = max(1, int(min(cell_w, cell_h) * 0.8))
 
     clock = pygame.time.Clock()
     zoom = 1.0
+    bounds = (min_gx, max_gx, min_gy, max_gy)
+    index = GridIndex(nodes, edges)
+    # The graph is drawn once per zoom level into an off-screen layer when it
+    # fits, else region by region through the index (see draw_region)
+    layer = None
+    layer_zoom = None
+    pan_x, pan_y = 0, 0
+    dragging = False
+    hover = None
+    screen_rect = screen.get_rect()
+    full_redraw = True
+
+    def paint(rect):
+        if layer is not None:
+            screen.fill((255,255,255), rect)
+            screen.blit(layer, rect.topleft, rect.move(-pan_x, -pan_y))
+        else:
+            draw_region(screen, index, rect, bounds, cell_size, MARGIN, zoom, (pan_x, pan_y))
 
-        
     while True:
+        # Only changed screen rects are redrawn and passed to display.update
+        dirty = []
+        dx = dy = 0
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pygame.quit()
@@ -140,38 +155,52 @@ def main(activity_tree):
                     zoom /= 1.1
                 zoom = max(0.2, min(3.0, zoom))  # clamp
                 print("Zoom:", zoom)
-
-        screen.fill((255,255,255))
-
-        # Draw grid
-        grid_color = (230,230,230)
-        for gx in range(min_gx, max_gx + 1):
-            x = MARGIN + (gx - min_gx) * cell_size * zoom
-            pygame.draw.line(screen, grid_color, (x, MARGIN), (x, SCREEN_HEIGHT - MARGIN))
-        for gy in range(min_gy, max_gy + 1):
-            y = MARGIN + (gy - min_gy) * cell_size * zoom
-            pygame.draw.line(screen, grid_color, (MARGIN, y), (SCREEN_WIDTH - MARGIN, y))
-
-        # Draw edges
-        for start_node, end_node in edges:
-            x1 = MARGIN + (start_node.gx - min_gx) * cell_size * zoom + cell_size*0.5*zoom
-            y1 = MARGIN + (start_node.gy - min_gy) * cell_size * zoom + cell_size*0.5*zoom
-            x2 = MARGIN + (end_node.gx - min_gx) * cell_size * zoom + cell_size*0.5*zoom
-            y2 = MARGIN + (end_node.gy - min_gy) * cell_size * zoom + cell_size*0.5*zoom
-            pygame.draw.line(screen, (0,0,0), (x1,y1), (x2,y2), max(1,int(2*zoom)))
-
-        # Draw nodes
-        for node in nodes:
-            draw_node(
-                screen,
-                node,
-                (min_gx, max_gx, min_gy, max_gy),
-                cell_size,
-                MARGIN,
-                zoom
-            )
-
-        pygame.display.flip()
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                dragging = True
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+                dragging = False
+            elif event.type == pygame.MOUSEMOTION and dragging:
+                dx += event.rel[0]
+                dy += event.rel[1]
+
+        if zoom != layer_zoom:
+            layer = render_static_layer(index, bounds, cell_size, MARGIN, zoom)
+            layer_zoom = zoom
+            full_redraw = True
+
+        if dx or dy:
+            pan_x += dx
+            pan_y += dy
+            if not full_redraw:
+                # Scroll what is on screen and draw only the uncovered strips
+                screen.scroll(dx, dy)
+                w, h = screen_rect.size
+                if dx:
+                    paint(pygame.Rect(0 if dx > 0 else w + dx, 0, abs(dx), h))
+                if dy:
+                    paint(pygame.Rect(0, 0 if dy > 0 else h + dy, w, abs(dy)))
+                dirty.append(screen_rect)
+        repainted = full_redraw
+        if full_redraw:
+            paint(screen_rect)
+            dirty.append(screen_rect)
+            full_redraw = False
+
+        # Outline the node under the mouse; repaint the previous one's box
+        mouse_x, mouse_y = pygame.mouse.get_pos()
+        node = index.node_at(*screen_to_grid(mouse_x, mouse_y, bounds, cell_size, MARGIN, zoom, (pan_x, pan_y)))
+        if node is not hover or dirty:
+            if hover is not None and node is not hover and not repainted:
+                old = node_rect(hover, bounds, cell_size, MARGIN, zoom, (pan_x, pan_y)).inflate(8, 8)
+                paint(old)
+                dirty.append(old)
+            hover = node
+            if hover is not None:
+                box = node_rect(hover, bounds, cell_size, MARGIN, zoom, (pan_x, pan_y)).inflate(8, 8)
+                pygame.draw.rect(screen, (255, 140, 0), box, 3)
+                dirty.append(box)
+
+        pygame.display.update(dirty)
         clock.tick(60)
 
 
@@ -1,178 +1,314 @@
 # parser.py
+import mmap
+import os
 import re
+from collections import namedtuple
+from steps import run_steps
+from graph_cache import LRUCache, text_hash
 
+# One alternative per token kind; whitespace matches with no group set.
+_TOKEN_RE = re.compile(r'\s+|([a-zA-Z0-9_]+)|([{}();])|(.)', re.S)
+# Same pattern for bytes-like sources (bytes, mmap)
+_TOKEN_RE_BYTES = re.compile(_TOKEN_RE.pattern.encode(), re.S)
 
-def parse_activity_text(text):
+# Keywords that open a nested block: `<keyword> { ... }`
+_BLOCK_KEYWORDS = ("sequence", "select", "parallel", "activity")
+
+# The `action` keyword as a whole name token
+_ACTION_RE = re.compile(r'(?<![a-zA-Z0-9_])action(?![a-zA-Z0-9_])')
+
+Token = namedtuple("Token", ["kind", "value", "line", "col"])
+
+
+def tokenize(text, line=1, col=1):
     """
-    Parses textual activity definitions into a JSON-like structure.
-    Supports: action <name> { ... }, referencing actions, operators, atomic nodes.
+    Splits text into tokens in a single left-to-right pass.
+    Yields Token(kind, value, line, col) where kind is "name", one of the
+    punctuation characters "{", "}", "(", ")", ";", "other" for any other
+    character, and finally "eof". Lines and columns are 1-based; line and
+    col give the position of text[0] when text is a slice of a document.
+    text may also be bytes or an mmap; token values are always str and
+    only the current token is held in memory.
     """
-    # Normalize whitespace and split into statements
-    text = re.sub(r'[ \t\r\f\v]+', ' ', text)
-    text = re.sub(r'\n+', ' ', text)
-    text = text.strip()
-    pos = 0
-    length = len(text)
-    warnings = []
-    actions = {}
+    is_bytes = not isinstance(text, str)
+    token_re = _TOKEN_RE_BYTES if is_bytes else _TOKEN_RE
+    newline = b'\n' if is_bytes else '\n'
+    line_start = 1 - col
+    for match in token_re.finditer(text):
+        group = match.lastindex
+        if group is None:
+            # Whitespace: only track line breaks
+            ws = match.group()
+            newlines = ws.count(newline)
+            if newlines:
+                line += newlines
+                line_start = match.start() + ws.rindex(newline) + 1
+            continue
+        value = match.group(group)
+        if is_bytes:
+            value = value.decode("latin-1")
+        if group == 1:
+            kind = "name"
+        elif group == 2:
+            kind = value
+        else:
+            kind = "other"
+        yield Token(kind, value, line, match.start() - line_start + 1)
+    yield Token("eof", "", line, len(text) - line_start + 1)
+
+
+def iter_actions(text, warnings=None, line=1, col=1):
+    """
+    Parses activity definitions one action at a time.
+    Yields (name, action) pairs in source order as soon as each action's
+    closing brace is read; text may be a str, bytes or an mmap. Warnings
+    are appended to the given list, if any. line and col are the position
+    of text[0] (see tokenize).
+    The generator returns False if text ended inside an action definition,
+    i.e. the result could change if more text followed, and True otherwise.
+    """
+    if warnings is None:
+        warnings = []
+    tokens = tokenize(text, line, col)
+    tok = next(tokens)
 
-    def skip_whitespace():
-        nonlocal pos
-        while pos < length and text[pos].isspace():
-            pos += 1
+    def advance():
+        nonlocal tok
+        tok = next(tokens)
+
+    def where():
+        return f"line {tok.line}, column {tok.col}"
+
+    def skip_until(*kinds):
+        while tok.kind not in kinds and tok.kind != "eof":
+            advance()
 
     def parse_name():
-        nonlocal pos
-        skip_whitespace()
-        match = re.match(r'[a-zA-Z0-9_]+', text[pos:])
-        if not match:
-            next_pos = pos
-            while next_pos < length and text[next_pos] not in [';', '}', '{']:
-                next_pos += 1
-            warnings.append(f"Warning: Expected name at position {pos}, skipping invalid token.")
-            pos = next_pos
+        if tok.kind != "name":
+            warnings.append(f"Warning: Expected name at {where()}, skipping invalid token.")
+            skip_until(';', '}', '{')
             return None
-        name = match.group(0)
-        pos += len(name)
+        name = tok.value
+        advance()
         return name
 
     def parse_number():
-        nonlocal pos
-        skip_whitespace()
-        match = re.match(r'\d+', text[pos:])
-        if not match:
-            warnings.append(f"Warning: Expected number at position {pos}, defaulting to 1.")
+        if tok.kind != "name" or not tok.value.isdigit():
+            warnings.append(f"Warning: Expected number at {where()}, defaulting to 1.")
             return 1
-        num = int(match.group(0))
-        pos += len(match.group(0))
+        num = int(tok.value)
+        advance()
         return num
 
     def parse_block():
-        nonlocal pos
+        # Step generator (see steps.run_steps) so nesting depth is not limited by recursion
         children = []
-        skip_whitespace()
-        while pos < length and text[pos] != '}':
-            skip_whitespace()
-            if text.startswith("repeat(", pos):
-                pos += len("repeat(")
+        while tok.kind not in ('}', "eof"):
+            if tok.kind == "name" and tok.value == "repeat":
+                advance()
+                if tok.kind != '(':
+                    # Plain identifier that happens to be called "repeat"
+                    if tok.kind == ';':
+                        advance()
+                    children.append({"type": "ref", "name": "repeat"})
+                    continue
+                advance()
                 n = parse_number()
-                skip_whitespace()
-                if pos >= length or text[pos] != ')':
-                    warnings.append(f"Warning: Expected ')' after repeat number at position {pos}, skipping.")
-                    while pos < length and text[pos] != '{':
-                        pos += 1
+                if tok.kind != ')':
+                    warnings.append(f"Warning: Expected ')' after repeat number at {where()}, skipping.")
+                    skip_until('{')
                 else:
-                    pos += 1
-                skip_whitespace()
-                if pos >= length or text[pos] != '{':
-                    warnings.append(f"Warning: Expected '{{' after repeat(n) at position {pos}, skipping.")
-                    while pos < length and text[pos] != '}':
-                        pos += 1
+                    advance()
+                if tok.kind != '{':
+                    warnings.append(f"Warning: Expected '{{' after repeat(n) at {where()}, skipping.")
+                    skip_until('}')
                     continue
-                pos += 1
-                block_children = parse_block()
+                advance()
+                block_children = yield parse_block()
                 children.append({"type": "repeat", "times": n, "children": block_children})
-                skip_whitespace()
-                if pos < length and text[pos] == '}':
-                    pos += 1
-            elif text.startswith("sequence", pos):
-                pos += len("sequence")
-                skip_whitespace()
-                if pos >= length or text[pos] != '{':
-                    warnings.append(f"Warning: Expected '{{' after sequence at position {pos}, skipping.")
-                    while pos < length and text[pos] != '}':
-                        pos += 1
-                    continue
-                pos += 1
-                block_children = parse_block()
-                children.append({"type": "sequence", "children": block_children})
-                skip_whitespace()
-                if pos < length and text[pos] == '}':
-                    pos += 1
-            elif text.startswith("select", pos):
-                pos += len("select")
-                skip_whitespace()
-                if pos >= length or text[pos] != '{':
-                    warnings.append(f"Warning: Expected '{{' after select at position {pos}, skipping.")
-                    while pos < length and text[pos] != '}':
-                        pos += 1
-                    continue
-                pos += 1
-                block_children = parse_block()
-                children.append({"type": "select", "children": block_children})
-                skip_whitespace()
-                if pos < length and text[pos] == '}':
-                    pos += 1
-            elif text.startswith("parallel", pos):
-                pos += len("parallel")
-                skip_whitespace()
-                if pos >= length or text[pos] != '{':
-                    warnings.append(f"Warning: Expected '{{' after parallel at position {pos}, skipping.")
-                    while pos < length and text[pos] != '}':
-                        pos += 1
-                    continue
-                pos += 1
-                block_children = parse_block()
-                children.append({"type": "parallel", "children": block_children})
-                skip_whitespace()
-                if pos < length and text[pos] == '}':
-                    pos += 1
-            elif text.startswith("activity", pos):
-                pos += len("activity")
-                skip_whitespace()
-                if pos >= length or text[pos] != '{':
-                    warnings.append(f"Warning: Expected '{{' after activity at position {pos}, skipping.")
-                    while pos < length and text[pos] != '}':
-                        pos += 1
+                if tok.kind == '}':
+                    advance()
+            elif tok.kind == "name" and tok.value in _BLOCK_KEYWORDS:
+                keyword = tok.value
+                advance()
+                if tok.kind != '{':
+                    warnings.append(f"Warning: Expected '{{' after {keyword} at {where()}, skipping.")
+                    skip_until('}')
                     continue
-                pos += 1
-                block_children = parse_block()
-                children.append({"type": "activity", "children": block_children})
-                skip_whitespace()
-                if pos < length and text[pos] == '}':
-                    pos += 1
+                advance()
+                block_children = yield parse_block()
+                children.append({"type": keyword, "children": block_children})
+                if tok.kind == '}':
+                    advance()
             else:
                 # Could be atomic or action reference
                 name = parse_name()
-                skip_whitespace()
-                if pos < length and text[pos] == ';':
-                    pos += 1
+                if tok.kind == ';':
+                    advance()
+                elif name is None and tok.kind == '{':
+                    # Stray block opener: step over it so parsing makes progress
+                    advance()
                 if name:
                     children.append({"type": "ref", "name": name})
-            skip_whitespace()
         return children
 
     def parse_actions():
-        nonlocal pos
-        skip_whitespace()
-        while pos < length:
-            skip_whitespace()
-            if text.startswith("action", pos):
-                pos += len("action")
-                skip_whitespace()
+        complete = True
+        while tok.kind != "eof":
+            if tok.kind == "name" and tok.value == "action":
+                advance()
                 action_name = parse_name()
-                skip_whitespace()
-                if pos < length and text[pos] == '{':
-                    pos += 1
-                    action_body = parse_block()
-                    actions[action_name] = {"type": "action", "name": action_name, "children": action_body}
-                    skip_whitespace()
-                    if pos < length and text[pos] == '}':
-                        pos += 1
+                if tok.kind == '{':
+                    advance()
+                    action_body = run_steps(parse_block())
+                    complete = tok.kind == '}'
+                    if complete:
+                        advance()
+                    yield action_name, {"type": "action", "name": action_name, "children": action_body}
                 else:
-                    warnings.append(f"Warning: Expected '{{' after action name at position {pos}.")
+                    complete = tok.kind != "eof"
+                    warnings.append(f"Warning: Expected '{{' after action name at {where()}.")
             else:
                 # Skip unknown tokens
-                pos += 1
-        return actions
+                advance()
+        return complete
 
-    actions = parse_actions()
+    return (yield from parse_actions())
+
+
+def parse_activity_text(text):
+    """
+    Parses textual activity definitions into a JSON-like structure.
+    Supports: action <name> { ... }, referencing actions, operators, atomic nodes.
+    Warnings report the line and column of the offending token.
+    """
+    warnings = []
+    actions = dict(iter_actions(text, warnings))
     return {"actions": actions, "warnings": warnings}
 
+
+def iter_references(action):
+    """Yields the names of all actions referenced in an action's activity."""
+    stack = list(action.get("children", []))
+    while stack:
+        child = stack.pop()
+        if child.get("type") == "ref":
+            yield child["name"]
+        else:
+            stack.extend(child.get("children", []))
+
+
+def dependency_fingerprint(actions, fingerprints, name):
+    """
+    Hash of the definitions of action name and of every action it reaches
+    through references, from the "fingerprints" of an IncrementalParser
+    result. It changes exactly when an edit can change the action's graph,
+    including defining a previously unknown (atomic) reference.
+    """
+    seen = {name}
+    stack = [name]
+    while stack:
+        action = actions.get(stack.pop())
+        if action is None:
+            continue
+        for ref in iter_references(action):
+            if ref not in seen:
+                seen.add(ref)
+                stack.append(ref)
+    return text_hash(";".join(f"{n}={fingerprints.get(n, '')}" for n in sorted(seen)))
+
+
+class IncrementalParser:
+    """
+    Re-parses a document edit by edit at action granularity.
+
+    parse() splits the text before every top-level `action` keyword, hashes
+    each block and reuses the parsed actions of blocks seen before, so only
+    edited blocks go through the tokenizer. Parsed actions do not depend on
+    other actions (references are resolved when the graph is built), so an
+    edit never forces other blocks to be re-parsed; dependency_fingerprint()
+    tells which graphs an edit affects.
+    Blocks are kept in an LRU cache bounded by their total text size.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.blocks = LRUCache(max_bytes)  # block hash -> (pairs, warnings, complete, (line, col))
+
+    def split_points(self, text):
+        # Offsets where a block starts: 0 and every `action` keyword outside
+        # braces. Brace counting only guesses where the parser is at top level;
+        # parse() checks each guess (see the "complete" flag of iter_actions).
+        points = [0]
+        depth = 0
+        last = 0
+        for match in _ACTION_RE.finditer(text):
+            start = match.start()
+            depth += text.count('{', last, start) - text.count('}', last, start)
+            last = start
+            if depth == 0 and start > 0:
+                points.append(start)
+        return points
+
+    def parse_block(self, block, line, col):
+        key = text_hash(block)
+        entry = self.blocks.get(key)
+        # Warnings carry absolute positions, so a moved block with warnings is re-parsed
+        if entry is None or (entry[1] and entry[3] != (line, col)):
+            warnings = []
+            actions = iter_actions(block, warnings, line, col)
+            pairs = []
+            while True:
+                try:
+                    pairs.append(next(actions))
+                except StopIteration as stop:
+                    complete = stop.value
+                    break
+            entry = (pairs, warnings, complete, (line, col))
+            self.blocks.put(key, entry, size=len(block))
+        return key, entry
+
+    def parse(self, text):
+        """
+        Same result as parse_activity_text(text), plus "fingerprints": the
+        hash of the block that defines each action.
+        """
+        actions, warnings, fingerprints = {}, [], {}
+        points = self.split_points(text)
+        line = 1
+        for i, start in enumerate(points):
+            end = points[i + 1] if i + 1 < len(points) else len(text)
+            line += text.count('\n', points[i - 1] if i else 0, start)
+            col = start - text.rfind('\n', 0, start)
+            key, (pairs, block_warnings, complete, _) = self.parse_block(text[start:end], line, col)
+            if not complete and end < len(text):
+                # The block runs into the next one: parse the rest in one piece
+                key, (pairs, block_warnings, _, _) = self.parse_block(text[start:], line, col)
+                end = len(text)
+            for name, action in pairs:
+                actions[name] = action
+                fingerprints[name] = key
+            warnings.extend(block_warnings)
+            if end == len(text):
+                break
+        return {"actions": actions, "warnings": warnings, "fingerprints": fingerprints}
+
+
+def iter_pss_file(file_path, warnings=None):
+    """
+    Streams (name, action) pairs from a PSS file through a read-only mmap,
+    so memory use stays around the size of one action regardless of file size.
+    """
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from iter_actions(mm, warnings)
+
+
 def parse_pss_file(file_path):
     try:
-        with open(file_path, "r") as f:
-            text = f.read()
-        return parse_activity_text(text)
+        warnings = []
+        actions = dict(iter_pss_file(file_path, warnings))
+        return {"actions": actions, "warnings": warnings}
     except FileNotFoundError:
         raise FileNotFoundError(f"PSS file not found: {file_path}. Please check the path or provide a fallback activity tree.")
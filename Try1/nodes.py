@@ -1,15 +1,56 @@
 __all__ = ['Node', 'Atomic', 'Start', 'End', 'Merge', 'ForkNode',
-           'Sequence', 'Parallel', 'Select', 'Repeat', 'collect_nodes_edges']
+           'Sequence', 'Parallel', 'Select', 'Repeat', 'ActionTemplate',
+           'ActionInstance', 'RepeatIterations', 'LayoutResult', 'layout_graph', 'extend_extents',
+           'collect_nodes_edges', 'iter_nodes_edges', 'NodeIds']
+
+import itertools
+from array import array
+from collections import namedtuple
+from contextvars import ContextVar
+from steps import run_steps
+
+# Result of layout_graph(): the node edges continue from, the column, the
+# next free row, and (min_gx, max_gx, min_gy, max_gy) over all laid-out nodes
+LayoutResult = namedtuple("LayoutResult", ["last", "gx", "next_y", "extents"])
+
+class NodeIds:
+    """
+    Node id allocator for one graph: dense ids 0, 1, 2... in creation order,
+    so ids can index arrays and identical inputs get identical ids.
+    Use it as a context manager around building a graph (including its
+    Start/End nodes); nodes created inside take their ids from it. The
+    active allocator lives in a context variable, so each thread (e.g. each
+    Flask request) sees its own and allocation needs no lock. count is the
+    number of ids handed out.
+    """
+    def __init__(self):
+        self.count = 0
+        self._tokens = []
+
+    def __next__(self):
+        value = self.count
+        self.count = value + 1
+        return value
+
+    def __enter__(self):
+        self._tokens.append(_node_ids.set(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _node_ids.reset(self._tokens.pop())
+
+# Outside any NodeIds scope, ids come from one process-wide counter
+# (itertools.count is atomic under the GIL)
+_node_ids = ContextVar("node_ids", default=itertools.count(1))
 
-_node_id_counter = 1
 def next_node_id():
-    global _node_id_counter
-    val = _node_id_counter
-    _node_id_counter += 1
-    return val
+    return next(_node_ids.get())
 
 
 class Node:
+    # Extra columns added to the left of the aggregated bbox (see _aggregate_bboxes)
+    bbox_margin = 0
+
     def __init__(self, name=None, node_type=None):
         self.name = name or "Node"
         self.type = node_type or "node"
@@ -19,50 +60,64 @@ class Node:
         self.gy = 0
         self.id = next_node_id()
         self.bbox = None  # (min_gx, max_gx, min_gy, max_gy)
+        self.parent = None
+        self._width = None  # cached measure_width(), see invalidate_width()
 
     def add_child(self, child):
         self.children.append(child)
+        child.parent = self
+        self.invalidate_width()
+
+    def invalidate_width(self):
+        # A cached width implies cached widths below it, so stop at the first uncached node
+        node = self
+        while node is not None and node._width is not None:
+            node._width = None
+            node = node.parent
 
     def measure_width(self):
-        return 1
+        if self._width is None:
+            run_steps(self._measure_steps())
+        return self._width
+
+    def _measure_steps(self):
+        # Step generator (see steps.run_steps) that caches self._width
+        yield from ()
+        self._width = 1
 
     def layout(self, gx, gy):
+        last, gx, next_y, _ = layout_graph(self, gx, gy)
+        return last, gx, next_y
+
+    def _layout_steps(self, gx, gy):
+        # Step generator returning (last node, gx, next free gy). Containers
+        # set self.bbox to their own box only; layout_graph() then widens it
+        # to cover the subtree.
+        yield from ()
         self.gx, self.gy = gx, gy
         return self, gx, gy + 1
 
 class CompoundAction(Node):
+    # Expand bbox by 2 to the left for compound actions
+    bbox_margin = 2
+
     def __init__(self, name=None):
         super().__init__(name or "CompoundAction", node_type="action")
 
-    def measure_width(self):
-        if not self.children:
-            return 1
-        return max([c.measure_width() for c in self.children])
+    def _measure_steps(self):
+        widths = yield from _child_widths(self)
+        self._width = max(widths) if widths else 1
 
-    def layout(self, gx, gy):
+    def _layout_steps(self, gx, gy):
         self.gx, self.gy = gx, gy
-        min_gx = max_gx = gx
-        min_gy = max_gy = gy
         current_y = gy + 1
         last_node = self
         for child in self.children:
-            last, child_gx, next_y = child.layout(gx, current_y)
+            last, child_gx, next_y = yield child._layout_steps(gx, current_y)
             self.edges.append((self, child))
             current_y = next_y
             last_node = last
-            min_gx = min(min_gx, child.gx)
-            max_gx = max(max_gx, child.gx)
-            min_gy = min(min_gy, child.gy)
-            max_gy = max(max_gy, child.gy)
-            if hasattr(child, "bbox") and child.bbox:
-                cminx, cmaxx, cminy, cmaxy = child.bbox
-                min_gx = min(min_gx, cminx)
-                max_gx = max(max_gx, cmaxx)
-                min_gy = min(min_gy, cminy)
-                max_gy = max(max_gy, cmaxy)
-        min_gx = min(min_gx, self.gx)
-        # Expand bbox by 2 to the left for compound actions
-        self.bbox = (min_gx - 2, max_gx, min_gy - 1, last_node.gy + 2)
+        self.bbox = (gx, gx, gy - 1, last_node.gy + 2)
         return self, gx, current_y
 
 class Atomic(Node):
@@ -88,46 +143,37 @@ class ForkNode(Node):
     def create_merge(self):
         return self.merge
 
-    def measure_width(self):
-        if not self.children:
-            return 1
-        widths = [c.measure_width() for c in self.children]
-        return sum(widths) + (len(widths)-1)  # 1-cell gap between branches
+    def _measure_steps(self):
+        widths = yield from _child_widths(self)
+        # 1-cell gap between branches
+        self._width = sum(widths) + (len(widths)-1) if widths else 1
+
+def _child_widths(node):
+    # Step generator: widths of node's children, measuring uncached ones first
+    for c in node.children:
+        if c._width is None:
+            yield c._measure_steps()
+    return [c._width for c in node.children]
 
 def _layout_forklike(self, gx, gy):
     # Used by Parallel and Select
     self.gx, self.gy = gx, gy
     merge = self.create_merge()
-    widths = [c.measure_width() for c in self.children]
+    widths = yield from _child_widths(self)
     total_width = sum(widths) + (len(widths)-1)
     start_x = gx - total_width // 2
     current_x = start_x
     max_y = gy
-    min_gx = max_gx = gx
-    min_gy = max_gy = gy
-    last_node = self
     for i, child in enumerate(self.children):
         cw = widths[i]
         child_center_x = current_x + cw // 2
-        last, _, child_end_y = child.layout(child_center_x, gy + 1)
+        last, _, child_end_y = yield child._layout_steps(child_center_x, gy + 1)
         self.edges.append((self, child))
         last.edges.append((last, merge))
         current_x += cw + 1
         max_y = max(max_y, child_end_y)
-        last_node = last
-        min_gx = min(min_gx, child.gx)
-        max_gx = max(max_gx, child.gx)
-        min_gy = min(min_gy, child.gy)
-        max_gy = max(max_gy, child.gy)
-        if hasattr(child, "bbox") and child.bbox:
-            cminx, cmaxx, cminy, cmaxy = child.bbox
-            min_gx = min(min_gx, cminx)
-            max_gx = max(max_gx, cmaxx)
-            min_gy = min(min_gy, cminy)
-            max_gy = max(max_gy, cmaxy)
     merge.gx, merge.gy = gx, max_y
-    min_gx = min(min_gx, merge.gx, self.gx)
-    self.bbox = (min_gx, max_gx, min_gy - 1, merge.gy)
+    self.bbox = (min(merge.gx, gx), gx, gy - 1, merge.gy)
     return merge, gx, max_y + 1
 
 def _layout_sequential(self, gx, gy):
@@ -135,42 +181,27 @@ def _layout_sequential(self, gx, gy):
     self.gx, self.gy = gx, gy
     merge = self.create_merge()
     current_y = gy + 1
-    min_gx = max_gx = gx
-    min_gy = max_gy = gy
     prev = self
-    last_node = self
     for child in self.children:
-        last, child_gx, next_y = child.layout(gx, current_y)
+        last, child_gx, next_y = yield child._layout_steps(gx, current_y)
         prev.edges.append((prev, child))
         prev = last
-        last_node = last
         current_y = next_y
-        min_gx = min(min_gx, child.gx)
-        max_gx = max(max_gx, child.gx)
-        min_gy = min(min_gy, child.gy)
-        max_gy = max(max_gy, child.gy)
-        if hasattr(child, "bbox") and child.bbox:
-            cminx, cmaxx, cminy, cmaxy = child.bbox
-            min_gx = min(min_gx, cminx)
-            max_gx = max(max_gx, cmaxx)
-            min_gy = min(min_gy, cminy)
-            max_gy = max(max_gy, cmaxy)
     prev.edges.append((prev, merge))
     merge.gx, merge.gy = gx, current_y
-    min_gx = min(min_gx, merge.gx, self.gx - 1)
-    self.bbox = (min_gx, max_gx, min_gy - 1, merge.gy)
+    self.bbox = (min(merge.gx, gx - 1), gx, gy - 1, merge.gy)
     return merge, gx, current_y + 1
 
 class Parallel(ForkNode):
     def __init__(self, name=None):
         super().__init__(name or "Parallel")
-    def layout(self, gx, gy):
+    def _layout_steps(self, gx, gy):
         return _layout_forklike(self, gx, gy)
 
 class Select(ForkNode):
     def __init__(self, name=None):
         super().__init__(name or "Select")
-    def layout(self, gx, gy):
+    def _layout_steps(self, gx, gy):
         return _layout_forklike(self, gx, gy)
 
 class Sequence(Node):
@@ -179,172 +210,320 @@ class Sequence(Node):
         self.merge = Merge(f"End_{self.name}")
     def create_merge(self):
         return self.merge
-    def measure_width(self):
-        if not self.children:
-            return 1
-        return max([c.measure_width() for c in self.children])
-    def layout(self, gx, gy):
+    def _measure_steps(self):
+        widths = yield from _child_widths(self)
+        self._width = max(widths) if widths else 1
+    def _layout_steps(self, gx, gy):
         return _layout_sequential(self, gx, gy)
 
 class Repeat(ForkNode):
+    times = None  # n of repeat(n), when known
+
     def __init__(self, name=None):
         super().__init__(name or "Repeat")
-    def layout(self, gx, gy):
+    def _layout_steps(self, gx, gy):
         return _layout_sequential(self, gx, gy)
 
+def layout_graph(root, gx=0, gy=0):
+    """
+    Lays out the tree under root with its top at (gx, gy) and fills in the
+    bbox of every container in one bottom-up pass (see _aggregate_bboxes).
+    Returns a LayoutResult whose extents cover every node position in the
+    layout, so callers do not have to rescan the nodes for bounds.
+    """
+    last, gx, next_y = run_steps(root._layout_steps(gx, gy))
+    extents = _aggregate_bboxes(root)
+    return LayoutResult(last, gx, next_y, extents)
+
+def _aggregate_bboxes(root):
+    # Number the tree in pre-order: every node comes before its subtree, so
+    # one reverse scan folding each node's x-range into its parent's is a
+    # segmented min/max over all subtree ranges at once.
+    order = []
+    parent = array('i')
+    min_x = array('i')
+    max_x = array('i')
+    min_gx = max_gx = root.gx
+    min_gy = max_gy = root.gy
+    stack = [(root, -1)]
+    while stack:
+        node, p = stack.pop()
+        index = len(order)
+        order.append(node)
+        parent.append(p)
+        bbox = node.bbox
+        if bbox is None:
+            min_x.append(node.gx)
+            max_x.append(node.gx)
+        else:
+            # Own box set by the layout step, before any child is folded in
+            min_x.append(bbox[0])
+            max_x.append(bbox[1])
+        # Node positions for the extents; merges and template copies sit
+        # outside the child lists
+        lo_x = hi_x = node.gx
+        lo_y = hi_y = node.gy
+        merge = getattr(node, "merge", None)
+        if merge is not None:
+            hi_y = max(hi_y, merge.gy)
+        template = getattr(node, "template", None)
+        if template is not None:
+            t_min_gx, t_max_gx, t_min_gy, t_max_gy = template.extents
+            lo_x, hi_x = node.gx + t_min_gx, node.gx + t_max_gx
+            lo_y, hi_y = node.gy + t_min_gy, node.gy + t_max_gy
+            if isinstance(node, RepeatIterations):
+                hi_y += (node.times - 1) * template.height
+        min_gx = min(min_gx, lo_x)
+        max_gx = max(max_gx, hi_x)
+        min_gy = min(min_gy, lo_y)
+        max_gy = max(max_gy, hi_y)
+        stack.extend((c, index) for c in reversed(node.children))
+
+    for i in range(len(order) - 1, -1, -1):
+        node = order[i]
+        bbox = node.bbox
+        if bbox is not None:
+            min_x[i] -= node.bbox_margin
+            node.bbox = (min_x[i], max_x[i], bbox[2], bbox[3])
+        p = parent[i]
+        if p >= 0:
+            if min_x[i] < min_x[p]:
+                min_x[p] = min_x[i]
+            if max_x[i] > max_x[p]:
+                max_x[p] = max_x[i]
+    return (min_gx, max_gx, min_gy, max_gy)
+
+def extend_extents(extents, *nodes):
+    """Grows (min_gx, max_gx, min_gy, max_gy) to include the given nodes, e.g. Start/End."""
+    min_gx, max_gx, min_gy, max_gy = extents
+    for n in nodes:
+        min_gx, max_gx = min(min_gx, n.gx), max(max_gx, n.gx)
+        min_gy, max_gy = min(min_gy, n.gy), max(max_gy, n.gy)
+    return (min_gx, max_gx, min_gy, max_gy)
+
+class ActionTemplate:
+    """Action body built and laid out once at (0, 0), shared by all its ActionInstances."""
+    def __init__(self, name, root):
+        self.name = name
+        self.root = root
+        self.exit, _, self.height, self.extents = layout_graph(root, 0, 0)
+        self.width = root.measure_width()
+        self.bbox = root.bbox
+
+class ActionInstance(Node):
+    """
+    One occurrence of a shared ActionTemplate, placed at (gx, gy).
+    Edges into the instance stand for edges into the template root and
+    edges out of it stand for edges out of the template exit node.
+    """
+    def __init__(self, template):
+        super().__init__(template.name, node_type="instance")
+        self.template = template
+
+    def _measure_steps(self):
+        yield from ()
+        self._width = self.template.width
+
+    def _layout_steps(self, gx, gy):
+        yield from ()
+        self.gx, self.gy = gx, gy
+        if self.template.bbox:
+            min_gx, max_gx, min_gy, max_gy = self.template.bbox
+            self.bbox = (min_gx + gx, max_gx + gx, min_gy + gy, max_gy + gy)
+        return self, gx, gy + self.template.height
+
+class RepeatIterations(Node):
+    """
+    The iterations of an unrolled repeat(n): `times` copies of one shared
+    ActionTemplate body stacked from (gx, gy), iteration k at
+    (gx, gy + k * template.height). Only the body is built, so memory does
+    not grow with times. Edges into the node stand for edges into the first
+    iteration's root, edges out of it for edges out of the last iteration's
+    exit node, and each iteration's exit leads to the next one's root.
+    """
+    def __init__(self, template, times):
+        super().__init__(template.name, node_type="iterations")
+        self.template = template
+        self.times = times
+
+    def _measure_steps(self):
+        yield from ()
+        self._width = self.template.width
+
+    def _layout_steps(self, gx, gy):
+        yield from ()
+        self.gx, self.gy = gx, gy
+        height = self.template.height
+        if self.template.bbox:
+            min_gx, max_gx, min_gy, max_gy = self.template.bbox
+            self.bbox = (min_gx + gx, max_gx + gx, min_gy + gy, max_gy + gy + (self.times - 1) * height)
+        return self, gx, gy + self.times * height
+
+def _template_steps(name, ctx):
+    # Step generator returning the shared ActionTemplate for action `name`
+    templates = ctx.templates
+    if name in templates:
+        if templates[name] is None:
+            raise ValueError(f"Recursive action reference: {name}")
+        return templates[name]
+    templates[name] = None  # marks the action as being built
+    root = yield _build_steps(ctx.action_map[name], ctx)
+    templates[name] = ActionTemplate(name, root)
+    return templates[name]
+
+def iter_nodes_edges(root, visited=None):
+    """
+    Walks the graph reachable from root along node.edges, depth-first.
+    Yields ("node", node) the first time a node is reached and
+    ("edge", (src, dst)) for every edge, in a stable order. visited is a
+    set of nodes that are skipped (and filled in) by the walk; nodes are
+    kept rather than their id(), since graph_store.StoreNode views are
+    created per access and compare by store entry.
+    """
+    if visited is None:
+        visited = set()
+    if root in visited:
+        return
+    visited.add(root)
+    yield "node", root
+
+    # Explicit stack of edge iterators instead of recursion
+    stack = [iter(root.edges)]
+    while stack:
+        e = next(stack[-1], None)
+        if e is None:
+            stack.pop()
+            continue
+        yield "edge", e
+        child = e[1]
+        if child not in visited:
+            visited.add(child)
+            yield "node", child
+            stack.append(iter(child.edges))
+
 def collect_nodes_edges(node, nodes=None, edges=None, visited=None):
     if nodes is None: nodes = []
     if edges is None: edges = []
-    if visited is None: visited = set()
-
-    if node in visited:
-        return nodes, edges
-
-    visited.add(node)
-
-    if node not in nodes:
-        nodes.append(node)
-
-    for e in node.edges:
-        edges.append(e)
-        collect_nodes_edges(e[1], nodes, edges, visited)
-
+    for kind, item in iter_nodes_edges(node, visited):
+        if kind == "node":
+            nodes.append(item)
+        else:
+            edges.append(item)
     return nodes, edges
 
 
 # Convert JSON to node objects
 
 
-def build_tree_from_json(node_json, action_map=None, skip_compound=True):
-    t = node_json["type"]
-    name = node_json.get("name")
-    if t == "atomic":
-        return Atomic(name)
-    elif t == "sequence":
-        seq = Sequence(name)
-        for c in node_json["children"]:
-            seq.add_child(build_tree_from_json(c, action_map, skip_compound))
-        return seq
-    elif t == "parallel":
-        par = Parallel(name)
-        for c in node_json["children"]:
-            par.add_child(build_tree_from_json(c, action_map, skip_compound))
-        return par
-    elif t == "select":
-        sel = Select(name)
-        for c in node_json["children"]:
-            sel.add_child(build_tree_from_json(c, action_map, skip_compound))
-        return sel
-    elif t == "repeat":
-        rep = Repeat(name)
-        for c in node_json["children"]:
-            rep.add_child(build_tree_from_json(c, action_map, skip_compound))
-        return rep
-    elif t == "activity":
-        # Do not create a redundant activity node, just return its children as a sequence if needed
-        children = node_json.get("children", [])
-        if len(children) == 1:
-            return build_tree_from_json(children[0], action_map, skip_compound)
-        elif children:
-            seq = Sequence(name or "activity")
-            for c in children:
-                seq.add_child(build_tree_from_json(c, action_map, skip_compound))
-            return seq
-        else:
-            return Sequence(name or "activity")
-    elif t == "action":
-        if skip_compound:
-            children = node_json.get("children", [])
-            if not children:
-                # atomic action, just return Atomic node
-                return Atomic(name)
-            elif len(children) == 1:
-                # single child, return it directly
-                return build_tree_from_json(children[0], action_map, skip_compound)
-            else:
-                # multiple children, wrap in sequence
-                seq = Sequence(name or "action")
-                for c in children:
-                    seq.add_child(build_tree_from_json(c, action_map, skip_compound))
-                return seq
-        else:
-            act = CompoundAction(name)
-            for c in node_json["children"]:
-                act.add_child(build_tree_from_json(c, action_map, skip_compound))
-            return act
-    elif t == "ref":
-        ref_name = node_json["name"]
-        if action_map and ref_name in action_map:
-            return build_tree_from_json(action_map[ref_name], action_map, skip_compound)
-        else:
-            return Atomic(ref_name)
+def build_tree_from_json(node_json, action_map=None, skip_compound=True, templates=None, store=None,
+                         unroll=False):
+    """
+    Builds a Node tree from parsed JSON. When a templates dict is given,
+    every referenced action is built and laid out once as an ActionTemplate
+    (cached in that dict by name) and each `ref` becomes an ActionInstance
+    pointing at it, so node count follows the source instead of the
+    fully expanded tree.
+    When a graph_store.GraphStore is given, nodes are appended to it and
+    the root's StoreNode view is returned instead of Node objects.
+    With unroll, the body of every repeat(n) is built and laid out once and
+    its iterations are one RepeatIterations node instead of a loop.
+    """
+    if store is not None and templates is not None:
+        raise ValueError("Shared templates are not supported when building into a GraphStore.")
+    if store is not None and unroll:
+        raise ValueError("Unrolled repeats are not supported when building into a GraphStore.")
+    ctx = _BuildContext(action_map, skip_compound, templates, store, unroll)
+    return run_steps(_build_steps(node_json, ctx))
+
+class _BuildContext:
+    # Settings and bookkeeping shared by one build_tree_from_json call
+    def __init__(self, action_map, skip_compound, templates, store, unroll=False):
+        self.action_map = action_map
+        self.skip_compound = skip_compound
+        self.templates = templates
+        self.store = store
+        self.unroll = unroll
+        self.expanding = set()  # refs currently expanded in place, to catch cycles
+
+    def make(self, cls, name):
+        if self.store is not None:
+            return self.store.add_node(cls, name)
+        return cls(name)
+
+def _build_children_steps(node, children_json, ctx):
+    for c in children_json:
+        node.add_child((yield _build_steps(c, ctx)))
+    return node
+
+def _unrolled_repeat_steps(node, children_json, ctx):
+    # The repeat's children, in a Sequence if there are several, become the
+    # body template of a RepeatIterations child; the name is unique per graph
+    if len(children_json) == 1:
+        root = yield _build_steps(children_json[0], ctx)
     else:
-        raise ValueError(f"Unknown type: {t}")
-def build_tree_from_json(node_json, action_map=None, skip_compound=True):
+        root = yield _build_children_steps(Sequence(node.name), children_json, ctx)
+    body = ActionTemplate(f"{node.name}#{node.id}", root)
+    node.add_child(RepeatIterations(body, node.times))
+    return node
+
+def _build_steps(node_json, ctx):
+    # Step generator behind build_tree_from_json
     t = node_json["type"]
     name = node_json.get("name")
     if t == "atomic":
-        return Atomic(name)
+        return ctx.make(Atomic, name)
     elif t == "sequence":
-        seq = Sequence(name)
-        for c in node_json["children"]:
-            seq.add_child(build_tree_from_json(c, action_map, skip_compound))
-        return seq
+        return (yield _build_children_steps(ctx.make(Sequence, name), node_json["children"], ctx))
     elif t == "parallel":
-        par = Parallel(name)
-        for c in node_json["children"]:
-            par.add_child(build_tree_from_json(c, action_map, skip_compound))
-        return par
+        return (yield _build_children_steps(ctx.make(Parallel, name), node_json["children"], ctx))
     elif t == "select":
-        sel = Select(name)
-        for c in node_json["children"]:
-            sel.add_child(build_tree_from_json(c, action_map, skip_compound))
-        return sel
+        return (yield _build_children_steps(ctx.make(Select, name), node_json["children"], ctx))
     elif t == "repeat":
-        rep = Repeat(name)
-        for c in node_json["children"]:
-            rep.add_child(build_tree_from_json(c, action_map, skip_compound))
-        return rep
+        node = ctx.make(Repeat, name)
+        if ctx.store is None:
+            node.times = node_json.get("times")
+        if ctx.unroll and node.times and node_json["children"]:
+            return (yield _unrolled_repeat_steps(node, node_json["children"], ctx))
+        return (yield _build_children_steps(node, node_json["children"], ctx))
     elif t == "activity":
         # Do not create a redundant activity node, just return its children as a sequence if needed
         children = node_json.get("children", [])
         if len(children) == 1:
-            return build_tree_from_json(children[0], action_map, skip_compound)
+            return (yield _build_steps(children[0], ctx))
         elif children:
-            seq = Sequence(name or "activity")
-            for c in children:
-                seq.add_child(build_tree_from_json(c, action_map, skip_compound))
-            return seq
+            return (yield _build_children_steps(ctx.make(Sequence, name or "activity"), children, ctx))
         else:
-            return Sequence(name or "activity")
+            return ctx.make(Sequence, name or "activity")
     elif t == "action":
-        if skip_compound:
+        if ctx.skip_compound:
             children = node_json.get("children", [])
             if not children:
                 # atomic action, just return Atomic node
-                return Atomic(name)
+                return ctx.make(Atomic, name)
             elif len(children) == 1:
                 # single child, return it directly
-                return build_tree_from_json(children[0], action_map, skip_compound)
+                return (yield _build_steps(children[0], ctx))
             else:
                 # multiple children, wrap in sequence
-                seq = Sequence(name or "action")
-                for c in children:
-                    seq.add_child(build_tree_from_json(c, action_map, skip_compound))
-                return seq
+                return (yield _build_children_steps(ctx.make(Sequence, name or "action"), children, ctx))
         else:
-            act = CompoundAction(name)
-            for c in node_json["children"]:
-                act.add_child(build_tree_from_json(c, action_map, skip_compound))
-            return act
+            return (yield _build_children_steps(ctx.make(CompoundAction, name), node_json["children"], ctx))
     elif t == "ref":
         ref_name = node_json["name"]
-        if action_map and ref_name in action_map:
-            return build_tree_from_json(action_map[ref_name], action_map, skip_compound)
+        if ctx.action_map and ref_name in ctx.action_map:
+            if ctx.templates is not None:
+                template = yield _template_steps(ref_name, ctx)
+                if isinstance(template.root, Atomic):
+                    # Nothing to share for a leaf action
+                    return ctx.make(Atomic, ref_name)
+                return ActionInstance(template)
+            if ref_name in ctx.expanding:
+                raise ValueError(f"Recursive action reference: {ref_name}")
+            ctx.expanding.add(ref_name)
+            node = yield _build_steps(ctx.action_map[ref_name], ctx)
+            ctx.expanding.discard(ref_name)
+            return node
         else:
-            return Atomic(ref_name)
+            return ctx.make(Atomic, ref_name)
     else:
         raise ValueError(f"Unknown type: {t}")
-
-
-
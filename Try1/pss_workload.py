@@ -0,0 +1,77 @@
+# pss_workload.py
+"""
+Synthetic PSS workloads for benchmarks.
+
+generate_pss() writes a document of atomic actions and `levels` levels of
+compound actions. Each compound action's activity is a tree of operator
+blocks `depth` deep with `fanout` children per block, operators drawn from
+`mix` (weights for sequence/parallel/select/repeat). Leaves reference an
+action of a lower level with probability `reuse` and an atomic action
+otherwise, so reuse controls how much larger the expanded graph is than
+the source. A final `test` action references the top level.
+
+Usage: python pss_workload.py [preset] > workload.pss
+"""
+import random
+import sys
+
+OPERATORS = ("sequence", "parallel", "select", "repeat")
+
+# Named parameter sets used by benchmark.py
+PRESETS = {
+    "wide":   dict(levels=2, actions_per_level=6, depth=2, fanout=8, reuse=0.2),
+    "deep":   dict(levels=2, actions_per_level=4, depth=7, fanout=2, reuse=0.1),
+    "reuse":  dict(levels=4, actions_per_level=3, depth=2, fanout=3, reuse=0.6),
+    "mixed":  dict(levels=3, actions_per_level=5, depth=3, fanout=3, reuse=0.3,
+                   mix={"sequence": 3, "parallel": 2, "select": 2, "repeat": 1}),
+}
+
+
+def generate_pss(levels=3, actions_per_level=4, depth=2, fanout=3, mix=None,
+                 reuse=0.3, atomics=8, seed=0):
+    """Returns the PSS text of a synthetic workload (see the module docstring)."""
+    rnd = random.Random(seed)
+    mix = mix or {op: 1 for op in OPERATORS}
+    operators = [op for op in OPERATORS if mix.get(op)]
+    weights = [mix[op] for op in operators]
+    atomic_names = [f"Atom{i}" for i in range(atomics)]
+    lines = [f"action {name} {{}}" for name in atomic_names]
+    lower = []  # compound actions of the levels below
+
+    def block(level, indent):
+        # Lines of one operator block, `level` more levels deep
+        pad = "  " * indent
+        if level == 0:
+            if lower and rnd.random() < reuse:
+                return [f"{pad}{rnd.choice(lower)};"]
+            return [f"{pad}{rnd.choice(atomic_names)};"]
+        op = rnd.choices(operators, weights)[0]
+        head = f"repeat({rnd.randint(2, 4)})" if op == "repeat" else op
+        out = [f"{pad}{head} {{"]
+        for _ in range(fanout):
+            out.extend(block(level - 1, indent + 1))
+        out.append(f"{pad}}}")
+        return out
+
+    for level in range(levels):
+        names = [f"L{level}_{k}" for k in range(actions_per_level)]
+        for name in names:
+            lines.append(f"action {name} {{")
+            lines.append("  activity {")
+            lines.extend(block(depth, 2))
+            lines.append("  }")
+            lines.append("}")
+        lower = names
+    lines.append("action test {")
+    lines.append("  activity {")
+    lines.append("    sequence {")
+    lines.extend(f"      {name};" for name in (lower or atomic_names))
+    lines.append("    }")
+    lines.append("  }")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    preset = sys.argv[1] if len(sys.argv) > 1 else "mixed"
+    sys.stdout.write(generate_pss(**PRESETS[preset]))
@@ -1,13 +1,37 @@
 // static/js/graph.js
+import { GraphLoader, GraphState, findTile, tileKey, tileOf, TILE, HIDDEN, HAS_BBOX, HIT_BBOX_TYPES } from "./graph_data.js";
+
 let canvas, ctx;
 
-// Data
-let nodes = [];
-let edges = []; // normalized to [{from, to}]
+// Data: the packed graph shown (see graph_data.GraphState.pack)
+let graph = { ...new GraphState().pack().graph, typeColor: [] };
+// Batched drawing of the tiles around the view, rebuilt when the view
+// leaves them or the level of detail changes (see buildScene)
+let scene = null;
+
+// Graph loading runs in graph_worker.js, or in the page without workers
+let loader = null;
+let nextRequest = 1;
+const pendingRequests = new Map();
 
 // Layout constants (model space is in "graph pixels")
 const CELL = 80;
 const MARGIN = 40;
+const NODE_W = CELL * 0.9;
+const NODE_H = CELL * 0.5;
+const NODE_R = 12;
+const LABEL_FONT = `${Math.max(12, NODE_H * 0.4)}px sans-serif`;
+
+// Level of detail: below DOT_SCALE nodes are DOT_PX dots without labels,
+// and bboxes smaller than BBOX_MIN_PX on screen are left to the one
+// enclosing them
+const DOT_SCALE = 0.3;
+const DOT_PX = 3;
+const BBOX_MIN_PX = 24;
+const GRID_MIN_PX = 8;
+// A scene covers the view and SCENE_PAD of its size on each side, so
+// panning redraws it until the view leaves it
+const SCENE_PAD = 0.25;
 
 // View transform (screen = offset + scale * model)
 let scale = 1;
@@ -20,6 +44,7 @@ let panStartX = 0;
 let panStartY = 0;
 let hoverNode = null;
 let selectedNode = null;
+let expandHandler = null;
 
 const typeColors = {
   atomic:  '#4a90e2',
@@ -30,7 +55,8 @@ const typeColors = {
   end:     '#d0021b',
   merge:   '#f8e71c',
   compoundaction: '#ffdc78',
-  action: '#ffdc78'
+  action: '#ffdc78',
+  actioninstance: '#ffdc78'
 };
 
 // ---------- Public API ----------
@@ -106,26 +132,106 @@ export function initGraph(canvasElement) {
       showNodeInfo(selectedNode);
       renderGraph();
     });
+
+    // Double click on a placeholder of a collapsed graph -> expand it
+    canvas.addEventListener('dblclick', (e) => {
+      const rect = canvas.getBoundingClientRect();
+      const node = hitTest(e.clientX - rect.left, e.clientY - rect.top);
+      if (node && node.type === 'actioninstance' && expandHandler) expandHandler(node);
+    });
   }
 }
 
-export function updateGraph(newNodes, newEdges) {
-  
-  nodes = Array.isArray(newNodes) ? newNodes : [];
+// handler(node) is called when a placeholder ("actioninstance") node is double-clicked
+export function setExpandHandler(handler) {
+  expandHandler = handler;
+}
 
-  // Normalize edges to [{from,to}]
-  edges = (Array.isArray(newEdges) ? newEdges : []).map(e => {
-    if (Array.isArray(e) && e.length >= 2) return { from: e[0], to: e[1] };
-    if ('from' in e && 'to' in e) return { from: e.from, to: e.to };
-    if ('source' in e && 'target' in e) return { from: e.source, to: e.target };
-    return null;
-  }).filter(Boolean);
+// Fetches a graph in the loader, so the response is parsed, decoded and
+// indexed off the main thread. The graph is the response body, or its
+// `field` member; with expand (a placeholder id) the body is its /expand
+// subtree, spliced into the graph shown. Resolves to {status, ok, data,
+// graph}: graph (status 200) is passed to showGraph, data holds the other
+// members of the body, or the whole body of a non-200 response.
+export function fetchGraph(url, init = {}, { field = null, expand = null } = {}) {
+  return loaderRequest({ op: 'load', url, init, field, expand });
+}
 
-  // Fit view to graph (center & scale to margins)
-  fitToGraph();
+// Shows a graph from fetchGraph; the view is refit unless it is an expansion
+export function showGraph(packed) {
+  graph = packed;
+  if (graph.missingEdges) console.warn(`${graph.missingEdges} edges skipped (missing src/dst)`);
+  [graph, ...graph.bodies].forEach(g => { g.typeColor = g.types.map(type => typeColors[type] || '#ffffff'); });
+  scene = null;
+  if (loader instanceof GraphLoader) loader.handle({ op: 'show', id: graph.id });
+  else loader.postMessage({ op: 'show', id: graph.id });
+
+  if (graph.expanded) {
+    // Indices moved: find the hovered and selected nodes again by id
+    const relocate = n => {
+      const i = n ? graph.ids.indexOf(n.id) : -1;
+      return i < 0 ? null : nodeAt(graph, i);
+    };
+    hoverNode = relocate(hoverNode);
+    selectedNode = relocate(selectedNode);
+  } else {
+    hoverNode = selectedNode = null;
+    fitToGraph();
+  }
   renderGraph();
 }
 
+// newNodes/newEdges: node rows and edges ([from, to], {from, to} or {source, target})
+// extents: optional [minGX, maxGX, minGY, maxGY] from the server layout
+// expand: optional { id, entry, exit } from /expand; newNodes/newEdges are then
+// the subtree of placeholder id and are spliced into the current graph
+// newNodes may also be a whole columnar graph (JSON or binary); the other
+// arguments are then taken from it
+export async function updateGraph(newNodes, newEdges, templates = null, extents = null, expand = null) {
+  const columnar = newNodes instanceof ArrayBuffer || (newNodes && newNodes.format === 'columnar');
+  const data = columnar ? newNodes : { nodes: newNodes, edges: newEdges, templates, extents, ...(expand || {}) };
+  const { graph: packed } = await loaderRequest({ op: 'load', graph: data, expand: expand ? expand.id : null });
+  showGraph(packed);
+}
+
+function loaderRequest(msg) {
+  if (!loader) loader = startLoader();
+  msg.id = nextRequest++;
+  if (loader instanceof GraphLoader) return loader.handle(msg).then(({ reply }) => reply);
+  return new Promise((resolve, reject) => {
+    pendingRequests.set(msg.id, { resolve, reject });
+    loader.postMessage(msg);
+  });
+}
+
+function startLoader() {
+  if (typeof Worker === 'undefined') return new GraphLoader();
+  const worker = new Worker(new URL('./graph_worker.js', import.meta.url), { type: 'module' });
+  worker.onmessage = ({ data }) => {
+    const request = pendingRequests.get(data.id);
+    pendingRequests.delete(data.id);
+    if (data.error) request.reject(new Error(data.error));
+    else request.resolve(data);
+  };
+  return worker;
+}
+
+// Node object of node i of packed graph g (the graph shown or a repeat body
+// drawn shifted by dx, dy with ids prefixed), for hit testing and node info
+function nodeAt(g, i, dx = 0, dy = 0, prefix = '') {
+  const { ids, names, types, name, type, template, gx, gy, bbox, flags } = g;
+  const node = {
+    id: prefix + ids[i], name: names[name[i]], type: types[type[i]],
+    gx: gx[i] + dx, gy: gy[i] + dy, hidden: Boolean(flags[i] & HIDDEN)
+  };
+  if (flags[i] & HAS_BBOX) {
+    const [min_gx, max_gx, min_gy, max_gy] = bbox.subarray(4 * i, 4 * i + 4);
+    node.bbox = [min_gx + dx, max_gx + dx, min_gy + dy, max_gy + dy];
+  }
+  if (template[i] >= 0) node.template = names[template[i]];
+  return node;
+}
+
 // ---------- Rendering ----------
 
 function resizeCanvas() {
@@ -134,12 +240,10 @@ function resizeCanvas() {
 }
 
 function fitToGraph() {
-  if (!nodes.length) return;
+  if (!graph.count) return;
 
-  const minGX = Math.min(...nodes.map(n => n.gx));
-  const maxGX = Math.max(...nodes.map(n => n.gx));
-  const minGY = Math.min(...nodes.map(n => n.gy));
-  const maxGY = Math.max(...nodes.map(n => n.gy));
+  // Layout extents, or the node extents computed by the loader
+  const [minGX, maxGX, minGY, maxGY] = graph.extents;
 
   const graphW = (maxGX - minGX + 1) * CELL;
   const graphH = (maxGY - minGY + 1) * CELL;
@@ -164,15 +268,14 @@ function renderGraph() {
   ctx.translate(offsetX, offsetY);
   ctx.scale(scale, scale);
 
+  const view = viewRect();
+  const lod = scale < DOT_SCALE ? scale : 0;  // dots depend on the scale, full detail does not
+  if (!sceneFits(view, lod)) scene = buildScene(sceneRect(view), lod);
   drawGrid();
   drawEdges();
 
   // Highlight bbox only if hovering close to the node center (within 1.5*CELL*scale)
-  if (
-    hoverNode &&
-    hoverNode.bbox &&
-    ["parallel", "select", "repeat", "sequence", "compoundaction", "action"].includes(hoverNode.type)
-  ) {
+  if (hoverNode && hoverNode.bbox && HIT_BBOX_TYPES.includes(hoverNode.type)) {
     // Find the node center
     const x = hoverNode.gx * CELL;
     const y = hoverNode.gy * CELL;
@@ -204,7 +307,8 @@ function renderGraph() {
 }
 
 function drawGrid() {
-  if (!nodes.length) return;
+  // Skipped when cells are too small on screen to tell apart
+  if (!graph.count || CELL * scale < GRID_MIN_PX) return;
 
   // Draw grid across the visible viewport
   const { mx: minMX, my: minMY } = screenToModel(0, 0);
@@ -218,92 +322,231 @@ function drawGrid() {
   ctx.strokeStyle = '#eee';
   ctx.lineWidth = 1 / scale;
 
+  ctx.beginPath();
   for (let gx = startGX; gx <= endGX; gx++) {
     const x = gx * CELL;
-    ctx.beginPath();
     ctx.moveTo(x, startGY * CELL);
     ctx.lineTo(x, endGY * CELL);
-    ctx.stroke();
   }
   for (let gy = startGY; gy <= endGY; gy++) {
     const y = gy * CELL;
-    ctx.beginPath();
     ctx.moveTo(startGX * CELL, y);
     ctx.lineTo(endGX * CELL, y);
-    ctx.stroke();
   }
+  ctx.stroke();
 }
 
-function drawEdges() {
-  // Softer edge color and thinner lines
-  ctx.strokeStyle = "rgba(80,80,80,0.45)";
-  ctx.lineWidth = 1.2 / scale;
-
-  edges.forEach(e => {
-    const src = nodes.find(n => n.id === e.from || n.id === e.source);
-    const dst = nodes.find(n => n.id === e.to   || n.id === e.target);
+// Model-space [x, y, w, h] of the bbox of node i of packed graph g shifted by dx, dy cells
+function bboxRect(g, i, dx = 0, dy = 0) {
+  const b = g.bbox;
+  const [min_gx, max_gx, min_gy, max_gy] = [b[4 * i] + dx, b[4 * i + 1] + dx, b[4 * i + 2] + dy, b[4 * i + 3] + dy];
+  return [min_gx * CELL, min_gy * CELL, (max_gx - min_gx + 1) * CELL, (max_gy - min_gy + 1) * CELL];
+}
 
-    if (!src || !dst) {
-      console.warn("Edge skipped (missing src/dst):", e);
-      return;
+// Calls fn with the index of every tile of packed graph g overlapping the
+// model rect [x0, y0, x1, y1] (in g's own coordinates); only tiles within a
+// tile of g's extents are looked up, so a zoomed-out view costs no more
+// than the graph has tiles
+function forEachTile(g, [x0, y0, x1, y1], fn) {
+  const keys = g.tiles.keys;
+  if (!keys.length) return;
+  const [minGX, maxGX, minGY, maxGY] = g.extents;
+  const tx0 = Math.max(Math.floor(x0 / CELL / TILE), tileOf(minGX) - 1);
+  const ty0 = Math.max(Math.floor(y0 / CELL / TILE), tileOf(minGY) - 1);
+  const tx1 = Math.min(Math.floor(x1 / CELL / TILE), tileOf(maxGX) + 1);
+  const ty1 = Math.min(Math.floor(y1 / CELL / TILE), tileOf(maxGY) + 1);
+  for (let tx = tx0; tx <= tx1; tx++) {
+    for (let ty = ty0; ty <= ty1; ty++) {
+      const t = findTile(keys, tileKey(tx, ty));
+      if (t >= 0) fn(t);
     }
+  }
+}
 
-    ctx.beginPath();
-    ctx.moveTo(src.gx * CELL, src.gy * CELL);
-    ctx.lineTo(dst.gx * CELL, dst.gy * CELL);
-    ctx.stroke();
-  });
+// Visible model rect, padded by a cell for nodes centered just outside it
+function viewRect() {
+  const { mx: x0, my: y0 } = screenToModel(0, 0);
+  const { mx: x1, my: y1 } = screenToModel(canvas.width, canvas.height);
+  return [x0 - CELL, y0 - CELL, x1 + CELL, y1 + CELL];
 }
 
+// Model rect of the tiles a scene for view rect [x0, y0, x1, y1] covers
+function sceneRect([x0, y0, x1, y1]) {
+  const padX = (x1 - x0) * SCENE_PAD, padY = (y1 - y0) * SCENE_PAD;
+  const size = TILE * CELL;
+  return [Math.floor((x0 - padX) / size) * size, Math.floor((y0 - padY) / size) * size,
+          Math.ceil((x1 + padX) / size) * size, Math.ceil((y1 + padY) / size) * size];
+}
+
+// Whether the scene can draw view rect [x0, y0, x1, y1] at lod: it covers
+// the view and, after zooming in, is not more than twice as wide as a new one
+function sceneFits(view, lod) {
+  if (!scene || scene.lod !== lod) return false;
+  const [x0, y0, x1, y1] = view;
+  const [u0, v0, u1, v1] = scene.rect;
+  const [w0, , w1] = sceneRect(view);
+  return u0 <= x0 && v0 <= y0 && u1 >= x1 && v1 >= y1 && u1 - u0 <= 2 * (w1 - w0);
+}
+
+// Iterations k0..k1 of unrolled repeat r of packed graph g (shifted by dx,
+// dy cells) that may overlap the cell rows y0..y1; an extra one on each
+// side for bboxes reaching past the body's nodes
+function visibleIterations(g, r, dy, y0, y1) {
+  const body = graph.bodies[r.body];
+  const [, , minGY, maxGY] = body.extents;
+  const top = g.gy[r.node] + dy;
+  const k0 = Math.max(0, Math.floor((y0 - top - maxGY) / body.step) - 1);
+  const k1 = Math.min(r.times - 1, Math.ceil((y1 - top - minGY) / body.step) + 1);
+  return [k0, k1];
+}
+
+// Model-space Path2Ds of the tiles in model rect `rect`, so a frame is a
+// few strokes and fills instead of one path per node and edge, and panning
+// within rect builds nothing: edges; node rects (or dots) per fill color and
+// their common outline; solid and dashed bboxes. Iterations of unrolled
+// repeats are added from their body's tiles, shifted. lod is the scale
+// dots were laid out for, 0 for full detail.
+function buildScene(rect, lod) {
+  const dots = lod > 0;
+  const edgePath = new Path2D();
+  const fills = new Map();
+  const outline = new Path2D();
+  const bboxes = new Path2D();
+  const dashedBboxes = new Path2D();
+  const labels = [];  // [text, x, y]
+  // Dot mode: one dot per DOT_PX screen square of rect
+  const dotCols = Math.ceil((rect[2] - rect[0]) * scale / DOT_PX) + 2;
+  const dotRows = Math.ceil((rect[3] - rect[1]) * scale / DOT_PX) + 2;
+  const dotTaken = dots ? new Uint8Array(dotCols * dotRows) : null;
+
+  // Dot mode: edges shorter than a dot are hidden by their end dots anyway
+  const minEdge = dots ? DOT_PX / scale / CELL : 0;
+  const addLine = (x0, y0, x1, y1) => {
+    if (minEdge && Math.abs(x1 - x0) + Math.abs(y1 - y0) < minEdge) return;
+    edgePath.moveTo(x0 * CELL, y0 * CELL);
+    edgePath.lineTo(x1 * CELL, y1 * CELL);
+  };
+
+  // Graph g shifted by dx, dy cells (the graph shown, or a repeat iteration)
+  const addGraph = (g, dx, dy) => {
+    const { gx, gy, type, types, flags, edges, tiles, typeColor } = g;
+    const [x0, y0, x1, y1] = rect.map((v, k) => v / CELL - (k % 2 ? dy : dx));
+    // Items found in several tiles are drawn once
+    const edgeSeen = new Uint8Array(edges.length / 2);
+    const boxSeen = new Uint8Array(g.count);
+    const addEdge = k => {
+      if (edgeSeen[k]) return;
+      edgeSeen[k] = 1;
+      const a = edges[2 * k], b = edges[2 * k + 1];
+      addLine(gx[a] + dx, gy[a] + dy, gx[b] + dx, gy[b] + dy);
+    };
+    const addNode = i => {
+      if (flags[i] & HIDDEN) return;
+      const x = (gx[i] + dx) * CELL;
+      const y = (gy[i] + dy) * CELL;
+      const color = typeColor[type[i]];
+      if (!fills.has(color)) fills.set(color, new Path2D());
+      if (dots) {
+        const px = Math.floor((x - rect[0]) * scale / DOT_PX) + 1;
+        const py = Math.floor((y - rect[1]) * scale / DOT_PX) + 1;
+        if (px < 0 || py < 0 || px >= dotCols) return;
+        const slot = py * dotCols + px;
+        if (slot >= dotTaken.length || dotTaken[slot]) return;
+        dotTaken[slot] = 1;
+        const d = DOT_PX / scale;
+        fills.get(color).rect(x - d / 2, y - d / 2, d, d);
+        return;
+      }
+      roundRect(fills.get(color), x - NODE_W / 2, y - NODE_H / 2, NODE_W, NODE_H, NODE_R);
+      roundRect(outline, x - NODE_W / 2, y - NODE_H / 2, NODE_W, NODE_H, NODE_R);
+      labels.push([g.names[g.name[i]] || types[type[i]], x, y]);
+    };
+    const addBox = i => {
+      if (boxSeen[i]) return;
+      boxSeen[i] = 1;
+      const [x, y, w, h] = bboxRect(g, i, dx, dy);
+      if (dots && w * scale < BBOX_MIN_PX && h * scale < BBOX_MIN_PX) return;
+      (types[type[i]] === "actioninstance" ? dashedBboxes : bboxes).rect(x, y, w, h);
+    };
+
+    forEachTile(g, [x0, y0, x1, y1].map(v => v * CELL), t => {
+      for (let k = tiles.edgeStart[t]; k < tiles.edgeStart[t + 1]; k++) addEdge(tiles.edges[k]);
+      for (let k = tiles.nodeStart[t]; k < tiles.nodeStart[t + 1]; k++) addNode(tiles.nodes[k]);
+      for (let k = tiles.boxStart[t]; k < tiles.boxStart[t + 1]; k++) addBox(tiles.boxes[k]);
+    });
+    tiles.longEdges.forEach(k => {
+      const a = edges[2 * k], b = edges[2 * k + 1];
+      if (Math.max(gx[a], gx[b]) >= x0 && Math.min(gx[a], gx[b]) <= x1 &&
+          Math.max(gy[a], gy[b]) >= y0 && Math.min(gy[a], gy[b]) <= y1) {
+        addEdge(k);
+      }
+    });
+
+    // Visible iterations, and the edges from each iteration's exit to the next
+    // one's entry; in dot mode only one iteration per DOT_PX screen rows
+    g.repeats.forEach(r => {
+      const body = graph.bodies[r.body];
+      const [minGX, maxGX] = body.extents;
+      const bx = gx[r.node] + dx;
+      if (bx + maxGX < x0 + dx || bx + minGX > x1 + dx) return;
+      const [k0, k1] = visibleIterations(g, r, dy, y0 + dy, y1 + dy);
+      const by = gy[r.node] + dy;
+      const stride = dots ? Math.max(1, Math.floor(DOT_PX / (body.step * CELL * scale))) : 1;
+      for (let k = k0; k <= k1; k += stride) {
+        addGraph(body, bx, by + k * body.step);
+        const next = Math.min(k + stride, r.times - 1);
+        if (next > k) {
+          addLine(bx + body.gx[body.exit], by + k * body.step + body.gy[body.exit],
+                  bx + body.gx[body.entry], by + next * body.step + body.gy[body.entry]);
+        }
+      }
+    });
+  };
+
+  addGraph(graph, 0, 0);
+  return { rect, lod, dots, edgePath, fills, outline, bboxes, dashedBboxes, labels };
+}
+
+function drawEdges() {
+  // Softer edge color and thinner lines
+  ctx.strokeStyle = "rgba(80,80,80,0.45)";
+  ctx.lineWidth = 1.2 / scale;
+  ctx.stroke(scene.edgePath);
+}
 
 function drawNodes() {
-  nodes.forEach(n => {
-    // Don't draw sequence start/end markers
-    if (n.type === "sequence" && (n.name === "start" || n.name === "end")) return;
-    const x = n.gx * CELL;
-    const y = n.gy * CELL;
-    const w = CELL * 0.9;
-    const h = CELL * 0.5;
-    const r = 12;
-
-    // Draw bounding box for compound actions
-    if (n.bbox && ["compoundaction", "action"].includes(n.type)) {
-      const [min_gx, max_gx, min_gy, max_gy] = n.bbox;
-      ctx.save();
-      ctx.strokeStyle = typeColors[n.type] || '#ffdc78';
-      ctx.lineWidth = 5 / scale;
-      ctx.globalAlpha = 0.5;
-      ctx.beginPath();
-      ctx.rect(
-        min_gx * CELL,
-        min_gy * CELL,
-        (max_gx - min_gx + 1) * CELL,
-        (max_gy - min_gy + 1) * CELL
-      );
-      ctx.stroke();
-      ctx.globalAlpha = 1.0;
-      ctx.restore();
-    }
+  ctx.save();
+  ctx.strokeStyle = '#ffdc78';
+  ctx.lineWidth = 5 / scale;
+  ctx.globalAlpha = 0.5;
+  ctx.stroke(scene.bboxes);
+  ctx.setLineDash([12 / scale, 8 / scale]);
+  ctx.stroke(scene.dashedBboxes);
+  ctx.restore();
 
+  scene.fills.forEach((path, color) => {
+    ctx.fillStyle = color;
+    ctx.fill(path);
+  });
+  if (scene.dots) return;
+  // Hovered and selected nodes are painted over their batched fill
+  [[hoverNode, '#ffec99'], [selectedNode, '#4cafef']].forEach(([n, color]) => {
+    if (!n || n.hidden) return;
     ctx.beginPath();
-    roundRect(ctx, x - w/2, y - h/2, w, h, r);
-    ctx.fillStyle =
-      (selectedNode && selectedNode.id === n.id) ? '#4cafef' :
-      (hoverNode && hoverNode.id === n.id) ? '#ffec99' :
-      (typeColors[n.type] || '#ffffff');
+    roundRect(ctx, n.gx * CELL - NODE_W / 2, n.gy * CELL - NODE_H / 2, NODE_W, NODE_H, NODE_R);
+    ctx.fillStyle = color;
     ctx.fill();
-
-    ctx.strokeStyle = '#333';
-    ctx.lineWidth = 2 / scale;
-    ctx.stroke();
-
-    // Always show label for all nodes except sequence start/end
-    ctx.fillStyle = '#000';
-    ctx.font = `${Math.max(12, h * 0.4)}px sans-serif`;
-    ctx.textAlign = 'center';
-    ctx.textBaseline = 'middle';
-    ctx.fillText(n.name || n.type, x, y);
   });
+  ctx.strokeStyle = '#333';
+  ctx.lineWidth = 2 / scale;
+  ctx.stroke(scene.outline);
+
+  // Always show label for all nodes except sequence start/end
+  ctx.fillStyle = '#000';
+  ctx.font = LABEL_FONT;
+  ctx.textAlign = 'center';
+  ctx.textBaseline = 'middle';
+  scene.labels.forEach(([text, x, y]) => ctx.fillText(text, x, y));
 }
 
 // ---------- Hit testing & helpers ----------
@@ -311,48 +554,62 @@ function drawNodes() {
 function hitTest(sx, sy) {
   // Convert screen -> model
   const { mx, my } = screenToModel(sx, sy);
+  return hitGraph(graph, mx / CELL, my / CELL, 0, 0, '');
+}
 
-  // First, check atomic/regular nodes (so they are clickable even inside compound bbox)
-  const atomicOrRegular = nodes.find(n => {
-    if (n.type === "sequence" && (n.name === "start" || n.name === "end")) return false;
-    const x = n.gx * CELL;
-    const y = n.gy * CELL;
-    const w = CELL * 0.9;
-    const h = CELL * 0.5;
-    return (
-      mx >= x - w / 2 &&
-      mx <= x + w / 2 &&
-      my >= y - h / 2 &&
-      my <= y + h / 2
-    );
+// Node of packed graph g (shifted by dx, dy cells, ids prefixed) at cell
+// position (cx, cy), looking into the iterations of its unrolled repeats
+function hitGraph(g, cx, cy, dx, dy, prefix) {
+  const { gx, gy, flags, tiles } = g;
+  const mx = (cx - dx) * CELL, my = (cy - dy) * CELL;
+
+  // First, check atomic/regular nodes (so they are clickable even inside compound bbox);
+  // the first in node order wins
+  let best = -1;
+  forEachTile(g, [mx - NODE_W / 2, my - NODE_H / 2, mx + NODE_W / 2, my + NODE_H / 2], t => {
+    for (let k = tiles.nodeStart[t]; k < tiles.nodeStart[t + 1]; k++) {
+      const i = tiles.nodes[k];
+      if (flags[i] & HIDDEN || (best >= 0 && i > best)) continue;
+      const x = gx[i] * CELL;
+      const y = gy[i] * CELL;
+      if (
+        mx >= x - NODE_W / 2 &&
+        mx <= x + NODE_W / 2 &&
+        my >= y - NODE_H / 2 &&
+        my <= y + NODE_H / 2
+      ) best = i;
+    }
   });
-  if (atomicOrRegular) return atomicOrRegular;
-
-  // Otherwise, check compound nodes by bbox (larger area)
-  const compoundMatches = nodes.filter(n =>
-    n.bbox &&
-    ["parallel", "select", "repeat", "sequence", "compoundaction", "action"].includes(n.type) &&
-    (() => {
-      const [min_gx, max_gx, min_gy, max_gy] = n.bbox;
-      const x1 = min_gx * CELL, x2 = (max_gx + 1) * CELL;
-      const y1 = min_gy * CELL, y2 = (max_gy + 1) * CELL;
-      return mx >= x1 && mx <= x2 && my >= y1 && my <= y2;
-    })()
-  );
-
-  if (compoundMatches.length > 0) {
-    // Pick the deepest (smallest area) compound node
-    compoundMatches.sort((a, b) => {
-      const [aminx, amaxx, aminy, amaxy] = a.bbox;
-      const [bminx, bmaxx, bminy, bmaxy] = b.bbox;
-      const aArea = (amaxx - aminx + 1) * (amaxy - aminy + 1);
-      const bArea = (bmaxx - bminx + 1) * (bmaxy - bminy + 1);
-      return aArea - bArea;
-    });
-    return compoundMatches[0];
+  if (best >= 0) return nodeAt(g, best, dx, dy, prefix);
+
+  // Then the iterations under the point, with path ids "<iterations id>.<k>."
+  for (const r of g.repeats) {
+    const body = graph.bodies[r.body];
+    const [k0, k1] = visibleIterations(g, r, dy, cy - 1, cy + 1);
+    for (let k = k0; k <= k1; k++) {
+      const node = hitGraph(body, cx, cy, gx[r.node] + dx, gy[r.node] + dy + k * body.step,
+                            `${prefix}${g.ids[r.node]}.${k}.`);
+      if (node) return node;
+    }
   }
 
-  return null;
+  // Otherwise, check compound nodes by bbox (larger area) and pick the
+  // deepest (smallest area) one, from the bboxes of the tile under the point
+  let deepest = -1;
+  let deepestArea = Infinity;
+  const hitBox = i => {
+    const [x, y, w, h] = bboxRect(g, i);
+    if (mx >= x && mx <= x + w && my >= y && my <= y + h && w * h < deepestArea) {
+      deepest = i;
+      deepestArea = w * h;
+    }
+  };
+  const t = findTile(tiles.keys, tileKey(tileOf(cx - dx), tileOf(cy - dy)));
+  if (t >= 0) {
+    for (let k = tiles.hitStart[t]; k < tiles.hitStart[t + 1]; k++) hitBox(tiles.hits[k]);
+  }
+  tiles.longBoxes.forEach(hitBox);
+  return deepest >= 0 ? nodeAt(g, deepest, dx, dy, prefix) : null;
 }
 
 function showNodeInfo(node) {
@@ -367,9 +624,9 @@ function screenToModel(sx, sy) {
   return { mx: (sx - offsetX) / scale, my: (sy - offsetY) / scale };
 }
 
+// Adds a rounded rect subpath to a context or Path2D
 function roundRect(c, x, y, w, h, r) {
   const rr = Math.min(r, w/2, h/2);
-  c.beginPath();
   c.moveTo(x + rr, y);
   c.lineTo(x + w - rr, y);
   c.quadraticCurveTo(x + w, y, x + w, y + rr);
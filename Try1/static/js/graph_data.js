@@ -0,0 +1,592 @@
+// static/js/graph_data.js
+// Graph preparation for the renderer (graph.js), without DOM access so it
+// runs in the loader worker (graph_worker.js): decoding, template
+// expansion, unrolled repeat bodies, edge normalization, extents and the
+// spatial grid, packed into typed arrays that are transferred to the renderer.
+
+// Column order of the columnar format (export_graph.COLUMNS)
+const COLUMNS = ["id", "name", "type", "gx", "gy", "edges", "bbox_nodes", "bbox",
+                 "instance_nodes", "instance_template", "repeat_nodes", "repeat_times"];
+
+// Spatial grid tiles are TILE x TILE cells; edges and hit-tested bboxes
+// spanning more than LONG_EDGE_TILES tiles are kept in lists and checked
+// one by one
+export const TILE = 16;
+const LONG_EDGE_TILES = 8;
+
+// Node flags of a packed graph
+export const HIDDEN = 1;      // sequence start/end marker or repeat anchor, not drawn
+export const HAS_BBOX = 2;
+export const DRAWN_BBOX = 4;  // bbox drawn around the node
+export const HIT_BBOX = 8;    // bbox taken into account by hit testing
+
+const BBOX_TYPES = ["compoundaction", "action", "actioninstance"];
+export const HIT_BBOX_TYPES = ["parallel", "select", "repeat", "sequence", "compoundaction", "action", "actioninstance"];
+
+export function tileOf(g) { return Math.floor(g / TILE); }
+export function tileKey(tx, ty) { return (tx + 0x100000) * 0x200000 + (ty + 0x100000); }
+
+// ---------- Columnar graphs ----------
+
+// Decodes a columnar graph, either the "columnar" JSON from the server or
+// the ArrayBuffer of its binary encoding, into sections whose columns are
+// Int32Arrays. Binary columns are views on the buffer, not copies.
+export function decodeGraph(data) {
+  if (data instanceof ArrayBuffer) return decodeBinaryGraph(data);
+  const toTyped = section => {
+    const out = { ...section };
+    COLUMNS.forEach(key => { out[key] = Int32Array.from(section[key]); });
+    return out;
+  };
+  const graph = toTyped(data);
+  graph.templates = {};
+  Object.entries(data.templates || {}).forEach(([name, t]) => { graph.templates[name] = toTyped(t); });
+  return graph;
+}
+
+// "PSSG", uint32 header length, JSON header, then int32 columns per section
+function decodeBinaryGraph(buffer) {
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== 'PSSG') throw new Error('Not a binary graph');
+  const headerLength = new DataView(buffer).getUint32(4, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+  let offset = 8 + headerLength;
+  const readSection = meta => {
+    const section = { ...meta };
+    header.columns.forEach((key, i) => {
+      section[key] = new Int32Array(buffer, offset, meta.lengths[i]);
+      offset += 4 * meta.lengths[i];
+    });
+    return section;
+  };
+  const graph = readSection(header);
+  graph.templates = {};
+  Object.entries(header.templates).forEach(([name, meta]) => { graph.templates[name] = readSection(meta); });
+  return graph;
+}
+
+// Node objects and [from, to] id edges of one decoded section
+function sectionToRows(section, names, types) {
+  const { id, name, type, gx, gy, bbox, bbox_nodes, instance_nodes, instance_template,
+          repeat_nodes, repeat_times } = section;
+  const rowNodes = new Array(id.length);
+  for (let i = 0; i < id.length; i++) {
+    rowNodes[i] = { id: id[i], name: names[name[i]], type: types[type[i]], gx: gx[i], gy: gy[i] };
+  }
+  for (let k = 0; k < bbox_nodes.length; k++) {
+    rowNodes[bbox_nodes[k]].bbox = [bbox[4 * k], bbox[4 * k + 1], bbox[4 * k + 2], bbox[4 * k + 3]];
+  }
+  for (let k = 0; k < instance_nodes.length; k++) {
+    rowNodes[instance_nodes[k]].template = names[instance_template[k]];
+  }
+  for (let k = 0; k < repeat_nodes.length; k++) {
+    rowNodes[repeat_nodes[k]].times = repeat_times[k];
+  }
+  const rowEdges = new Array(section.edges.length / 2);
+  for (let k = 0; k < rowEdges.length; k++) {
+    rowEdges[k] = [id[section.edges[2 * k]], id[section.edges[2 * k + 1]]];
+  }
+  const rows = { nodes: rowNodes, edges: rowEdges };
+  if ('entry' in section) {
+    rows.entry = id[section.entry];
+    rows.exit = id[section.exit];
+    rows.height = section.height;
+  }
+  return rows;
+}
+
+// ---------- Node rows ----------
+
+// Expand "actioninstance" nodes into positioned copies of their template.
+// Copies get path ids ("<instance id>.<template node id>"); edges into an
+// instance go to its template entry node and edges out of it leave from
+// its template exit node. resolveEntry/resolveExit map an id of the input
+// to the node such edges end up at.
+export function expandTemplates(graphNodes, graphEdges, templates) {
+  const outNodes = [];
+  const pendingEdges = [];
+  const entryOf = new Map();
+  const exitOf = new Map();
+  const jobs = [{ g: { nodes: graphNodes, edges: graphEdges || [] }, dx: 0, dy: 0, prefix: '' }];
+
+  while (jobs.length) {
+    const { g, dx, dy, prefix } = jobs.pop();
+    const fullId = id => prefix ? prefix + id : id;
+    g.nodes.forEach(n => {
+      const id = fullId(n.id);
+      const template = n.type === 'actioninstance' ? templates[n.template] : null;
+      if (template) {
+        const inner = id + '.';
+        entryOf.set(id, inner + template.entry);
+        exitOf.set(id, inner + template.exit);
+        jobs.push({ g: template, dx: dx + n.gx, dy: dy + n.gy, prefix: inner });
+        return;
+      }
+      const copy = { ...n, id, gx: n.gx + dx, gy: n.gy + dy };
+      if (n.bbox) {
+        const [min_gx, max_gx, min_gy, max_gy] = n.bbox;
+        copy.bbox = [min_gx + dx, max_gx + dx, min_gy + dy, max_gy + dy];
+      }
+      outNodes.push(copy);
+    });
+    g.edges.forEach(e => {
+      const [from, to] = Array.isArray(e) ? e : [e.from, e.to];
+      pendingEdges.push([fullId(from), fullId(to)]);
+    });
+  }
+
+  const resolve = (map, id) => {
+    while (map.has(id)) id = map.get(id);
+    return id;
+  };
+  const outEdges = pendingEdges.map(([from, to]) => ({ from: resolve(exitOf, from), to: resolve(entryOf, to) }));
+  return {
+    nodes: outNodes, edges: outEdges,
+    resolveEntry: id => resolve(entryOf, id), resolveExit: id => resolve(exitOf, id)
+  };
+}
+
+// Normalize edges to [{from,to}]
+function normalizeEdges(edges) {
+  return (Array.isArray(edges) ? edges : []).map(e => {
+    if (Array.isArray(e) && e.length >= 2) return { from: e[0], to: e[1] };
+    if ('from' in e && 'to' in e) return { from: e.from, to: e.to };
+    if ('source' in e && 'target' in e) return { from: e.source, to: e.target };
+    return null;
+  }).filter(Boolean);
+}
+
+// Node rows and {from, to} edges of one graph, packed for the renderer by pack()
+export class GraphState {
+  constructor(nodes = [], edges = [], extents = null, bodies = new Map()) {
+    this.nodes = nodes;
+    this.edges = edges;
+    this.extents = extents;  // [minGX, maxGX, minGY, maxGY] from the server layout, if any
+    // Unrolled repeat bodies by template name, shared with the bodies themselves;
+    // a body also has the ids of its entry and exit nodes and its height
+    this.bodies = bodies;
+    this.entry = this.exit = this.height = null;
+  }
+
+  // From a server graph: rows ({nodes, edges, templates, extents}), columnar JSON or binary ArrayBuffer
+  static from(data) {
+    if (data instanceof ArrayBuffer || (data && data.format === 'columnar')) {
+      const graph = decodeGraph(data);
+      if (!Object.keys(graph.templates).length) return new ColumnarGraphState(graph, graph.extents);
+      const rows = sectionToRows(graph, graph.names, graph.types);
+      const names = Object.keys(graph.templates);
+      const templates = names.length ? {} : null;
+      names.forEach(name => { templates[name] = sectionToRows(graph.templates[name], graph.names, graph.types); });
+      return GraphState.fromRows(rows.nodes, rows.edges, templates, graph.extents);
+    }
+    data = data || {};
+    return GraphState.fromRows(data.nodes, data.edges, data.templates, data.extents);
+  }
+
+  static fromRows(nodes, edges, templates = null, extents = null) {
+    nodes = Array.isArray(nodes) ? nodes : [];
+    // Shared-subtree graphs: place each template copy at its instance position
+    if (templates) ({ nodes, edges } = expandTemplates(nodes, edges, templates));
+    const state = new GraphState(nodes, normalizeEdges(edges), extents || null);
+    if (templates) state.addBodies(templates);
+    return state;
+  }
+
+  // Builds the body of every "repeatiterations" node, in this graph and in
+  // the bodies, once from its template; iterations are not copied but drawn
+  // from the body (see pack)
+  addBodies(templates) {
+    const pending = [this];
+    while (pending.length) {
+      pending.pop().nodes.forEach(n => {
+        const t = n.type === 'repeatiterations' ? templates[n.template] : null;
+        if (!t || this.bodies.has(n.template)) return;
+        const inner = expandTemplates(t.nodes, t.edges, templates);
+        const body = new GraphState(inner.nodes, normalizeEdges(inner.edges), null, this.bodies);
+        body.entry = inner.resolveEntry(t.entry);
+        body.exit = inner.resolveExit(t.exit);
+        body.height = t.height;
+        this.bodies.set(n.template, body);
+        pending.push(body);
+      });
+    }
+  }
+
+  // This graph with placeholder expand.id replaced by its subtree, laid out
+  // at the template origin: expanding the placeholder against a one-template
+  // map shifts the subtree into place and leaves nested placeholders collapsed.
+  // A placeholder in an unrolled repeat, "<iterations id>.<k>.<id in body>",
+  // is replaced in the shared body and so in every iteration; the result
+  // gets its own copy of the bodies map.
+  splice(expand, subNodes, subEdges, bodies = new Map(this.bodies)) {
+    const id = String(expand.id);
+    const index = this.nodes.findIndex(n => String(n.id) === id);
+    if (index < 0) {
+      const node = this.nodes.find(n => n.type === 'repeatiterations' && id.startsWith(`${n.id}.`));
+      const body = node && bodies.get(node.template);
+      if (!body) return this;
+      const inner = id.slice(`${node.id}.`.length).replace(/^\d+\./, '');
+      const spliced = body.splice({ ...expand, id: inner }, subNodes, subEdges, bodies);
+      if (spliced === body) return this;
+      bodies.set(node.template, spliced);
+      return this.withGraph(this.nodes, this.edges, bodies);
+    }
+    const placeholder = this.nodes[index];
+    const template = { nodes: subNodes, edges: subEdges, entry: expand.entry, exit: expand.exit };
+    const inner = expandTemplates([placeholder], [], { [placeholder.template]: template });
+
+    const prefix = placeholder.id + '.';
+    const entry = prefix + expand.entry;
+    const exit = prefix + expand.exit;
+    const nodes = this.nodes.slice(0, index).concat(inner.nodes, this.nodes.slice(index + 1));
+    const edges = this.edges.map(e => ({
+      from: e.from === placeholder.id ? exit : e.from,
+      to: e.to === placeholder.id ? entry : e.to
+    })).concat(normalizeEdges(inner.edges));
+    const state = this.withGraph(nodes, edges, bodies);
+    if (state.entry === placeholder.id) state.entry = entry;
+    if (state.exit === placeholder.id) state.exit = exit;
+    return state;
+  }
+
+  // Same extents, body entry/exit and height, other nodes, edges and bodies map
+  withGraph(nodes, edges, bodies) {
+    const state = new GraphState(nodes, edges, this.extents, bodies);
+    state.entry = this.entry;
+    state.exit = this.exit;
+    state.height = this.height;
+    return state;
+  }
+
+  // Typed-array form of the graph for the renderer, and the buffers to transfer:
+  // per node its id, interned name/type/template, position, bbox and flags;
+  // edges as [from, to] node indices; extents; the spatial grid (see buildTiles);
+  // unrolled repeats and, in `bodies`, their packed bodies, each packed once
+  pack() {
+    const ctx = { byName: this.bodies, bodies: [], bodyIndex: new Map(), transfer: [] };
+    const graph = this.packSection(ctx);
+    graph.bodies = ctx.bodies;
+    return { graph, transfer: ctx.transfer };
+  }
+
+  // A body also gets the rows of its entry and exit nodes and its height as "step".
+  // Unrolled repeats: the iterations node is hidden and edges into and out
+  // of it attach to hidden anchors at the first iteration's entry and the
+  // last iteration's exit; `repeats` lists {node, body, times} for the
+  // renderer, which draws iteration k as the body shifted by k * step.
+  packSection(ctx) {
+    let { nodes, edges } = this;
+    const repeats = [];
+    const hidden = new Set();
+    const anchors = new Map();  // iterations id -> [entry anchor id, exit anchor id]
+    const extra = [];
+    nodes.forEach(node => {
+      const body = node.type === 'repeatiterations' ? ctx.byName.get(node.template) : null;
+      if (!body) return;
+      let b = ctx.bodyIndex.get(node.template);
+      if (b === undefined) {
+        b = ctx.bodies.length;
+        ctx.bodyIndex.set(node.template, b);
+        ctx.bodies.push(null);
+        ctx.bodies[b] = body.packSection(ctx);
+      }
+      const p = ctx.bodies[b];
+      const last = node.times - 1;
+      const entry = { id: `${node.id}.0.${p.ids[p.entry]}`, type: node.type,
+                      gx: node.gx + p.gx[p.entry], gy: node.gy + p.gy[p.entry] };
+      const exit = { id: `${node.id}.${last}.${p.ids[p.exit]}`, type: node.type,
+                     gx: node.gx + p.gx[p.exit], gy: node.gy + last * p.step + p.gy[p.exit] };
+      extra.push(entry, exit);
+      [node.id, entry.id, exit.id].forEach(id => hidden.add(id));
+      anchors.set(node.id, [entry.id, exit.id]);
+      repeats.push({ node: node.id, body: b, times: node.times });
+    });
+    if (extra.length) {
+      nodes = nodes.concat(extra);
+      edges = edges.map(e => ({
+        from: anchors.has(e.from) ? anchors.get(e.from)[1] : e.from,
+        to: anchors.has(e.to) ? anchors.get(e.to)[0] : e.to
+      }));
+    }
+    const n = nodes.length;
+    const names = [], types = [];
+    const nameIndex = new Map(), typeIndex = new Map();
+    const intern = (table, index, s) => {
+      let k = index.get(s);
+      if (k === undefined) {
+        k = table.length;
+        table.push(s);
+        index.set(s, k);
+      }
+      return k;
+    };
+    const ids = new Array(n);
+    const byId = new Map();
+    const name = new Int32Array(n), type = new Int32Array(n), template = new Int32Array(n);
+    const gx = new Int32Array(n), gy = new Int32Array(n);
+    const bbox = new Int32Array(4 * n), flags = new Uint8Array(n);
+    nodes.forEach((node, i) => {
+      ids[i] = node.id;
+      byId.set(node.id, i);
+      name[i] = node.name == null ? -1 : intern(names, nameIndex, node.name);
+      type[i] = intern(types, typeIndex, node.type);
+      template[i] = node.template == null ? -1 : intern(names, nameIndex, node.template);
+      gx[i] = node.gx;
+      gy[i] = node.gy;
+      if (node.bbox) bbox.set(node.bbox, 4 * i);
+      flags[i] = nodeFlags(node.type, node.name, !!node.bbox, hidden.has(node.id));
+    });
+
+    const pairs = new Int32Array(2 * edges.length);
+    let m = 0;
+    edges.forEach(e => {
+      const from = byId.get(e.from);
+      const to = byId.get(e.to);
+      if (from === undefined || to === undefined) return;
+      pairs[m++] = from;
+      pairs[m++] = to;
+    });
+
+    const graph = finishPacked(ctx, {
+      count: n, ids, names, types, name, type, template, gx, gy, bbox, flags,
+      edges: pairs.slice(0, m),
+      missingEdges: edges.length - m / 2,
+      repeats: repeats.map(r => ({ ...r, node: byId.get(r.node) }))
+    }, this.extents);
+    if (this.entry != null) {
+      graph.entry = byId.get(this.entry);
+      graph.exit = byId.get(this.exit);
+      graph.step = this.height;
+    }
+    return graph;
+  }
+}
+
+// A decoded columnar graph without templates: packed straight from its
+// columns, whose names and types are already interned and whose edges
+// already use rows. Node rows are only built if a splice needs them.
+class ColumnarGraphState extends GraphState {
+  constructor(section, extents = null) {
+    super(null, null, extents);
+    this.section = section;
+  }
+
+  get nodes() {
+    if (this._nodes === null) this.toRows();
+    return this._nodes;
+  }
+
+  set nodes(nodes) { this._nodes = nodes; }
+
+  get edges() {
+    if (this._edges === null) this.toRows();
+    return this._edges;
+  }
+
+  set edges(edges) { this._edges = edges; }
+
+  toRows() {
+    const { names, types } = this.section;
+    const rows = sectionToRows(this.section, names, types);
+    this._nodes = rows.nodes;
+    this._edges = normalizeEdges(rows.edges);
+  }
+
+  packSection(ctx) {
+    const { id, names, types, bbox_nodes, instance_nodes, instance_template } = this.section;
+    const n = id.length;
+    // Copies: binary columns are views on one response buffer, which cannot be transferred per column
+    const name = this.section.name.slice(), type = this.section.type.slice();
+    const gx = this.section.gx.slice(), gy = this.section.gy.slice();
+    const template = new Int32Array(n).fill(-1);
+    instance_nodes.forEach((row, k) => { template[row] = instance_template[k]; });
+    const bbox = new Int32Array(4 * n), hasBbox = new Uint8Array(n);
+    bbox_nodes.forEach((row, k) => {
+      bbox.set(this.section.bbox.subarray(4 * k, 4 * k + 4), 4 * row);
+      hasBbox[row] = 1;
+    });
+    const flags = new Uint8Array(n);
+    for (let i = 0; i < n; i++) flags[i] = nodeFlags(types[type[i]], names[name[i]], hasBbox[i], false);
+    return finishPacked(ctx, {
+      count: n, ids: Array.from(id), names, types, name, type, template, gx, gy, bbox, flags,
+      edges: this.section.edges.slice(), missingEdges: 0, repeats: []
+    }, this.extents);
+  }
+}
+
+// Renderer flags of one node
+function nodeFlags(type, name, hasBbox, hidden) {
+  let flags = hidden || (type === "sequence" && (name === "start" || name === "end")) ? HIDDEN : 0;
+  if (hasBbox) {
+    flags |= HAS_BBOX;
+    if (BBOX_TYPES.includes(type) && !(flags & HIDDEN)) flags |= DRAWN_BBOX;
+    if (HIT_BBOX_TYPES.includes(type)) flags |= HIT_BBOX;
+  }
+  return flags;
+}
+
+// Adds the extents and the spatial grid to a packed section and queues its arrays for transfer
+function finishPacked(ctx, graph, extents) {
+  const { gx, gy, bbox, flags, edges } = graph;
+  // Prefer the extents computed during layout over rescanning every node
+  if (!extents && graph.count) {
+    extents = [Infinity, -Infinity, Infinity, -Infinity];
+    for (let i = 0; i < graph.count; i++) {
+      extents[0] = Math.min(extents[0], gx[i]);
+      extents[1] = Math.max(extents[1], gx[i]);
+      extents[2] = Math.min(extents[2], gy[i]);
+      extents[3] = Math.max(extents[3], gy[i]);
+    }
+  }
+  graph.extents = extents || null;
+  const tiles = graph.tiles = buildTiles(gx, gy, bbox, flags, edges);
+  const arrays = [graph.name, graph.type, graph.template, gx, gy, bbox, flags, edges,
+                  tiles.keys, tiles.nodeStart, tiles.nodes, tiles.edgeStart, tiles.edges,
+                  tiles.boxStart, tiles.boxes, tiles.hitStart, tiles.hits,
+                  tiles.longEdges, tiles.longBoxes];
+  arrays.forEach(a => ctx.transfer.push(a.buffer));
+  return graph;
+}
+
+// Sparse grid of TILE x TILE cell tiles in CSR form: sorted tile keys and,
+// per tile, the nodes centred in it, the edges whose bounding rect
+// overlaps it, the drawn bboxes whose border crosses it and the hit-tested
+// bboxes whose area overlaps it. Edges and hit-tested bboxes spanning more
+// than LONG_EDGE_TILES tiles go to longEdges and longBoxes instead.
+function buildTiles(gx, gy, bbox, flags, edges) {
+  const tiles = new Map();
+  const tile = (tx, ty) => {
+    const key = tileKey(tx, ty);
+    let t = tiles.get(key);
+    if (!t) {
+      t = { nodes: [], edges: [], boxes: [], hits: [] };
+      tiles.set(key, t);
+    }
+    return t;
+  };
+
+  for (let i = 0; i < gx.length; i++) tile(tileOf(gx[i]), tileOf(gy[i])).nodes.push(i);
+
+  const longEdges = [];
+  for (let k = 0; k < edges.length / 2; k++) {
+    const a = edges[2 * k], b = edges[2 * k + 1];
+    const tx0 = tileOf(Math.min(gx[a], gx[b])), tx1 = tileOf(Math.max(gx[a], gx[b]));
+    const ty0 = tileOf(Math.min(gy[a], gy[b])), ty1 = tileOf(Math.max(gy[a], gy[b]));
+    if ((tx1 - tx0 + 1) * (ty1 - ty0 + 1) > LONG_EDGE_TILES) {
+      longEdges.push(k);
+      continue;
+    }
+    for (let tx = tx0; tx <= tx1; tx++) {
+      for (let ty = ty0; ty <= ty1; ty++) tile(tx, ty).edges.push(k);
+    }
+  }
+
+  for (let i = 0; i < flags.length; i++) {
+    if (!(flags[i] & DRAWN_BBOX)) continue;
+    const tx0 = tileOf(bbox[4 * i]), tx1 = tileOf(bbox[4 * i + 1] + 1);
+    const ty0 = tileOf(bbox[4 * i + 2]), ty1 = tileOf(bbox[4 * i + 3] + 1);
+    for (let tx = tx0; tx <= tx1; tx++) {
+      tile(tx, ty0).boxes.push(i);
+      if (ty1 !== ty0) tile(tx, ty1).boxes.push(i);
+    }
+    for (let ty = ty0 + 1; ty < ty1; ty++) {
+      tile(tx0, ty).boxes.push(i);
+      if (tx1 !== tx0) tile(tx1, ty).boxes.push(i);
+    }
+  }
+
+  const longBoxes = [];
+  for (let i = 0; i < flags.length; i++) {
+    if (!(flags[i] & HIT_BBOX)) continue;
+    const tx0 = tileOf(bbox[4 * i]), tx1 = tileOf(bbox[4 * i + 1] + 1);
+    const ty0 = tileOf(bbox[4 * i + 2]), ty1 = tileOf(bbox[4 * i + 3] + 1);
+    if ((tx1 - tx0 + 1) * (ty1 - ty0 + 1) > LONG_EDGE_TILES) {
+      longBoxes.push(i);
+      continue;
+    }
+    for (let tx = tx0; tx <= tx1; tx++) {
+      for (let ty = ty0; ty <= ty1; ty++) tile(tx, ty).hits.push(i);
+    }
+  }
+
+  const keys = Float64Array.from(tiles.keys()).sort();
+  const flatten = field => {
+    const start = new Int32Array(keys.length + 1);
+    keys.forEach((key, t) => { start[t + 1] = start[t] + tiles.get(key)[field].length; });
+    const items = new Int32Array(start[keys.length]);
+    keys.forEach((key, t) => items.set(tiles.get(key)[field], start[t]));
+    return [start, items];
+  };
+  const [nodeStart, nodeItems] = flatten('nodes');
+  const [edgeStart, edgeItems] = flatten('edges');
+  const [boxStart, boxItems] = flatten('boxes');
+  const [hitStart, hitItems] = flatten('hits');
+  return {
+    keys, nodeStart, nodes: nodeItems, edgeStart, edges: edgeItems, boxStart, boxes: boxItems,
+    hitStart, hits: hitItems, longEdges: Int32Array.from(longEdges), longBoxes: Int32Array.from(longBoxes)
+  };
+}
+
+// Index of a tile key in the sorted keys, or -1
+export function findTile(keys, key) {
+  let lo = 0, hi = keys.length - 1;
+  while (lo <= hi) {
+    const mid = (lo + hi) >> 1;
+    if (keys[mid] === key) return mid;
+    if (keys[mid] < key) lo = mid + 1;
+    else hi = mid - 1;
+  }
+  return -1;
+}
+
+// ---------- Loader ----------
+
+// Runs the renderer's graph requests, in graph_worker.js or in the page when
+// workers are unavailable. A request's graph becomes the current one, which
+// later splices apply to, when the renderer shows it ("show").
+//   {op: "load", id, url, init, field, expand, graph}: the graph is msg.graph,
+//     or the response body of fetch(url, init), or its `field` member;
+//     with expand it is the /expand subtree of placeholder `expand`
+//   {op: "show", id}
+export class GraphLoader {
+  constructor() {
+    this.current = new GraphState();
+    this.loaded = new Map();  // request id -> GraphState not shown yet
+  }
+
+  async handle(msg) {
+    if (msg.op === 'show') {
+      const state = this.loaded.get(msg.id);
+      if (state) this.current = state;
+      // Older requests can no longer be shown
+      this.loaded.forEach((_, id) => { if (id <= msg.id) this.loaded.delete(id); });
+      return { reply: null, transfer: [] };
+    }
+    let status = 200;
+    let data = msg.graph;
+    if (msg.url) {
+      const resp = await fetch(msg.url, msg.init);
+      status = resp.status;
+      const contentType = resp.headers.get('Content-Type') || '';
+      data = contentType.includes('json') ? await resp.json() : await resp.arrayBuffer();
+    }
+    const reply = { id: msg.id, status, ok: status >= 200 && status < 300 };
+    if (status !== 200) return { reply: { ...reply, data }, transfer: [] };
+
+    let raw = data;
+    data = null;
+    if (msg.field) {
+      data = { ...raw };
+      delete data[msg.field];
+      raw = raw[msg.field];
+    }
+    const state = msg.expand != null
+      ? this.current.splice({ id: msg.expand, entry: raw.entry, exit: raw.exit }, raw.nodes || [], raw.edges || [])
+      : GraphState.from(raw);
+    this.loaded.set(msg.id, state);
+    const { graph, transfer } = state.pack();
+    graph.id = msg.id;
+    graph.expanded = msg.expand != null;
+    return { reply: { ...reply, data, graph }, transfer };
+  }
+}
@@ -0,0 +1,14 @@
+// static/js/graph_worker.js
+// Loads graphs for graph.js off the main thread (see graph_data.GraphLoader)
+import { GraphLoader } from "./graph_data.js";
+
+const loader = new GraphLoader();
+
+self.onmessage = async ({ data: msg }) => {
+  try {
+    const { reply, transfer } = await loader.handle(msg);
+    if (reply) self.postMessage(reply, transfer);
+  } catch (err) {
+    self.postMessage({ id: msg.id, error: String(err && err.message || err) });
+  }
+};
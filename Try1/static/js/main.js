@@ -1,5 +1,5 @@
 // static/js/main.js
-import { initGraph, updateGraph } from "./graph.js";
+import { initGraph, updateGraph, fetchGraph, showGraph, setExpandHandler } from "./graph.js";
 
 window.addEventListener("DOMContentLoaded", () => {
   const canvas = document.getElementById("graphCanvas");
@@ -7,6 +7,9 @@ window.addEventListener("DOMContentLoaded", () => {
 
   const textarea = document.getElementById("pssInput");
   const button = document.getElementById("showBtn");
+  // Draw repeat(n) as n iterations (one shared body on the server) instead of a loop
+  const unrollBox = document.getElementById("unrollRepeats");
+  const unroll = () => Boolean(unrollBox && unrollBox.checked);
   const galleryList = document.getElementById("galleryList");
   let selectedActionName = null;
 
@@ -119,22 +122,70 @@ action test {
 
 `;
 
-  async function fetchActions(pssText) {
-    const resp = await fetch("/actions", {
+  // Document id of the last rendered text; lets action switches skip re-uploading it
+  let currentDoc = null;
+
+  // POSTs request with the current document id instead of the text when there is one;
+  // the response is read by fetchGraph, with the graph in its `field` member
+  async function postDocument(url, request, pssText, field = null) {
+    const post = body => fetchGraph(url, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ text: pssText })
-    });
-    const data = await resp.json();
-    return data.actions || [];
+      body: JSON.stringify(body)
+    }, { field });
+    let result = currentDoc ? await post({ ...request, doc: currentDoc }) : null;
+    if (!result || result.status === 404) {
+      // No id yet, or the server no longer has it cached: send the text
+      result = await post({ ...request, text: pssText });
+    }
+    return result;
+  }
+
+  async function fetchRender(pssText, actionName = null) {
+    const request = { action: actionName, collapsed: true, unroll: unroll(), format: "columnar" };
+    const result = await postDocument("/render", request, pssText, "graph");
+    const data = { ...result.data, graph: result.graph };
+    currentDoc = data.doc || null;
+    return data;
+  }
+
+  // Identifies this page to /jobs: a new graph job cancels the previous one
+  const editorId = Math.random().toString(36).slice(2);
+
+  // Builds the graph in the server's worker pool and long-polls for it;
+  // null if the job was superseded by a newer one or failed
+  async function fetchGraphJob(pssText, actionName) {
+    const request = { action: actionName, collapsed: true, unroll: unroll(), format: "binary", editor: editorId };
+    const submitted = await postDocument("/jobs", request, pssText);
+    const job = submitted.data;
+    if (!submitted.ok) {
+      console.error("Graph job error", job.error);
+      return null;
+    }
+    currentDoc = job.doc || currentDoc;
+    for (;;) {
+      const result = await fetchGraph(`/jobs/${job.job}?wait=25`);
+      if (result.status === 202) continue;
+      if (result.status === 200) return result.graph;
+      if (result.data.state === "failed") console.error("Graph job failed", result.data.error);
+      return null;
+    }
   }
 
   async function renderFromText(selectedName = null) {
     const pssText = textarea.value.trim();
     if (!pssText) return;
 
-    // Fetch actions for gallery
-    const actions = await fetchActions(pssText);
+    // One request parses the text and returns the gallery and the default graph
+    currentDoc = null;
+    let data;
+    try {
+      data = await fetchRender(pssText, selectedName);
+    } catch (err) {
+      console.error("Graph parsing error", err);
+      return;
+    }
+    const actions = data.actions || [];
     galleryList.innerHTML = "";
     actions.forEach(act => {
       const tr = document.createElement("tr");
@@ -152,17 +203,11 @@ action test {
       galleryList.appendChild(tr);
     });
 
-    // By default, show "test" action if present, else first compound action
-    let defaultAction = "test";
-    if (!actions.some(a => a.name === "test")) {
-      const firstCompound = actions.find(a => a.type !== "atomic");
-      if (firstCompound) defaultAction = firstCompound.name;
-      else defaultAction = actions.length ? actions[0].name : null;
-    }
-    if (selectedName) defaultAction = selectedName;
+    // The server picked the requested action, else "test", else the first one
+    const defaultAction = data.action;
     selectedActionName = defaultAction;
-    if (defaultAction) {
-      renderGraphForAction(defaultAction, actions.find(a => a.name === defaultAction)?.type);
+    if (defaultAction && data.graph) {
+      showGraph(data.graph);
       // Highlight selected row
       Array.from(galleryList.children).forEach(row => {
         row.classList.toggle("selected", row.firstChild.textContent === defaultAction);
@@ -178,22 +223,30 @@ action test {
       return;
     }
     try {
-      const resp = await fetch("/parse", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ text: pssText, action: actionName })
-      });
-      const data = await resp.json();
-      let nodes = data.nodes || [];
-      let edges = data.edges || [];
-      edges = edges.map(([from, to]) => ({ from, to }));
-      updateGraph(nodes, edges);
+      const graph = await fetchGraphJob(pssText, actionName);
+      if (graph && selectedActionName === actionName) showGraph(graph);
     } catch (err) {
       console.error("Graph parsing error", err);
     }
   }
 
+  // Fetch the subtree behind a double-clicked placeholder and splice it in
+  setExpandHandler(async node => {
+    if (!currentDoc) return;
+    try {
+      const result = await fetchGraph("/expand", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ doc: currentDoc, action: selectedActionName, unroll: unroll(), id: node.id })
+      }, { expand: node.id });
+      if (result.status === 200) showGraph(result.graph);
+    } catch (err) {
+      console.error("Expand error", err);
+    }
+  });
+
   button.addEventListener("click", () => renderFromText());
+  if (unrollBox) unrollBox.addEventListener("change", () => renderFromText(selectedActionName));
 
   // render default graph and gallery
   renderFromText();
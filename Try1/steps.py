@@ -0,0 +1,23 @@
+# steps.py
+
+
+def run_steps(steps):
+    """
+    Runs a generator-based recursive computation with an explicit stack.
+    A step generator yields another step generator for each sub-computation
+    and is sent back that generator's return value, so nesting depth is
+    limited by memory instead of the interpreter's recursion limit.
+    Returns the return value of the outermost generator.
+    """
+    stack = [steps]
+    value = None
+    while stack:
+        try:
+            sub = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            value = stop.value
+        else:
+            stack.append(sub)
+            value = None
+    return value
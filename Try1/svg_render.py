@@ -0,0 +1,65 @@
+# svg_render.py
+"""
+Pure-Python SVG rendering of a laid-out graph, drawn like the pygame viewer
+(visualization.draw_region at zoom 1): grid lines, edges, compound action
+bboxes and node boxes with their captions. Needs no pygame or display.
+"""
+from xml.sax.saxutils import escape
+from nodes import CompoundAction
+from graph_style import node_style, GRID_COLOR, EDGE_COLOR, BBOX_COLOR, LABEL_COLOR
+
+
+def _rgb(color):
+    return "#%02x%02x%02x" % color
+
+
+def render_svg(nodes, edges, bounds, cell_size, margin):
+    """SVG document (text) of nodes and edges inside bounds (min_gx, max_gx, min_gy, max_gy)."""
+    min_gx, max_gx, min_gy, max_gy = bounds
+    w_cells = max_gx - min_gx + 1
+    h_cells = max_gy - min_gy + 1
+    width = 2 * margin + w_cells * cell_size
+    height = 2 * margin + h_cells * cell_size
+    node_size = int(cell_size * 0.5)
+    font_size = max(18, node_size)
+
+    def center(node):
+        return (margin + (node.gx - min_gx) * cell_size + cell_size / 2,
+                margin + (node.gy - min_gy) * cell_size + cell_size / 2)
+
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}">',
+        f'<rect width="{width}" height="{height}" fill="#ffffff"/>',
+    ]
+    # Grid as one path
+    grid = [f"M{margin + i * cell_size} {margin}v{h_cells * cell_size}" for i in range(w_cells + 1)]
+    grid += [f"M{margin} {margin + i * cell_size}h{w_cells * cell_size}" for i in range(h_cells + 1)]
+    out.append(f'<path d="{"".join(grid)}" stroke="{_rgb(GRID_COLOR)}" fill="none"/>')
+
+    lines = []
+    for start, end in edges:
+        (x1, y1), (x2, y2) = center(start), center(end)
+        lines.append(f"M{x1:g} {y1:g}L{x2:g} {y2:g}")
+    if lines:
+        out.append(f'<path d="{"".join(lines)}" stroke="{_rgb(EDGE_COLOR)}" stroke-width="2" fill="none"/>')
+
+    out.append(f'<g font-family="sans-serif" font-weight="bold" font-size="{font_size * 0.75:g}" '
+               f'text-anchor="middle" dominant-baseline="central" fill="{_rgb(LABEL_COLOR)}">')
+    for node in nodes:
+        if isinstance(node, CompoundAction) and node.bbox:
+            bx0, bx1, by0, by1 = node.bbox
+            # 3px border inside the box, as pygame.draw.rect draws it
+            x = margin + (bx0 - min_gx) * cell_size + 1.5
+            y = margin + (by0 - min_gy) * cell_size + 1.5
+            out.append(f'<rect x="{x:g}" y="{y:g}" width="{(bx1 - bx0 + 1) * cell_size - 3}" '
+                       f'height="{(by1 - by0 + 1) * cell_size - 3}" fill="none" '
+                       f'stroke="{_rgb(BBOX_COLOR)}" stroke-width="3"/>')
+        color, caption = node_style(node)
+        cx, cy = center(node)
+        out.append(f'<rect x="{cx - node_size / 2:g}" y="{cy - node_size / 2:g}" '
+                   f'width="{node_size}" height="{node_size}" fill="{_rgb(color)}"/>')
+        out.append(f'<text x="{cx:g}" y="{cy:g}">{escape(caption)}</text>')
+    out.append("</g>")
+    out.append("</svg>")
+    return "\n".join(out)
@@ -1,6 +1,30 @@
 # ---- visualization.py ----
 import pygame
-from nodes import Node, Atomic, Start, End, ForkNode, Parallel, Select, Repeat, Merge, Sequence, CompoundAction
+from nodes import CompoundAction
+from graph_cache import LRUCache
+from graph_style import node_style, GRID_COLOR, EDGE_COLOR, BBOX_COLOR, LABEL_COLOR
+
+# Fonts by size and rendered captions by (caption, size), shared by all frames
+FONT_CACHE_SIZES = 64
+LABEL_CACHE_ITEMS = 8192
+_fonts = LRUCache(FONT_CACHE_SIZES)
+_labels = LRUCache(LABEL_CACHE_ITEMS)
+
+# Largest static layer (see render_static_layer), in pixels
+MAX_LAYER_PIXELS = 16 * 1024 * 1024
+
+# GridIndex buckets are GRID_INDEX_CELLS x GRID_INDEX_CELLS layout cells
+GRID_INDEX_CELLS = 8
+LONG_EDGE_BUCKETS = 8
+
+def get_font(size):
+    if not pygame.font.get_init():
+        pygame.font.init()
+    return _fonts.get_or_create(size, lambda: pygame.font.SysFont(None, size, bold=True))
+
+def render_label(caption, size):
+    """Text surface of a caption, rendered once per (caption, size)."""
+    return _labels.get_or_create((caption, size), lambda: get_font(size).render(caption, True, LABEL_COLOR))
 
 def compute_bounds(nodes):
     xs = [n.gx for n in nodes]
@@ -34,7 +58,7 @@ def grid_to_screen(node, bounds, cell_size, margin, zoom):
     return sx, sy
 
 def draw_grid(screen, cell_size, margin, w_cells, h_cells):
-    color = (230, 230, 230)
+    color = GRID_COLOR
     
     # vertical lines
     for i in range(w_cells + 1):
@@ -46,59 +70,27 @@ def draw_grid(screen, cell_size, margin, w_cells, h_cells):
         y = margin + i * cell_size
         pygame.draw.line(screen, color, (margin, y), (margin + w_cells * cell_size, y))
 
-def draw_node(screen, node, bounds, cell_size, margin, zoom):
-    pygame.font.init()  # Ensure font module is initialized
-
+def draw_node(screen, node, bounds, cell_size, margin, zoom, offset=(0, 0)):
+    ox, oy = offset
     sx, sy = grid_to_screen(node, bounds, cell_size, margin, zoom)
+    sx, sy = sx + ox, sy + oy
     NODE_SIZE = int(cell_size * zoom * 0.5)
     rect = pygame.Rect(0, 0, NODE_SIZE, NODE_SIZE)
     rect.center = (sx, sy)
 
-    # color and caption
-    if isinstance(node, Start):
-        color = (200, 255, 255)
-        caption = f"St[{node.id}]"
-    elif isinstance(node, End):
-        color = (255, 200, 255)
-        caption = f"En[{node.id}]"
-    elif isinstance(node, Merge):
-        color = (200, 255, 200)
-        caption = f"M[{node.id}]"
-    elif isinstance(node, Parallel):
-        color = (255, 200, 200)
-        caption = f"P[{node.id}]"
-    elif isinstance(node, Select):
-        color = (255, 255, 150)
-        caption = f"S[{node.id}]"
-    elif isinstance(node, Repeat):
-        color = (180, 180, 255)
-        caption = f"R[{node.id}]"
-    elif isinstance(node, Sequence):
-        color = (220, 220, 255)
-        caption = f"Seq[{node.id}]"
-    elif isinstance(node, Atomic):
-        color = (200, 200, 255)
-        caption = f"{node.name}[{node.id}]"
-    elif isinstance(node, CompoundAction):
-        color = (255, 220, 120)
-        caption = f"Action[{node.name}][{node.id}]"
-        # Draw bounding box for the container
-        if node.bbox:
-            min_gx, max_gx, min_gy, max_gy = node.bbox
-            min_sx = margin + (min_gx - bounds[0]) * cell_size * zoom
-            min_sy = margin + (min_gy - bounds[2]) * cell_size * zoom
-            max_sx = margin + (max_gx - bounds[0]) * cell_size * zoom + cell_size * zoom
-            max_sy = margin + (max_gy - bounds[2]) * cell_size * zoom + cell_size * zoom
-            box_rect = pygame.Rect(min_sx, min_sy, max_sx - min_sx, max_sy - min_sy)
-            pygame.draw.rect(screen, (255, 220, 120), box_rect, 3)  # thick border for container
-    else:
-        color = (200, 200, 255)
-        caption = f"A[{node.id}]"
+    color, caption = node_style(node)
+    # Draw bounding box for the container
+    if isinstance(node, CompoundAction) and node.bbox:
+        min_gx, max_gx, min_gy, max_gy = node.bbox
+        min_sx = ox + margin + (min_gx - bounds[0]) * cell_size * zoom
+        min_sy = oy + margin + (min_gy - bounds[2]) * cell_size * zoom
+        max_sx = ox + margin + (max_gx - bounds[0]) * cell_size * zoom + cell_size * zoom
+        max_sy = oy + margin + (max_gy - bounds[2]) * cell_size * zoom + cell_size * zoom
+        box_rect = pygame.Rect(min_sx, min_sy, max_sx - min_sx, max_sy - min_sy)
+        pygame.draw.rect(screen, BBOX_COLOR, box_rect, 3)  # thick border for container
 
     pygame.draw.rect(screen, color, rect, 0)
-    font_size = max(18, NODE_SIZE)
-    font = pygame.font.SysFont(None, font_size, bold=True)
-    text = font.render(caption, True, (20, 20, 20))
+    text = render_label(caption, max(18, NODE_SIZE))
     text_rect = text.get_rect(center=rect.center)
     screen.blit(text, text_rect)
 
@@ -108,6 +100,162 @@ def draw_edges(screen, edges, cell_size, margin, bounds, zoom):
         x2, y2 = grid_to_screen(end, bounds, cell_size, margin, zoom)
         pygame.draw.aaline(screen, (60,60,60), (x1, y1), (x2, y2))  # anti-aliased, softer color
 
+class GridIndex:
+    """
+    Uniform grid over a laid-out graph in buckets of GRID_INDEX_CELLS x
+    GRID_INDEX_CELLS layout cells: nodes in the bucket of their position,
+    edges in the buckets of their bounding box (or in long_edges when that
+    spans more than LONG_EDGE_BUCKETS buckets), compound actions also in
+    the buckets along their bbox border.
+    """
+
+    def __init__(self, nodes, edges):
+        self.nodes = nodes
+        self.edges = edges
+        self.buckets = {}  # (bx, by) -> [node indices, edge indices]
+        self.long_edges = []
+        self._label_widths = {}  # font size -> widest caption, pixels
+        self._captions = None    # distinct captions, collected on first use
+        for i, node in enumerate(nodes):
+            self._bucket(node.gx // GRID_INDEX_CELLS, node.gy // GRID_INDEX_CELLS)[0].append(i)
+            if isinstance(node, CompoundAction) and node.bbox:
+                bx0, bx1, by0, by1 = (v // GRID_INDEX_CELLS for v in node.bbox)
+                for bx in range(bx0, bx1 + 1):
+                    for by in {by0, by1}:
+                        self._bucket(bx, by)[0].append(i)
+                for by in range(by0 + 1, by1):
+                    for bx in {bx0, bx1}:
+                        self._bucket(bx, by)[0].append(i)
+        for k, (start, end) in enumerate(edges):
+            bx0, bx1 = sorted((start.gx // GRID_INDEX_CELLS, end.gx // GRID_INDEX_CELLS))
+            by0, by1 = sorted((start.gy // GRID_INDEX_CELLS, end.gy // GRID_INDEX_CELLS))
+            if (bx1 - bx0 + 1) * (by1 - by0 + 1) > LONG_EDGE_BUCKETS:
+                self.long_edges.append(k)
+                continue
+            for bx in range(bx0, bx1 + 1):
+                for by in range(by0, by1 + 1):
+                    self._bucket(bx, by)[1].append(k)
+
+    def _bucket(self, bx, by):
+        bucket = self.buckets.get((bx, by))
+        if bucket is None:
+            bucket = self.buckets[bx, by] = [[], []]
+        return bucket
+
+    def query(self, min_gx, max_gx, min_gy, max_gy):
+        """(nodes, edges) that may be visible in the cell range, in graph order."""
+        node_ids, edge_ids = set(), set()
+        for bx in range(min_gx // GRID_INDEX_CELLS, max_gx // GRID_INDEX_CELLS + 1):
+            for by in range(min_gy // GRID_INDEX_CELLS, max_gy // GRID_INDEX_CELLS + 1):
+                bucket = self.buckets.get((bx, by))
+                if bucket:
+                    node_ids.update(bucket[0])
+                    edge_ids.update(bucket[1])
+        for k in self.long_edges:
+            start, end = self.edges[k]
+            if (max(start.gx, end.gx) >= min_gx and min(start.gx, end.gx) <= max_gx
+                    and max(start.gy, end.gy) >= min_gy and min(start.gy, end.gy) <= max_gy):
+                edge_ids.add(k)
+        return [self.nodes[i] for i in sorted(node_ids)], [self.edges[k] for k in sorted(edge_ids)]
+
+    def label_width(self, size):
+        """Width of the widest node caption at font size, measured without rendering."""
+        width = self._label_widths.get(size)
+        if width is None:
+            if self._captions is None:
+                self._captions = {node_style(node)[1] for node in self.nodes}
+            font = get_font(size)
+            width = self._label_widths[size] = max((font.size(c)[0] for c in self._captions), default=0)
+        return width
+
+    def node_at(self, gx, gy):
+        """The node laid out at cell (gx, gy), or None."""
+        bucket = self.buckets.get((gx // GRID_INDEX_CELLS, gy // GRID_INDEX_CELLS))
+        for i in bucket[0] if bucket else ():
+            node = self.nodes[i]
+            if node.gx == gx and node.gy == gy:
+                return node
+        return None
+
+def screen_to_grid(x, y, bounds, cell_size, margin, zoom, offset=(0, 0)):
+    """Cell under screen point (x, y) of a graph drawn shifted by offset pixels."""
+    step = cell_size * zoom
+    if step <= 0:  # cells of no size all sit at the first one
+        return bounds[0], bounds[2]
+    return (int((x - offset[0] - margin) // step) + bounds[0],
+            int((y - offset[1] - margin) // step) + bounds[2])
+
+def node_rect(node, bounds, cell_size, margin, zoom, offset=(0, 0)):
+    """Screen rect of a node's box, as draw_node draws it."""
+    size = int(cell_size * zoom * 0.5)
+    sx, sy = grid_to_screen(node, bounds, cell_size, margin, zoom)
+    rect = pygame.Rect(0, 0, size, size)
+    rect.center = (sx + offset[0], sy + offset[1])
+    return rect
+
+def draw_region(surface, index, rect, bounds, cell_size, margin, zoom, offset=(0, 0)):
+    """
+    Redraws the screen rect of a graph (a GridIndex) shown at zoom and
+    shifted by offset pixels: background, grid lines, and the edges and
+    nodes the index finds in the cells under rect.
+    """
+    min_gx, max_gx, min_gy, max_gy = bounds
+    step = cell_size * zoom
+    ox, oy = offset
+    clip = surface.get_clip()
+    surface.set_clip(rect)
+    surface.fill((255, 255, 255), rect)
+    if step <= 0:  # cells of no size: nothing but the background
+        surface.set_clip(clip)
+        return
+
+    # Grid lines of the cells under rect, within the graph extent
+    left, top = ox + margin, oy + margin
+    width = (max_gx - min_gx + 1) * step
+    height = (max_gy - min_gy + 1) * step
+    for i in range(max(0, int((rect.left - left) // step)),
+                   min(max_gx - min_gx + 1, int((rect.right - left) // step) + 1) + 1):
+        x = left + i * step
+        pygame.draw.line(surface, GRID_COLOR, (x, top), (x, top + height))
+    for i in range(max(0, int((rect.top - top) // step)),
+                   min(max_gy - min_gy + 1, int((rect.bottom - top) // step) + 1) + 1):
+        y = top + i * step
+        pygame.draw.line(surface, GRID_COLOR, (left, y), (left + width, y))
+
+    # Padding for node boxes, and captions wider than a cell, centred outside rect
+    gx0, gy0 = screen_to_grid(rect.left, rect.top, bounds, cell_size, margin, zoom, offset)
+    gx1, gy1 = screen_to_grid(rect.right, rect.bottom, bounds, cell_size, margin, zoom, offset)
+    pad = 1 + int(index.label_width(max(18, int(step * 0.5))) / 2 // step)
+    nodes, edges = index.query(gx0 - pad, gx1 + pad, gy0 - 1, gy1 + 1)
+
+    line_width = max(1, int(2 * zoom))
+    for start, end in edges:
+        x1, y1 = grid_to_screen(start, bounds, cell_size, margin, zoom)
+        x2, y2 = grid_to_screen(end, bounds, cell_size, margin, zoom)
+        pygame.draw.line(surface, EDGE_COLOR, (x1 + ox, y1 + oy), (x2 + ox, y2 + oy), line_width)
+    for node in nodes:
+        draw_node(surface, node, bounds, cell_size, margin, zoom, offset)
+    surface.set_clip(clip)
+
+def layer_size(bounds, cell_size, margin, zoom):
+    min_gx, max_gx, min_gy, max_gy = bounds
+    return (int(2 * margin + (max_gx - min_gx + 1) * cell_size * zoom) + 1,
+            int(2 * margin + (max_gy - min_gy + 1) * cell_size * zoom) + 1)
+
+def render_static_layer(index, bounds, cell_size, margin, zoom):
+    """
+    Off-screen surface of the whole graph (a GridIndex) at zoom, blitted at
+    the pan offset and rebuilt only when zoom changes; None if it would
+    exceed MAX_LAYER_PIXELS, in which case the caller uses draw_region.
+    """
+    width, height = layer_size(bounds, cell_size, margin, zoom)
+    if width * height > MAX_LAYER_PIXELS:
+        return None
+    layer = pygame.Surface((width, height)).convert()
+    layer.fill((255, 255, 255))
+    draw_region(layer, index, layer.get_rect(), bounds, cell_size, margin, zoom)
+    return layer
+
 def adjust_margin_for_zoom(mouse_x, mouse_y, bounds, cell_size, old_margin, old_zoom, new_zoom):
     min_x, _, min_y, _ = bounds
     # Find which grid cell mouse is pointing to